@@ -1,5 +1,5 @@
 import json
-from typing import Optional, Dict, Any, Union
+from typing import Optional, Dict, Any, List, Union
 from pathlib import Path
 from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings
@@ -17,6 +17,132 @@ class MongoDBSettings(BaseSettings):
     password: Optional[str] = Field(default=None)
 
 
+class TelemetrySettings(BaseSettings):
+    data_dir: str = Field(
+        default="data/telemetry",
+        description="Directory of the on-disk car data store"
+    )
+
+
+class EndpointCacheSettings(BaseSettings):
+    soft_ttl: float = Field(
+        default=10,
+        description="Seconds a cached response is served as fresh"
+    )
+    hard_ttl: float = Field(
+        default=120,
+        description="Seconds a cached response is still served while it is refreshed in the background"
+    )
+
+
+class CacheSettings(BaseSettings):
+    snapshot_path: str = Field(
+        default="data/cache_snapshot.bin",
+        description="File the in-process caches are snapshotted to"
+    )
+    snapshot_interval: int = Field(
+        default=60,
+        description="Seconds between two cache snapshots"
+    )
+    endpoints: Dict[str, EndpointCacheSettings] = Field(
+        default_factory=dict,
+        description="Stale-while-revalidate TTLs per OpenF1 endpoint while a session is live, keyed by endpoint name"
+    )
+    final_after: float = Field(
+        default=3600,
+        description="Seconds after a session's date_end from which its data is final and cached indefinitely"
+    )
+
+    def endpoint(self, name: str) -> EndpointCacheSettings:
+        return self.endpoints.get(name, EndpointCacheSettings())
+
+
+class StagesSettings(BaseSettings):
+    default_deadline: float = Field(
+        default=8.0,
+        description="Seconds from the start of a build until a stage is given up"
+    )
+    deadlines: Dict[str, float] = Field(
+        default_factory=lambda: {"traces": 30.0},   # First download of a session's car data is large
+        description="Per-stage deadlines overriding the default, keyed by stage name"
+    )
+
+
+class AdmissionSettings(BaseSettings):
+    max_builds: int = Field(default=8, description="Builds running at the same time")
+    max_renders: int = Field(default=1, description="Renders running at the same time")
+    max_per_user: int = Field(default=2, description="Requests in flight per user")
+    max_per_guild: int = Field(default=10, description="Requests in flight per guild")
+    queue_timeout: float = Field(default=10.0, description="Seconds to wait for a build slot before degrading")
+    stale_ttl: float = Field(default=600, description="Seconds the latest result of a request can be served when saturated")
+
+
+class RaceReplaySettings(BaseSettings):
+    workers: int = Field(default=2, description="Processes rendering replay frames")
+    max_frames: int = Field(default=80, description="Laps a single replay can cover")
+    frame_duration: int = Field(default=400, description="Milliseconds each lap is shown for")
+    max_upload_bytes: int = Field(default=8 * 1024 * 1024, description="Size an animation is scaled down to fit, below Discord's upload limit")
+    frame_cache_size: int = Field(default=1024, description="Rendered frames kept for reuse")
+
+
+class LoggingSettings(BaseSettings):
+    json_output: bool = Field(default=False, description="Write logs as JSON lines with request ids and stage timings")
+    sample_rate: int = Field(default=10, description="Keep one in this many hot-path INFO messages, 1 keeps all of them")
+    sampled_prefixes: List[str] = Field(
+        default_factory=lambda: ["Adding ", "Finished ", "Getting ", "Converting ", "Using cached "],
+        description="Start of the hot-path INFO messages that are sampled"
+    )
+
+
+class EncodingSettings(BaseSettings):
+    format: str = Field(default="png", description="Encoding of uploaded images: png (palette), webp (lossless) or png-rgb (full colour)")
+    colors: int = Field(default=256, description="Palette size of png images")
+    compress_level: int = Field(default=9, description="zlib compression level of png images")
+    webp_method: int = Field(default=4, description="Effort of the webp encoder, from 0 (fast) to 6 (small)")
+
+
+class ProfilingSettings(BaseSettings):
+    output_dir: str = Field(default="logs", description="Directory the collapsed-stack profiles are written to")
+    sample_interval: float = Field(default=0.005, description="Seconds between two stack samples of every thread")
+    max_seconds: float = Field(default=300, description="Longest a profile can run")
+    signal_seconds: float = Field(default=30, description="Seconds profiled on SIGUSR1")
+    lag_threshold: float = Field(default=0.2, description="Seconds the event loop can be blocked before the blocking task is logged")
+    lag_check_interval: float = Field(default=0.05, description="Seconds between two event loop heartbeats")
+
+
+class RaceControlSettings(BaseSettings):
+    poll_interval: float = Field(default=4.0, description="Seconds between two polls of a live session's race control messages and team radio")
+    scheduled_check_interval: float = Field(default=300, description="Longest sleep of a feed whose session hasn't started yet")
+    queue_size: int = Field(default=50, description="Messages waiting to be sent per channel, the oldest are dropped beyond it")
+    max_batch: int = Field(default=10, description="Messages combined into one Discord message")
+    send_interval: float = Field(default=1.2, description="Seconds between two Discord messages to the same channel")
+
+
+class ExportSettings(BaseSettings):
+    data_dir: str = Field(default="data/exports", description="Directory of the pre-built exports of finished sessions")
+    chunk_rows: int = Field(default=500, description="Rows generated and written at a time")
+    max_cached_files: int = Field(default=200, description="Pre-built exports kept, the least recently served are removed beyond it")
+    max_upload_bytes: int = Field(default=8 * 1024 * 1024, description="Largest export uploaded, below Discord's upload limit")
+
+
+class TrackMapSettings(BaseSettings):
+    width: int = Field(default=900, description="Width in pixels of the track map")
+    outline_tolerance: float = Field(default=20.0, description="Largest distance, in OpenF1 location units, the simplified circuit outline may stray from the traced lap")
+    stale_after: float = Field(default=30.0, description="Seconds a car's latest location can be behind the newest one before it is greyed out")
+
+
+class RepositoryCacheSettings(BaseSettings):
+    ttl: float = Field(default=3600, description="Seconds a query's models are kept, a safety net behind the invalidation on writes")
+    maxsize: int = Field(default=256, description="Queries kept per collection")
+    watch_retry_interval: float = Field(default=30, description="Seconds before the change stream is reopened after an error")
+
+
+class CompareSettings(BaseSettings):
+    max_sessions: int = Field(default=6, description="Sessions compared at once")
+    max_concurrent_fetches: int = Field(default=3, description="Fetch stages of one comparison running at the same time, the others wait for a slot")
+    deadline: float = Field(default=15.0, description="Seconds from the start of a comparison until a session's fetches are given up")
+
+
 class AppConfig(BaseSettings):
     openf1: OpenF1Settings = Field(
         default_factory=OpenF1Settings,
@@ -28,6 +154,71 @@ class AppConfig(BaseSettings):
         description="Settings for MongoDB connection"
     )
 
+    telemetry: TelemetrySettings = Field(
+        default_factory=TelemetrySettings,
+        description="Settings for the car telemetry store"
+    )
+
+    cache: CacheSettings = Field(
+        default_factory=CacheSettings,
+        description="Settings for the in-process cache snapshots"
+    )
+
+    stages: StagesSettings = Field(
+        default_factory=StagesSettings,
+        description="Settings for the data fetching stages of the builders"
+    )
+
+    admission: AdmissionSettings = Field(
+        default_factory=AdmissionSettings,
+        description="Settings for admission control of the interactions"
+    )
+
+    race_replay: RaceReplaySettings = Field(
+        default_factory=RaceReplaySettings,
+        description="Settings for the race replay animations"
+    )
+
+    logging: LoggingSettings = Field(
+        default_factory=LoggingSettings,
+        description="Settings for the log output"
+    )
+
+    encoding: EncodingSettings = Field(
+        default_factory=EncodingSettings,
+        description="Settings for encoding the uploaded images"
+    )
+
+    profiling: ProfilingSettings = Field(
+        default_factory=ProfilingSettings,
+        description="Settings for the profiler and the event loop lag monitor"
+    )
+
+    race_control: RaceControlSettings = Field(
+        default_factory=RaceControlSettings,
+        description="Settings for the race control feed"
+    )
+
+    export: ExportSettings = Field(
+        default_factory=ExportSettings,
+        description="Settings for the session data exports"
+    )
+
+    track_map: TrackMapSettings = Field(
+        default_factory=TrackMapSettings,
+        description="Settings for the track position maps"
+    )
+
+    compare: CompareSettings = Field(
+        default_factory=CompareSettings,
+        description="Settings for the cross-session comparisons"
+    )
+
+    repository_cache: RepositoryCacheSettings = Field(
+        default_factory=RepositoryCacheSettings,
+        description="Settings for the in-process cache of the MongoDB repositories"
+    )
+
     @classmethod
     def from_json(cls, file_path: Union[str, Path]) -> "AppConfig":
         file_path = Path(file_path)
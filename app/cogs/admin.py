@@ -0,0 +1,64 @@
+import discord
+from discord.ext import commands
+
+from app.services.profiling import profiler
+from app.exceptions import ProfilingError
+
+import logging
+logger = logging.getLogger(__name__)
+logger.info("Logging is configured.")
+
+
+class Admin(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    @discord.slash_command(name="profile", description="Profile the bot for a while (bot owner only)")
+    @discord.option(
+        name="seconds",
+        type=discord.SlashCommandOptionType.integer,
+        min_value=1,
+        max_value=300,
+        default=30
+    )
+    @discord.option(
+        name="interactions",
+        type=discord.SlashCommandOptionType.integer,
+        description="Stop after this many interactions have been rendered instead",
+        min_value=1,
+        required=False,
+        default=None
+    )
+    @commands.is_owner()
+    async def profile(
+        self,
+        ctx: discord.ApplicationContext,
+        seconds: discord.SlashCommandOptionType.integer,
+        interactions: discord.SlashCommandOptionType.integer
+    ):
+        logger.info(f"Profile command invoked by user [{ctx.interaction.user.id}|{ctx.interaction.user.name}]")
+        await ctx.defer(ephemeral=True)
+        try:
+            result = await profiler.run(None if interactions else seconds, interactions)
+        except ProfilingError as e:
+            await ctx.followup.send(f"{e}, please try it again later.", ephemeral=True)
+            return
+
+        top = "\n".join(f"- `{function}`: {count} samples" for function, count in result.top)
+        await ctx.followup.send(
+            f"Profiled {result.samples} samples over {result.duration:.0f} seconds and {result.interactions} interactions, saved to `{result.path}`.\n{top}",
+            file=discord.File(result.path),
+            ephemeral=True
+        )
+
+    async def cog_command_error(self, ctx: discord.ApplicationContext, error: Exception):
+        if isinstance(error, commands.NotOwner):
+            await ctx.respond("This command is only available to the bot owner.", ephemeral=True)
+        else:
+            logger.exception(error)
+            # Followed up when the command already deferred
+            await ctx.respond("An error occurred, please try it again.", ephemeral=True)
+
+
+def setup(bot): # this is called by Pycord to setup the cog
+    bot.add_cog(Admin(bot))
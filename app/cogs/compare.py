@@ -0,0 +1,89 @@
+import time
+from typing import List, Tuple
+
+import discord
+from discord.ext import commands
+
+from app.services import compare as cmp
+from app.services.admission import admission
+from app.cogs.helpers import get_stale_note, get_image_file
+from app.exceptions import OpenF1Error, AdmissionError, CompareError
+
+import logging
+logger = logging.getLogger(__name__)
+logger.info("Logging is configured.")
+
+
+class Compare(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    @discord.slash_command(name="compare", description="Compare a driver's laps across several sessions in one chart")
+    @discord.option(
+        name="driver",
+        type=discord.SlashCommandOptionType.string,
+        description="Driver acronym or number (e.g. VER)"
+    )
+    @discord.option(
+        name="sessions",
+        type=discord.SlashCommandOptionType.string,
+        description="Sessions separated by semicolons (e.g. 2025 Monza Q; 2025 Monza Race; 2024 Monza Race)"
+    )
+    async def compare(
+        self,
+        ctx: discord.ApplicationContext,
+        driver: discord.SlashCommandOptionType.string,
+        sessions: discord.SlashCommandOptionType.string
+    ):
+        logger.info(f"Compare command invoked by user [{ctx.interaction.user.id}|{ctx.interaction.user.name}]")
+        driver = driver.strip()
+        try:
+            targets = cmp.parse_targets(sessions)
+        except CompareError as e:
+            await ctx.respond(f"{e}. Please give sessions as `year location [session]`, separated by semicolons.")
+            return
+
+        # Nothing to select, so the comparison is sent right away
+        try:
+            await ctx.defer()
+            key = ("compare", driver.upper(), tuple((target.year, target.location.lower(), target.session_name) for target in targets))
+            admitted = await admission.run(
+                key, ctx.interaction.user.id, ctx.interaction.guild_id,
+                lambda: self.build(driver, targets), self.render
+            )
+            notes, image_payload = admitted.payload
+            message = "\n".join(line for line in (get_stale_note(admitted), notes) if line) or None
+            await ctx.followup.send(message, file=get_image_file(image_payload, "compare"))
+        except CompareError as e:
+            await ctx.followup.send(f"{e}. Please select other sessions.")
+        except AdmissionError as e:
+            await ctx.followup.send(f"The bot is busy right now, please try it again in a few seconds.")
+        except OpenF1Error as e:
+            await ctx.followup.send(f"OpenF1 API timed out, please try it again.")
+        except Exception as e:
+            logger.exception(e)
+            await ctx.followup.send(f"An error occurred, please try it again.")
+
+    @staticmethod
+    async def build(driver: str, targets: List[cmp.Target]) -> cmp.Comparison:
+        t0 = time.time()
+        # Copies, the builder resolves the locations in place
+        builder = cmp.ComparisonBuilder(driver, [target.model_copy() for target in targets])
+        await builder.run_stages()
+        comparison = builder.build()
+        logger.debug(f"Time taken to build comparison: {time.time() - t0} seconds")
+        return comparison
+
+    @staticmethod
+    def render(comparison: cmp.Comparison) -> Tuple[str, bytes]:
+        t0 = time.time()
+        image_bytes = comparison.to_image_bytes()
+        logger.debug(f"Time taken to convert to image bytes: {time.time() - t0} seconds")
+        notes = "\n".join(f"Left out: {note}" for note in comparison.notes)
+        payload = image_bytes.getvalue()
+        image_bytes.close()
+        return notes, payload
+
+
+def setup(bot): # this is called by Pycord to setup the cog
+    bot.add_cog(Compare(bot))
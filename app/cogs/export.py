@@ -0,0 +1,96 @@
+import os
+from pathlib import Path
+
+import discord
+from discord.ext import commands
+
+from app.app_config import AppConfig
+from app.services.openf1 import OpenF1
+from app.services.export import FORMATS, export_session, resolve_drivers
+from app.cogs.helpers import get_years, get_locations
+from app.exceptions import OpenF1Error, DatabaseError, ExportError
+
+import logging
+logger = logging.getLogger(__name__)
+logger.info("Logging is configured.")
+
+app_config_path = os.getenv("APP_CONFIG_PATH", f"{Path(__file__).parent.parent.parent.resolve()}/app_config.json")
+app_config = AppConfig.from_json(app_config_path)
+
+
+class Export(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    @discord.slash_command(name="export", description="Download the laps, sectors, stints and pit stops of a session")
+    @discord.option(
+        name="year",
+        type=discord.SlashCommandOptionType.integer,
+        choices=get_years()
+    )
+    @discord.option(
+        name="location",
+        type=discord.SlashCommandOptionType.string,
+        autocomplete=discord.utils.basic_autocomplete(get_locations)
+    )
+    @discord.option(
+        name="session_name",
+        type=discord.SlashCommandOptionType.string,
+        choices=["Practice 1", "Practice 2", "Practice 3", "Sprint Qualifying", "Qualifying", "Sprint", "Race"]
+    )
+    @discord.option(
+        name="drivers",
+        type=discord.SlashCommandOptionType.string,
+        description="Driver acronyms or numbers separated by commas (e.g. VER, HAM), all drivers by default",
+        required=False,
+        default=None
+    )
+    @discord.option(
+        name="format",
+        type=discord.SlashCommandOptionType.string,
+        choices=FORMATS,
+        default="csv"
+    )
+    async def export(
+        self,
+        ctx: discord.ApplicationContext,
+        year: discord.SlashCommandOptionType.integer,
+        location: discord.SlashCommandOptionType.string,
+        session_name: discord.SlashCommandOptionType.string,
+        drivers: discord.SlashCommandOptionType.string,
+        format: discord.SlashCommandOptionType.string
+    ):
+        logger.info(f"Export command invoked by user [{ctx.interaction.user.id}|{ctx.interaction.user.name}]")
+        await ctx.defer()
+        export_file = None
+        try:
+            session_key = await OpenF1.get_session_key(year, location, session_name)
+            if not session_key:
+                await ctx.followup.send(f"{year} {location} doesn't have {session_name} or {session_name} hasn't started yet. Please select another session.")
+                return
+            session_drivers = await OpenF1.get_drivers(year, location, session_name)
+            driver_numbers = resolve_drivers(session_drivers, drivers)
+            export_file = await export_session(session_key, session_drivers, driver_numbers, format)
+
+            if os.path.getsize(export_file.path) > app_config.export.max_upload_bytes:
+                await ctx.followup.send("The export is too large to upload, please select fewer drivers.")
+                return
+            filename = f"{year}_{location}_{session_name}_laps.{format}".replace(" ", "_")
+            await ctx.followup.send(
+                f"Laps of {year} {location} Grand Prix {session_name} session.",
+                file=discord.File(export_file.path, filename=filename)
+            )
+        except ExportError as e:
+            await ctx.followup.send(f"{e}, please check the drivers.")
+        except (OpenF1Error, DatabaseError) as e:
+            await ctx.followup.send(f"OpenF1 API timed out, please try it again.")
+        except Exception as e:
+            logger.exception(e)
+            await ctx.followup.send(f"An error occurred, please try it again.")
+        finally:
+            if export_file is not None and export_file.temporary:
+                os.remove(export_file.path)
+
+
+def setup(bot): # this is called by Pycord to setup the cog
+    bot.add_cog(Export(bot))
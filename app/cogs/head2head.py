@@ -1,14 +1,14 @@
-import asyncio
 import time
-from typing import List
+from typing import List, Tuple
 
 import discord
 from discord.ext import commands
 
-from app.cogs.helpers import get_years, get_locations, get_drivers_select_options
+from app.cogs.helpers import get_years, get_locations, get_drivers_select_options, get_stale_note, get_image_file
 from app.services import head2head as h2h
 from app.services.openf1 import OpenF1
-from app.exceptions import OpenF1Error
+from app.services.admission import admission
+from app.exceptions import OpenF1Error, AdmissionError
 
 import logging
 logger = logging.getLogger(__name__)
@@ -110,42 +110,47 @@ class Head2HeadView(discord.ui.View):
             logger.info(f"Start processing head-to-head comparison between {driver1} and {driver2} for {self.year} {self.location} Grand Prix for user [{interaction.user.id}|{interaction.user.name}]")
             
             await interaction.response.defer()
-            t0 = time.time()
-            builder = h2h.Head2HeadBuilder(self.year, self.location, self.session_name)
-            await builder.get_session_key()
-            tasks = [
-                builder.add_drivers(driver1, driver2),
-                builder.add_laps_and_sectors_time(driver1, driver2, num_of_laps),
-                builder.add_interval(driver1, driver2)
-            ]
-            
-            await asyncio.gather(*tasks)
-            head2head = builder.build()
-            t1 = time.time()
-            building_time = t1 - t0
-            logger.debug(f"Time taken to build head2head: {building_time} seconds")
-
-            t0 = time.time()
-            image_bytes = head2head.to_image_bytes()
-            t1 = time.time()
-            image_conversion_time = t1 - t0
-            logger.debug(f"Time taken to convert to image bytes: {image_conversion_time} seconds")
-            logger.debug(f"Total time: {building_time + image_conversion_time} seconds")
-
-            if head2head.current_interval > 0:
-                interval_message = f"{head2head.driver_names[1]}'s gap to {head2head.driver_names[0]}: {head2head.current_interval} seconds"
-            else:
-                interval_message = f"{head2head.driver_names[0]}'s gap to {head2head.driver_names[1]}: {-head2head.current_interval} seconds"
-            await interaction.followup.send(interval_message)
-            await interaction.followup.send(file=discord.File(image_bytes, filename="head2head.png"))
-            image_bytes.close()
+            key = ("h2h", self.year, self.location, self.session_name, driver1, driver2, num_of_laps)
+            admitted = await admission.run(
+                key, interaction.user.id, interaction.guild_id,
+                lambda: self.build(driver1, driver2, num_of_laps), self.render
+            )
+            interval_message, image_payload = admitted.payload
+            stale_note = get_stale_note(admitted)
+            await interaction.followup.send(f"{stale_note}\n{interval_message}" if stale_note else interval_message)
+            await interaction.followup.send(file=get_image_file(image_payload, "head2head"))
+        except AdmissionError as e:
+            await interaction.followup.send(f"The bot is busy right now, please try it again in a few seconds.")
         except OpenF1Error as e:
             await interaction.followup.send(f"OpenF1 API timed out, please try it again.")
         except Exception as e:
             logger.exception(e)
             await interaction.followup.send(f"An error occurred.")
-        
-        
+
+    async def build(self, driver1: int, driver2: int, num_of_laps: int) -> h2h.Head2Head:
+        t0 = time.time()
+        builder = h2h.Head2HeadBuilder(self.year, self.location, self.session_name)
+        await builder.run_stages(driver1, driver2, num_of_laps)
+        head2head = builder.build()
+        logger.debug(f"Time taken to build head2head: {time.time() - t0} seconds")
+        return head2head
+
+    @staticmethod
+    def render(head2head: h2h.Head2Head) -> Tuple[str, bytes]:
+        t0 = time.time()
+        image_bytes = head2head.to_image_bytes()
+        logger.debug(f"Time taken to convert to image bytes: {time.time() - t0} seconds")
+
+        if not isinstance(head2head.current_interval, (int, float)):
+            interval_message = f"The current gap between {head2head.driver_names[0]} and {head2head.driver_names[1]} is not available."
+        elif head2head.current_interval > 0:
+            interval_message = f"{head2head.driver_names[1]}'s gap to {head2head.driver_names[0]}: {head2head.current_interval} seconds"
+        else:
+            interval_message = f"{head2head.driver_names[0]}'s gap to {head2head.driver_names[1]}: {-head2head.current_interval} seconds"
+
+        payload = image_bytes.getvalue()
+        image_bytes.close()
+        return interval_message, payload
 
     """ async def select_driver_callback(self, select: discord.ui.Select, interaction: discord.Interaction):
         print(f"Selected values: {select.values}")
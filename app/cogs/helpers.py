@@ -1,8 +1,12 @@
+import time
 import discord
 import asyncio
-from async_lru import alru_cache
+from io import BytesIO
 
 from app.services.openf1 import OpenF1
+from app.services.cache import async_ttl_cache
+from app.services.admission import Admitted
+from app.services.encoding import image_extension, record_upload
 from app.exceptions import DatabaseError
 
 import logging
@@ -13,26 +17,28 @@ def get_years():
     year_choices = [2023, 2024, 2025]
     return year_choices
 
-@alru_cache(ttl=3600)
 async def get_locations(ctx: discord.AutocompleteContext):
-    year = ctx.options['year']
+    # The autocomplete context differs on every keystroke, so cache by year instead
+    return await get_location_choices(ctx.options['year'])
+
+@async_ttl_cache(ttl=3600)
+async def get_location_choices(year: int):
     locations = await OpenF1.get_grand_prix_locations(year)
     location_choices = [discord.OptionChoice(location.meeting_name, location.location) for location in locations]
     return location_choices
 
-@alru_cache(ttl=3600)
 async def get_drivers_choices(ctx: discord.AutocompleteContext):
-    year = ctx.options['year']
-    location = ctx.options['location']
-    session_name = ctx.options['session_name']
+    return await get_drivers_option_choices(ctx.options['year'], ctx.options['location'], ctx.options['session_name'])
 
+@async_ttl_cache(ttl=3600)
+async def get_drivers_option_choices(year: int, location: str, session_name: str):
     #session_key = await OpenF1.get_session_key(year, location, 'Race')
     drivers = await OpenF1.get_drivers(year, location, session_name)
     driver_choices = [discord.OptionChoice(driver.name_acronym, driver.driver_number) for driver in drivers]
 
     return driver_choices
 
-@alru_cache(ttl=3600)
+@async_ttl_cache(ttl=3600)
 async def get_drivers_select_options(year: int, location: str, session_name: str):
     #session_key = await OpenF1.get_session_key(year, location, 'Race')
     drivers = await OpenF1.get_drivers(year, location, session_name)
@@ -40,4 +46,12 @@ async def get_drivers_select_options(year: int, location: str, session_name: str
 
     return driver_options
 
-    
\ No newline at end of file
+def get_stale_note(admitted: Admitted):
+    if not admitted.stale:
+        return None
+    return f"The bot is busy right now, showing the result from {int(time.time() - admitted.rendered_at)} seconds ago."
+
+def get_image_file(payload: bytes, name: str) -> discord.File:
+    # Uploads are counted per renderer next to their encoding stats
+    record_upload(name, len(payload))
+    return discord.File(BytesIO(payload), filename=f"{name}.{image_extension()}")
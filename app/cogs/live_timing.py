@@ -1,13 +1,14 @@
-import asyncio
 import time
+from typing import Optional
 
 import discord
 from discord.ext import commands
 
 from app.services import live_timing as lt
 from app.services.openf1 import OpenF1
-from app.cogs.helpers import get_years, get_locations
-from app.exceptions import OpenF1Error
+from app.services.admission import admission
+from app.cogs.helpers import get_years, get_locations, get_stale_note, get_image_file
+from app.exceptions import OpenF1Error, AdmissionError, AsOfError
 
 import logging
 logger = logging.getLogger(__name__)
@@ -34,27 +35,37 @@ class LiveTiming(commands.Cog):
         type=discord.SlashCommandOptionType.string,
         choices=["Practice 1", "Practice 2", "Practice 3", "Sprint Qualifying", "Qualifying", "Sprint", "Race"]
     )
+    @discord.option(
+        name="as_of",
+        type=discord.SlashCommandOptionType.string,
+        description="Lap number (e.g. 20) or UTC time (e.g. 14:32:05) to show instead of the latest data",
+        required=False,
+        default=None
+    )
     async def live_timing(
         self,
         ctx: discord.ApplicationContext,
         year: discord.SlashCommandOptionType.integer,
         location: discord.SlashCommandOptionType.string,
-        session_name: discord.SlashCommandOptionType.string
+        session_name: discord.SlashCommandOptionType.string,
+        as_of: discord.SlashCommandOptionType.string
     ):
         logger.info(f"Live Timing command invoked by user [{ctx.interaction.user.id}|{ctx.interaction.user.name}]")
         session_key = await OpenF1.get_session_key(year, location, session_name)
         if not session_key:
             await ctx.respond(f"{year} {location} doesn't have {session_name} or {session_name} hasn't started yet. Please select another session.")
             return
-        await ctx.respond(f"Select the fields for the Live Timing for {year} {location} Grand Prix {session_name} session. Default: `[Driver Number, Position]`", view=LiveTimingView(year, location, session_name))
+        at = f" as of {as_of}" if as_of else ""
+        await ctx.respond(f"Select the fields for the Live Timing for {year} {location} Grand Prix {session_name} session{at}. Default: `[Driver Number, Position]`", view=LiveTimingView(year, location, session_name, as_of))
 
 
 class LiveTimingView(discord.ui.View):
-    def __init__(self, year: int, location: str, session_name: str):
+    def __init__(self, year: int, location: str, session_name: str, as_of: Optional[str] = None):
         super().__init__()
         self.year = year
         self.location = location
         self.session_name = session_name
+        self.as_of = as_of
         self.selected_values = []
     
     @discord.ui.select(
@@ -81,40 +92,37 @@ class LiveTimingView(discord.ui.View):
     async def button_callback(self, button: discord.ui.Button, interaction: discord.Interaction):
         try:
             logger.info(f"Start processing live timing for {self.year} {self.location} Grand Prix {self.session_name} session for user [{interaction.user.id}|{interaction.user.name}]")
-            logger.info(f"Selected fields: {self.selected_values}")
-            t0 = time.time()
+            logger.info(f"Selected fields: {self.selected_values}, as of: {self.as_of}")
             await interaction.response.defer()
-            builder = lt.LiveTimingBuilder(self.year, self.location, self.session_name)
-            await builder.get_session_key()
-            tasks = [
-                builder.add_drivers(),
-                builder.add_positions()
-            ]
-            if "Intervals" in self.selected_values:
-                tasks.append(builder.add_intervals())
-            if "Pit Stops" in self.selected_values:
-                tasks.append(builder.add_pit_stops())
-            if "Tyres" in self.selected_values:
-                tasks.append(builder.add_tyres())
-            
-            await asyncio.gather(*tasks)
-            live_timing = builder.build()
-            t1 = time.time()
-            building_time = t1 - t0
-            logger.debug(f"Time taken to build live_timing: {building_time} seconds")
-            t0 = time.time()
-            image_bytes = live_timing.to_image_bytes()
-            t1 = time.time()
-            image_conversion_time = t1 - t0
-            logger.debug(f"Time taken to convert to image bytes: {image_conversion_time} seconds")
-            logger.debug(f"Total time: {building_time + image_conversion_time} seconds")
-            await interaction.followup.send(file=discord.File(image_bytes, filename="live_timing.png"))
-            image_bytes.close()
+            key = ("live_timing", self.year, self.location, self.session_name, tuple(sorted(self.selected_values)), self.as_of)
+            admitted = await admission.run(key, interaction.user.id, interaction.guild_id, self.build, self.render)
+            await interaction.followup.send(get_stale_note(admitted), file=get_image_file(admitted.payload, "live_timing"))
+        except AdmissionError as e:
+            await interaction.followup.send(f"The bot is busy right now, please try it again in a few seconds.")
+        except AsOfError as e:
+            await interaction.followup.send(f"{e}, please select another lap or time.")
         except OpenF1Error as e:
             await interaction.followup.send(f"OpenF1 API timed out, please try it again.")
         except Exception as e:
             logger.exception(e)
             await interaction.followup.send(f"An error occurred, please try it again.")
 
+    async def build(self) -> lt.LiveTiming:
+        t0 = time.time()
+        builder = lt.LiveTimingBuilder(self.year, self.location, self.session_name, self.as_of)
+        await builder.run_stages(self.selected_values)
+        live_timing = builder.build()
+        logger.debug(f"Time taken to build live_timing: {time.time() - t0} seconds")
+        return live_timing
+
+    @staticmethod
+    def render(live_timing: lt.LiveTiming) -> bytes:
+        t0 = time.time()
+        image_bytes = live_timing.to_image_bytes()
+        logger.debug(f"Time taken to convert to image bytes: {time.time() - t0} seconds")
+        payload = image_bytes.getvalue()
+        image_bytes.close()
+        return payload
+
 def setup(bot): # this is called by Pycord to setup the cog
     bot.add_cog(LiveTiming(bot)) # add the cog to the bot
\ No newline at end of file
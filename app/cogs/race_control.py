@@ -0,0 +1,105 @@
+import discord
+from discord.ext import commands
+
+from app.services.openf1 import OpenF1, FINISHED
+from app.services.models import Subscription
+from app.services.race_control import feeds
+from app.cogs.helpers import get_years, get_locations
+from app.exceptions import OpenF1Error, DatabaseError
+
+import logging
+logger = logging.getLogger(__name__)
+logger.info("Logging is configured.")
+
+
+class RaceControl(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    race_control = discord.SlashCommandGroup(
+        "race-control",
+        "Flags, safety cars and penalties of a session posted to this channel",
+        default_member_permissions=discord.Permissions(manage_channels=True)
+    )
+
+    @race_control.command(name="subscribe", description="Post a session's race control messages to this channel")
+    @discord.option(
+        name="year",
+        type=discord.SlashCommandOptionType.integer,
+        choices=get_years()
+    )
+    @discord.option(
+        name="location",
+        type=discord.SlashCommandOptionType.string,
+        autocomplete=discord.utils.basic_autocomplete(get_locations)
+    )
+    @discord.option(
+        name="session_name",
+        type=discord.SlashCommandOptionType.string,
+        choices=["Practice 1", "Practice 2", "Practice 3", "Sprint Qualifying", "Qualifying", "Sprint", "Race"]
+    )
+    @discord.option(
+        name="team_radio",
+        type=discord.SlashCommandOptionType.boolean,
+        description="Also post links to the team radio recordings",
+        default=False
+    )
+    async def subscribe(
+        self,
+        ctx: discord.ApplicationContext,
+        year: discord.SlashCommandOptionType.integer,
+        location: discord.SlashCommandOptionType.string,
+        session_name: discord.SlashCommandOptionType.string,
+        team_radio: discord.SlashCommandOptionType.boolean
+    ):
+        logger.info(f"Race Control subscribe command invoked by user [{ctx.interaction.user.id}|{ctx.interaction.user.name}]")
+        if ctx.guild_id is None:
+            await ctx.respond("Race control messages can only be posted to server channels.", ephemeral=True)
+            return
+        if not ctx.app_permissions.send_messages:
+            await ctx.respond("The bot can't send messages in this channel, please add it to the server or allow it to send messages here.", ephemeral=True)
+            return
+        try:
+            session_key = await OpenF1.get_session_key(year, location, session_name)
+            if not session_key:
+                await ctx.respond(f"{year} {location} doesn't have {session_name}. Please select another session.", ephemeral=True)
+                return
+            if await OpenF1.get_session_state(session_key) == FINISHED:
+                await ctx.respond(f"{year} {location} {session_name} has finished. Please select another session.", ephemeral=True)
+                return
+
+            subscription = Subscription(
+                channel_id=ctx.channel_id,
+                guild_id=ctx.guild_id,
+                session_key=session_key,
+                year=year,
+                location=location,
+                session_name=session_name,
+                team_radio=team_radio
+            )
+            await feeds.subscribe(ctx.channel, subscription)
+        except OpenF1Error as e:
+            await ctx.respond(f"OpenF1 API timed out, please try it again.", ephemeral=True)
+            return
+        except DatabaseError as e:
+            await ctx.respond(f"An error occurred, please try it again.", ephemeral=True)
+            return
+        radio = " and team radio" if team_radio else ""
+        await ctx.respond(f"Race control messages{radio} of {year} {location} Grand Prix {session_name} will be posted to this channel as they come in.")
+
+    @race_control.command(name="unsubscribe", description="Stop posting race control messages to this channel")
+    async def unsubscribe(self, ctx: discord.ApplicationContext):
+        logger.info(f"Race Control unsubscribe command invoked by user [{ctx.interaction.user.id}|{ctx.interaction.user.name}]")
+        try:
+            subscription = await feeds.unsubscribe(ctx.channel_id)
+        except DatabaseError as e:
+            await ctx.respond(f"An error occurred, please try it again.", ephemeral=True)
+            return
+        if subscription is None:
+            await ctx.respond("This channel isn't subscribed to any session.", ephemeral=True)
+            return
+        await ctx.respond(f"Race control messages of {subscription.year} {subscription.location} Grand Prix {subscription.session_name} are no longer posted to this channel.")
+
+
+def setup(bot): # this is called by Pycord to setup the cog
+    bot.add_cog(RaceControl(bot))
@@ -0,0 +1,144 @@
+import time
+from io import BytesIO
+
+import discord
+from discord.ext import commands
+
+from app.services import race_replay as rr
+from app.services.openf1 import OpenF1
+from app.services.admission import admission
+from app.cogs.helpers import get_years, get_locations, get_stale_note
+from app.exceptions import OpenF1Error, AdmissionError, ReplayError
+
+import logging
+logger = logging.getLogger(__name__)
+logger.info("Logging is configured.")
+
+
+class RaceReplay(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    @discord.slash_command(name="race-replay")
+    @discord.option(
+        name="year",
+        type=discord.SlashCommandOptionType.integer,
+        choices=get_years()
+    )
+    @discord.option(
+        name="location",
+        type=discord.SlashCommandOptionType.string,
+        autocomplete=discord.utils.basic_autocomplete(get_locations)
+    )
+    @discord.option(
+        name="session_name",
+        type=discord.SlashCommandOptionType.string,
+        choices=["Practice 1", "Practice 2", "Practice 3", "Sprint Qualifying", "Qualifying", "Sprint", "Race"]
+    )
+    @discord.option(
+        name="start_lap",
+        type=discord.SlashCommandOptionType.integer,
+        min_value=1,
+        default=1
+    )
+    @discord.option(
+        name="end_lap",
+        type=discord.SlashCommandOptionType.integer,
+        min_value=1,
+        required=False,
+        default=None
+    )
+    async def race_replay(
+        self,
+        ctx: discord.ApplicationContext,
+        year: discord.SlashCommandOptionType.integer,
+        location: discord.SlashCommandOptionType.string,
+        session_name: discord.SlashCommandOptionType.string,
+        start_lap: discord.SlashCommandOptionType.integer,
+        end_lap: discord.SlashCommandOptionType.integer
+    ):
+        logger.info(f"Race Replay command invoked by user [{ctx.interaction.user.id}|{ctx.interaction.user.name}]")
+        session_key = await OpenF1.get_session_key(year, location, session_name)
+        if not session_key:
+            await ctx.respond(f"{year} {location} doesn't have {session_name} or {session_name} hasn't started yet. Please select another session.")
+            return
+        if end_lap is not None and end_lap < start_lap:
+            await ctx.respond("The end lap must not be before the start lap.")
+            return
+
+        laps = f"laps {start_lap} to {end_lap}" if end_lap else f"lap {start_lap} onwards"
+        await ctx.respond(
+            f"Select the format of the running order replay of {laps} for {year} {location} Grand Prix {session_name} session. Default: `GIF`",
+            view=RaceReplayView(year, location, session_name, start_lap, end_lap)
+        )
+
+
+class RaceReplayView(discord.ui.View):
+    def __init__(self, year: int, location: str, session_name: str, start_lap: int, end_lap: int):
+        super().__init__()
+        self.year = year
+        self.location = location
+        self.session_name = session_name
+        self.start_lap = start_lap
+        self.end_lap = end_lap
+        self.image_format = "gif"
+
+    @discord.ui.select(
+        placeholder="Choose the format...",
+        min_values=1,
+        max_values=1,
+        options=[
+            discord.SelectOption(
+                label="GIF",
+                value="gif"
+            ),
+            discord.SelectOption(
+                label="WebP",
+                value="webp",
+                description="Lossless, sharper text"
+            )
+        ]
+    )
+    async def select_callback(self, select: discord.ui.Select, interaction: discord.Interaction):
+        self.image_format = select.values[0]
+        await interaction.response.defer()
+
+    @discord.ui.button(label="Submit", style=discord.ButtonStyle.primary)
+    async def button_callback(self, button: discord.ui.Button, interaction: discord.Interaction):
+        try:
+            logger.info(f"Start processing race replay of laps {self.start_lap}-{self.end_lap} for {self.year} {self.location} Grand Prix for user [{interaction.user.id}|{interaction.user.name}]")
+
+            await interaction.response.defer()
+            key = ("race_replay", self.year, self.location, self.session_name, self.start_lap, self.end_lap, self.image_format)
+            admitted = await admission.run(key, interaction.user.id, interaction.guild_id, self.build, self.render)
+            await interaction.followup.send(get_stale_note(admitted), file=discord.File(BytesIO(admitted.payload), filename=f"race_replay.{self.image_format}"))
+        except AdmissionError as e:
+            await interaction.followup.send(f"The bot is busy right now, please try it again in a few seconds.")
+        except ReplayError as e:
+            await interaction.followup.send(f"{e}, please select other laps.")
+        except OpenF1Error as e:
+            await interaction.followup.send(f"OpenF1 API timed out, please try it again.")
+        except Exception as e:
+            logger.exception(e)
+            await interaction.followup.send(f"An error occurred.")
+
+    async def build(self) -> rr.RaceReplay:
+        t0 = time.time()
+        builder = rr.RaceReplayBuilder(self.year, self.location, self.session_name)
+        await builder.run_stages(self.start_lap, self.end_lap, self.image_format)
+        race_replay = builder.build()
+        logger.debug(f"Time taken to build race replay: {time.time() - t0} seconds")
+        return race_replay
+
+    @staticmethod
+    def render(race_replay: rr.RaceReplay) -> bytes:
+        t0 = time.time()
+        image_bytes = race_replay.to_image_bytes()
+        logger.debug(f"Time taken to convert to an animation: {time.time() - t0} seconds")
+        payload = image_bytes.getvalue()
+        image_bytes.close()
+        return payload
+
+
+def setup(bot): # this is called by Pycord to setup the cog
+    bot.add_cog(RaceReplay(bot))
@@ -0,0 +1,87 @@
+import time
+
+import discord
+from discord.ext import commands
+
+from app.services import strategy as st
+from app.services.openf1 import OpenF1
+from app.services.admission import admission
+from app.cogs.helpers import get_years, get_locations, get_stale_note, get_image_file
+from app.exceptions import OpenF1Error, AdmissionError
+
+import logging
+logger = logging.getLogger(__name__)
+logger.info("Logging is configured.")
+
+
+class Strategy(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    @discord.slash_command(name="strategy")
+    @discord.option(
+        name="year",
+        type=discord.SlashCommandOptionType.integer,
+        choices=get_years()
+    )
+    @discord.option(
+        name="location",
+        type=discord.SlashCommandOptionType.string,
+        autocomplete=discord.utils.basic_autocomplete(get_locations)
+    )
+    @discord.option(
+        name="session_name",
+        type=discord.SlashCommandOptionType.string,
+        choices=["Practice 1", "Practice 2", "Practice 3", "Sprint Qualifying", "Qualifying", "Sprint", "Race"]
+    )
+    async def strategy(
+        self,
+        ctx: discord.ApplicationContext,
+        year: discord.SlashCommandOptionType.integer,
+        location: discord.SlashCommandOptionType.string,
+        session_name: discord.SlashCommandOptionType.string
+    ):
+        logger.info(f"Strategy command invoked by user [{ctx.interaction.user.id}|{ctx.interaction.user.name}]")
+        session_key = await OpenF1.get_session_key(year, location, session_name)
+        if not session_key:
+            await ctx.respond(f"{year} {location} doesn't have {session_name} or {session_name} hasn't started yet. Please select another session.")
+            return
+
+        # Nothing to select, so the timeline is sent right away
+        try:
+            await ctx.defer()
+            key = ("strategy", year, location, session_name)
+            admitted = await admission.run(
+                key, ctx.interaction.user.id, ctx.interaction.guild_id,
+                lambda: self.build(year, location, session_name), self.render
+            )
+            await ctx.followup.send(get_stale_note(admitted), file=get_image_file(admitted.payload, "strategy"))
+        except AdmissionError as e:
+            await ctx.followup.send(f"The bot is busy right now, please try it again in a few seconds.")
+        except OpenF1Error as e:
+            await ctx.followup.send(f"OpenF1 API timed out, please try it again.")
+        except Exception as e:
+            logger.exception(e)
+            await ctx.followup.send(f"An error occurred, please try it again.")
+
+    @staticmethod
+    async def build(year: int, location: str, session_name: str) -> st.Strategy:
+        t0 = time.time()
+        builder = st.StrategyBuilder(year, location, session_name)
+        await builder.run_stages()
+        strategy = builder.build()
+        logger.debug(f"Time taken to build strategy: {time.time() - t0} seconds")
+        return strategy
+
+    @staticmethod
+    def render(strategy: st.Strategy) -> bytes:
+        t0 = time.time()
+        image_bytes = strategy.to_image_bytes()
+        logger.debug(f"Time taken to convert to image bytes: {time.time() - t0} seconds")
+        payload = image_bytes.getvalue()
+        image_bytes.close()
+        return payload
+
+
+def setup(bot): # this is called by Pycord to setup the cog
+    bot.add_cog(Strategy(bot))
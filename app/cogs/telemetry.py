@@ -0,0 +1,125 @@
+import time
+from typing import List
+
+import discord
+from discord.ext import commands
+
+from app.cogs.helpers import get_years, get_locations, get_drivers_select_options, get_stale_note, get_image_file
+from app.cogs.head2head import DriversSelect
+from app.services import telemetry as tm
+from app.services.openf1 import OpenF1
+from app.services.admission import admission
+from app.exceptions import OpenF1Error, AdmissionError, TelemetryError
+
+import logging
+logger = logging.getLogger(__name__)
+logger.info("Logging is configured.")
+
+
+class Telemetry(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    @discord.slash_command(name="telemetry")
+    @discord.option(
+        name="year",
+        type=discord.SlashCommandOptionType.integer,
+        choices=get_years()
+    )
+    @discord.option(
+        name="location",
+        type=discord.SlashCommandOptionType.string,
+        autocomplete=discord.utils.basic_autocomplete(get_locations)
+    )
+    @discord.option(
+        name="session_name",
+        type=discord.SlashCommandOptionType.string,
+        choices=["Practice 1", "Practice 2", "Practice 3", "Sprint Qualifying", "Qualifying", "Sprint", "Race"]
+    )
+    @discord.option(
+        name="lap",
+        type=discord.SlashCommandOptionType.integer,
+        min_value=1
+    )
+    async def telemetry(
+        self,
+        ctx: discord.ApplicationContext,
+        year: discord.SlashCommandOptionType.integer,
+        location: discord.SlashCommandOptionType.string,
+        session_name: discord.SlashCommandOptionType.string,
+        lap: discord.SlashCommandOptionType.integer
+    ):
+        logger.info(f"Telemetry command invoked by user [{ctx.interaction.user.id}|{ctx.interaction.user.name}]")
+        session_key = await OpenF1.get_session_key(year, location, session_name)
+        if not session_key:
+            await ctx.respond(f"{year} {location} doesn't have {session_name} or {session_name} hasn't started yet. Please select another session.")
+            return
+
+        driver_options = await get_drivers_select_options(year, location, session_name)
+        await ctx.respond(
+            f"Select drivers to compare the speed, throttle and brake traces of lap {lap} for {year} {location} Grand Prix {session_name} session.",
+            view=TelemetryView(year, location, session_name, lap, driver_options)
+        )
+
+
+class TelemetryView(discord.ui.View):
+    def __init__(self, year: int, location: str, session_name: str, lap: int, driver_options: List[discord.SelectOption]):
+        super().__init__()
+        self.year = year
+        self.location = location
+        self.session_name = session_name
+        self.lap = lap
+        self.driver1_select = DriversSelect("Select the first driver...", driver_options)
+        self.driver2_select = DriversSelect("Select the second driver", driver_options)
+
+        self.add_item(self.driver1_select)
+        self.add_item(self.driver2_select)
+
+    @discord.ui.button(label="Submit", style=discord.ButtonStyle.primary)
+    async def button_callback(self, button: discord.ui.Button, interaction: discord.Interaction):
+        try:
+            driver1 = int(self.driver1_select.values[0])
+            driver2 = int(self.driver2_select.values[0])
+            if driver1 == driver2:
+                await interaction.respond("Please select two different drivers.")
+                return
+
+            logger.info(f"Start processing telemetry comparison between {driver1} and {driver2} on lap {self.lap} for {self.year} {self.location} Grand Prix for user [{interaction.user.id}|{interaction.user.name}]")
+
+            await interaction.response.defer()
+            key = ("telemetry", self.year, self.location, self.session_name, driver1, driver2, self.lap)
+            admitted = await admission.run(
+                key, interaction.user.id, interaction.guild_id,
+                lambda: self.build(driver1, driver2), self.render
+            )
+            await interaction.followup.send(get_stale_note(admitted), file=get_image_file(admitted.payload, "telemetry"))
+        except AdmissionError as e:
+            await interaction.followup.send(f"The bot is busy right now, please try it again in a few seconds.")
+        except TelemetryError as e:
+            await interaction.followup.send(f"{e}, please select another lap.")
+        except OpenF1Error as e:
+            await interaction.followup.send(f"OpenF1 API timed out, please try it again.")
+        except Exception as e:
+            logger.exception(e)
+            await interaction.followup.send(f"An error occurred.")
+
+    async def build(self, driver1: int, driver2: int) -> tm.Telemetry:
+        t0 = time.time()
+        builder = tm.TelemetryBuilder(self.year, self.location, self.session_name)
+        await builder.run_stages(driver1, driver2, self.lap)
+        telemetry = builder.build()
+        logger.debug(f"Time taken to build telemetry: {time.time() - t0} seconds")
+        return telemetry
+
+    @staticmethod
+    def render(telemetry: tm.Telemetry) -> bytes:
+        t0 = time.time()
+        image_bytes = telemetry.to_image_bytes()
+        logger.debug(f"Time taken to convert to image bytes: {time.time() - t0} seconds")
+        payload = image_bytes.getvalue()
+        image_bytes.close()
+        return payload
+
+
+def setup(bot): # this is called by Pycord to setup the cog
+    bot.add_cog(Telemetry(bot)) # add the cog to the bot
@@ -3,3 +3,27 @@ class OpenF1Error(Exception):
 
 class DatabaseError(Exception):
     pass
+
+class AdmissionError(Exception):
+    pass
+
+class ProfilingError(Exception):
+    pass
+
+class AsOfError(Exception):
+    pass
+
+class TelemetryError(Exception):
+    pass
+
+class ReplayError(Exception):
+    pass
+
+class CompareError(Exception):
+    pass
+
+class ExportError(Exception):
+    pass
+
+class TrackMapError(Exception):
+    pass
@@ -0,0 +1,66 @@
+import json
+import uuid
+import logging
+import itertools
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Id of the interaction being processed, copied into every task and thread it starts
+request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+
+def new_request_id() -> str:
+    request_id.set(uuid.uuid4().hex[:8])
+    return request_id.get()
+
+
+class RequestContextFilter(logging.Filter):
+    # Runs on the emitting thread, where the request id context var is set.
+    # Threads outside the request's context can pass it with extra={"request_id": ...}.
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "request_id", None) is None:
+            record.request_id = request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    # Keeps one in every sample_rate INFO-or-lower messages starting with one
+    # of the prefixes, per logger. Warnings and errors are always kept.
+    def __init__(self, sample_rate: int = 10, prefixes: Optional[List[str]] = None):
+        super().__init__()
+        self.sample_rate = max(1, sample_rate)
+        self.prefixes = tuple(prefixes or [])
+        self._counters: Dict[Tuple[str, str], Iterator[int]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.sample_rate == 1 or record.levelno > logging.INFO or not isinstance(record.msg, str):
+            return True
+        prefix = next((prefix for prefix in self.prefixes if record.msg.startswith(prefix)), None)
+        if prefix is None:
+            return True
+        counter = self._counters.setdefault((record.name, prefix), itertools.count())
+        if next(counter) % self.sample_rate != 0:
+            return False
+        record.sample_rate = self.sample_rate
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line, with the request id and the stage timings when present
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key in ("request_id", "stages", "sample_rate"):
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
@@ -0,0 +1,144 @@
+import os
+import time
+import asyncio
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+from pydantic import BaseModel
+
+from app.app_config import AppConfig
+from app.services.cache import TTLCache
+from app.exceptions import AdmissionError
+from app.logging_utils import request_id, new_request_id
+
+import logging
+logger = logging.getLogger(__name__)
+logger.info("Logging is configured.")
+
+app_config_path = os.getenv("APP_CONFIG_PATH", f"{Path(__file__).parent.parent.parent.resolve()}/app_config.json")
+app_config = AppConfig.from_json(app_config_path)
+
+
+class Admitted(BaseModel):
+    payload: Any
+    rendered_at: float
+    stale: bool = False   # Served from the latest result because the bot is saturated
+
+
+class AdmissionController:
+    # Sits in front of the cog callbacks:
+    #   - identical in-flight requests share one build and render,
+    #   - builds and renders each have a bounded number of slots,
+    #   - a user or guild can only have a few computations in flight,
+    # and when a request can't be admitted in time the latest result for the
+    # same request is served instead, if there is one.
+    def __init__(self, max_builds: int, max_renders: int, max_per_user: int, max_per_guild: int, queue_timeout: float, stale_ttl: float):
+        self.builds = asyncio.Semaphore(max_builds)
+        self.renders = asyncio.Semaphore(max_renders)
+        self.max_per_user = max_per_user
+        self.max_per_guild = max_per_guild
+        self.queue_timeout = queue_timeout
+        self.in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.per_user: Dict[int, int] = {}
+        self.per_guild: Dict[int, int] = {}
+        self.latest = TTLCache(f"{__name__}.latest", ttl=stale_ttl, maxsize=256)
+        # Called with ("queue" | "build" | "render", seconds) for every computation
+        self.observers: List[Callable[[str, float], None]] = []
+
+    async def run(
+        self,
+        key: Hashable,
+        user_id: int,
+        guild_id: Optional[int],
+        build: Callable[[], Awaitable[Any]],
+        render: Callable[[Any], Any]
+    ) -> Admitted:
+        # Every log line of this interaction, and of the computation it starts, carries the id
+        if request_id.get() is None:
+            new_request_id()
+        logger.info(f"Request {key} from user {user_id} in guild {guild_id}")
+
+        pending = self.in_flight.get(key)
+        if pending is not None:
+            logger.info(f"Joining in-flight request {key}")
+            try:
+                return await asyncio.shield(pending)
+            except AdmissionError:
+                return self._degrade(key, "no build slot available")
+
+        if self.per_user.get(user_id, 0) >= self.max_per_user:
+            return self._degrade(key, f"user {user_id} has {self.max_per_user} requests in flight")
+        if guild_id is not None and self.per_guild.get(guild_id, 0) >= self.max_per_guild:
+            return self._degrade(key, f"guild {guild_id} has {self.max_per_guild} requests in flight")
+
+        pending = asyncio.ensure_future(self._compute(key, build, render))
+        pending.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.in_flight[key] = pending
+        self._acquire_quota(user_id, guild_id)
+        try:
+            return await asyncio.shield(pending)
+        except AdmissionError:
+            return self._degrade(key, "no build slot available")
+        finally:
+            self._release_quota(user_id, guild_id)
+
+    async def _compute(self, key: Hashable, build: Callable[[], Awaitable[Any]], render: Callable[[Any], Any]) -> Admitted:
+        try:
+            t0 = time.perf_counter()
+            try:
+                await asyncio.wait_for(self.builds.acquire(), self.queue_timeout)
+            except TimeoutError:
+                raise AdmissionError("Timed out waiting for a build slot")
+            self._observe("queue", time.perf_counter() - t0)
+            try:
+                t0 = time.perf_counter()
+                model = await build()
+                self._observe("build", time.perf_counter() - t0)
+            finally:
+                self.builds.release()
+
+            # Renders are CPU and memory heavy, so they run in a thread one per render slot
+            async with self.renders:
+                t0 = time.perf_counter()
+                payload = await asyncio.to_thread(render, model)
+                self._observe("render", time.perf_counter() - t0)
+
+            self.latest.set(key, payload)
+            return Admitted(payload=payload, rendered_at=time.time())
+        finally:
+            self.in_flight.pop(key, None)
+
+    def _observe(self, phase: str, duration: float) -> None:
+        for observer in self.observers:
+            observer(phase, duration)
+
+    def _degrade(self, key: Hashable, reason: str) -> Admitted:
+        entry = self.latest.peek(key)
+        if entry is None:
+            logger.warning(f"Rejecting request {key}: {reason}")
+            raise AdmissionError(f"Request rejected: {reason}")
+        logger.warning(f"Serving latest result of {key} from {time.time() - entry.fetched_at:.0f} seconds ago: {reason}")
+        return Admitted(payload=entry.value, rendered_at=entry.fetched_at, stale=True)
+
+    def _acquire_quota(self, user_id: int, guild_id: Optional[int]) -> None:
+        self.per_user[user_id] = self.per_user.get(user_id, 0) + 1
+        if guild_id is not None:
+            self.per_guild[guild_id] = self.per_guild.get(guild_id, 0) + 1
+
+    def _release_quota(self, user_id: int, guild_id: Optional[int]) -> None:
+        self.per_user[user_id] -= 1
+        if self.per_user[user_id] == 0:
+            del self.per_user[user_id]
+        if guild_id is not None:
+            self.per_guild[guild_id] -= 1
+            if self.per_guild[guild_id] == 0:
+                del self.per_guild[guild_id]
+
+
+admission = AdmissionController(
+    max_builds=app_config.admission.max_builds,
+    max_renders=app_config.admission.max_renders,
+    max_per_user=app_config.admission.max_per_user,
+    max_per_guild=app_config.admission.max_per_guild,
+    queue_timeout=app_config.admission.queue_timeout,
+    stale_ttl=app_config.admission.stale_ttl
+)
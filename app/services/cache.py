@@ -0,0 +1,247 @@
+import os
+import time
+import pickle
+import zlib
+import asyncio
+import functools
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from app.app_config import AppConfig
+
+import logging
+logger = logging.getLogger(__name__)
+logger.info("Logging is configured.")
+
+app_config_path = os.getenv("APP_CONFIG_PATH", f"{Path(__file__).parent.parent.parent.resolve()}/app_config.json")
+app_config = AppConfig.from_json(app_config_path)
+
+
+class CacheEntry:
+    __slots__ = ("value", "fetched_at", "stale_at", "expires_at")
+
+    def __init__(self, value: Any, fetched_at: float, stale_at: float, expires_at: float):
+        self.value = value
+        self.fetched_at = fetched_at
+        self.stale_at = stale_at
+        self.expires_at = expires_at
+
+
+class TTLCache:
+    # Named LRU cache with a TTL per entry. Expiry uses wall-clock time so the
+    # entries stay meaningful across a restart, and every cache registers
+    # itself by name so CacheSnapshot can save and restore it.
+    registry: Dict[str, "TTLCache"] = {}
+
+    def __init__(self, name: str, ttl: float, maxsize: Optional[int] = 128, snapshot: bool = True):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.snapshot = snapshot
+        self._entries: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+        TTLCache.registry[name] = self
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry.value
+
+    def peek(self, key: Hashable) -> Optional[CacheEntry]:
+        # Non-expired entry with its timestamps, without touching the LRU order
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at <= time.time():
+            return None
+        return entry
+
+    def set(self, key: Hashable, value: Any, fetched_at: Optional[float] = None, expires_at: Optional[float] = None, stale_at: Optional[float] = None) -> None:
+        fetched_at = fetched_at or time.time()
+        expires_at = expires_at or fetched_at + self.ttl
+        self._entries[key] = CacheEntry(value, fetched_at, stale_at or expires_at, expires_at)
+        self._entries.move_to_end(key)
+        while self.maxsize and len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def keys(self) -> List[Hashable]:
+        return list(self._entries)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def dump(self) -> List[Tuple[Hashable, Any, float, float, float]]:
+        now = time.time()
+        return [(key, entry.value, entry.fetched_at, entry.expires_at, entry.stale_at) for key, entry in list(self._entries.items()) if entry.expires_at > now]
+
+    def load(self, entries: List[Tuple[Hashable, Any, float, float, float]]) -> int:
+        now = time.time()
+        restored = 0
+        for key, value, fetched_at, expires_at, *stale_at in entries:   # Older snapshots have no stale_at
+            if expires_at > now and key not in self._entries:
+                self.set(key, value, fetched_at=fetched_at, expires_at=expires_at, stale_at=stale_at[0] if stale_at else None)
+                restored += 1
+        return restored
+
+
+class AsyncTTLCache(TTLCache):
+    # Drop-in replacement for alru_cache: concurrent calls with the same
+    # arguments share one in-flight call, and a cancelled caller doesn't
+    # cancel the call for the others.
+    #
+    # With hard_ttl > ttl the cache serves stale-while-revalidate: an entry
+    # older than ttl (soft) is still returned immediately and refreshed once
+    # in the background, and only an entry older than hard_ttl blocks the
+    # caller on a new call.
+    #
+    # A ttl_policy, called with the same arguments after each call, returns
+    # the (soft, hard) TTLs of the new entry instead, e.g. by session state.
+    def __init__(self, func, ttl: float, maxsize: Optional[int] = 128, snapshot: bool = True, hard_ttl: Optional[float] = None,
+                 ttl_policy: Optional[Callable[..., Awaitable[Tuple[float, float]]]] = None):
+        super().__init__(f"{func.__module__}.{func.__qualname__}", max(ttl, hard_ttl or ttl), maxsize, snapshot)
+        functools.update_wrapper(self, func)
+        self.soft_ttl = ttl
+        self.ttl_policy = ttl_policy
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+
+    @staticmethod
+    def make_key(args: tuple, kwargs: dict) -> Hashable:
+        return (args, tuple(sorted(kwargs.items()))) if kwargs else args
+
+    async def __call__(self, *args, **kwargs):
+        entry = await self.get_entry(*args, **kwargs)
+        return entry.value
+
+    async def with_age(self, *args, **kwargs) -> Tuple[Any, float]:
+        # Returns the value and the time it was fetched at
+        entry = await self.get_entry(*args, **kwargs)
+        return entry.value, entry.fetched_at
+
+    async def get_entry(self, *args, **kwargs) -> CacheEntry:
+        key = self.make_key(args, kwargs)
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at > now:
+            self._entries.move_to_end(key)
+            if entry.stale_at <= now and key not in self._pending:
+                logger.debug(f"Serving stale {self.name}{args} and refreshing it in the background.")
+                self._start_fetch(key, args, kwargs)
+            return entry
+
+        pending = self._pending.get(key) or self._start_fetch(key, args, kwargs)
+        return await asyncio.shield(pending)
+
+    def _start_fetch(self, key: Hashable, args: tuple, kwargs: dict) -> asyncio.Future:
+        pending = asyncio.ensure_future(self._fetch(key, args, kwargs))
+        # Retrieve the exception even if every caller was cancelled or nobody awaits a background refresh
+        pending.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._pending[key] = pending
+        return pending
+
+    async def _fetch(self, key: Hashable, args: tuple, kwargs: dict) -> CacheEntry:
+        try:
+            value = await self.__wrapped__(*args, **kwargs)
+            soft_ttl, hard_ttl = self.soft_ttl, self.ttl
+            if self.ttl_policy:
+                # The value is kept with the default TTLs when the policy fails
+                try:
+                    soft_ttl, hard_ttl = await self.ttl_policy(*args, **kwargs)
+                except Exception as e:
+                    logger.warning(f"Error getting the TTLs of {self.name}{args}, using the defaults: {e}")
+            now = time.time()
+            self.set(key, value, fetched_at=now, expires_at=now + hard_ttl, stale_at=now + soft_ttl)
+            return self._entries[key]
+        except Exception as e:
+            if key in self._entries and self._entries[key].expires_at > time.time():
+                logger.warning(f"Error refreshing {self.name}{args}, keeping the stale value: {e}")
+            raise
+        finally:
+            self._pending.pop(key, None)
+
+    def cache_set(self, value: Any, *args, **kwargs) -> None:
+        # Primes the entry of a call with a value fetched elsewhere
+        self.set(self.make_key(args, kwargs), value)
+
+    def cache_invalidate(self, *args, **kwargs) -> None:
+        self.invalidate(self.make_key(args, kwargs))
+
+    def cache_clear(self) -> None:
+        self.clear()
+
+
+def async_ttl_cache(ttl: float, maxsize: Optional[int] = 128, snapshot: bool = True, hard_ttl: Optional[float] = None,
+                    ttl_policy: Optional[Callable[..., Awaitable[Tuple[float, float]]]] = None):
+    def decorator(func):
+        return AsyncTTLCache(func, ttl, maxsize, snapshot, hard_ttl, ttl_policy)
+    return decorator
+
+
+class CacheSnapshot:
+    # Compact on-disk copy of every registered cache: a zlib-compressed pickle
+    # of {cache name: pickled [(key, value, fetched_at, expires_at, stale_at), ...]}.
+    # Caches are pickled one by one so an unpicklable cache only skips itself.
+    def __init__(self, path: Optional[str] = None, interval: Optional[int] = None):
+        self.path = Path(path or app_config.cache.snapshot_path)
+        self.interval = interval or app_config.cache.snapshot_interval
+
+    def collect(self) -> Dict[str, List[Tuple[Hashable, Any, float, float, float]]]:
+        return {name: cache.dump() for name, cache in TTLCache.registry.items() if cache.snapshot}
+
+    def write(self, snapshot: Dict[str, List[Tuple[Hashable, Any, float, float, float]]]) -> Tuple[int, int]:
+        pickled = {}
+        num_entries = 0
+        for name, entries in snapshot.items():
+            try:
+                pickled[name] = pickle.dumps(entries, protocol=pickle.HIGHEST_PROTOCOL)
+                num_entries += len(entries)
+            except Exception as e:
+                logger.warning(f"Skipping cache {name} in snapshot: {e}")
+
+        data = zlib.compress(pickle.dumps(pickled, protocol=pickle.HIGHEST_PROTOCOL))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+        return num_entries, len(data)
+
+    async def save(self) -> None:
+        # Entries are collected on the loop, pickling and disk I/O run in a thread
+        t0 = time.perf_counter()
+        num_entries, size = await asyncio.to_thread(self.write, self.collect())
+        logger.info(f"Saved {num_entries} cache entries ({size} bytes) in {time.perf_counter() - t0:.3f} seconds.")
+
+    def save_sync(self) -> None:
+        num_entries, size = self.write(self.collect())
+        logger.info(f"Saved {num_entries} cache entries ({size} bytes).")
+
+    def restore(self) -> int:
+        if not self.path.exists():
+            logger.info(f"No cache snapshot found at {self.path}.")
+            return 0
+
+        t0 = time.perf_counter()
+        try:
+            with open(self.path, "rb") as f:
+                pickled = pickle.loads(zlib.decompress(f.read()))
+        except Exception as e:
+            logger.error(f"Error reading cache snapshot: {e}")
+            return 0
+
+        restored = 0
+        for name, data in pickled.items():
+            cache = TTLCache.registry.get(name)
+            if cache is None or not cache.snapshot:
+                continue
+            try:
+                restored += cache.load(pickle.loads(data))
+            except Exception as e:
+                logger.warning(f"Skipping cache {name} in snapshot: {e}")
+        logger.info(f"Restored {restored} cache entries from {self.path} in {time.perf_counter() - t0:.3f} seconds.")
+        return restored
@@ -0,0 +1,309 @@
+import os
+import re
+import asyncio
+import statistics
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from io import BytesIO
+
+import numpy as np
+from matplotlib.figure import Figure
+from pydantic import BaseModel
+
+from app.app_config import AppConfig
+from app.services.openf1 import OpenF1
+from app.services.cache import TTLCache
+from app.services.fastest import DriverBests, format_lap_time
+from app.services.stages import StageGraph, StageResult
+from app.services.encoding import render_figure, cache_key
+from app.exceptions import OpenF1Error, DatabaseError, CompareError
+
+import logging
+logger = logging.getLogger(__name__)
+logger.info("Logging is configured.")
+
+app_config_path = os.getenv("APP_CONFIG_PATH", f"{Path(__file__).parent.parent.parent.resolve()}/app_config.json")
+app_config = AppConfig.from_json(app_config_path)
+
+# Encoded images keyed by the model they were rendered from
+rendered_images = TTLCache(f"{__name__}.rendered_images", ttl=3600, maxsize=32)
+
+SESSION_NAMES = {
+    "FP1": "Practice 1", "FP2": "Practice 2", "FP3": "Practice 3",
+    "SQ": "Sprint Qualifying", "Q": "Qualifying", "S": "Sprint", "R": "Race",
+}
+# Laps slower than this ratio of the session's best lap (in and out laps, safety cars) don't count towards the pace
+PACE_CUTOFF = 1.07
+SESSION_COLORS = ['#FF5A4F', '#00D2BE', '#FF8700', '#3671C6', '#FFD700', '#B138DD']
+
+
+class Target(BaseModel):
+    year: int
+    location: str
+    session_name: str
+
+    @property
+    def label(self) -> str:
+        short = {name: alias for alias, name in SESSION_NAMES.items()}[self.session_name]
+        return f"{self.year} {self.location} {short}"
+
+
+def parse_targets(spec: str) -> List[Target]:
+    # "2025 Monza Q; 2025 Monza Race; 2024 Monza" -> three targets, the session is the race by default
+    names = {name.upper(): name for name in SESSION_NAMES.values()}
+    names.update(SESSION_NAMES)
+    targets = []
+    for part in re.split(r"[;\n]+", spec):
+        words = part.split()
+        if not words:
+            continue
+        if not words[0].isdigit():
+            raise CompareError(f"`{part.strip()}` doesn't start with a year")
+        session_name = "Race"
+        # Longest session name first, "Sprint Qualifying" before "Qualifying"
+        for length in (2, 1):
+            if len(words) > length and " ".join(words[-length:]).upper() in names:
+                session_name = names[" ".join(words[-length:]).upper()]
+                words = words[:-length]
+                break
+        if len(words) < 2:
+            raise CompareError(f"`{part.strip()}` doesn't have a location")
+        target = Target(year=int(words[0]), location=" ".join(words[1:]), session_name=session_name)
+        if target not in targets:
+            targets.append(target)
+    if not targets:
+        raise CompareError("No sessions given")
+    if len(targets) > app_config.compare.max_sessions:
+        raise CompareError(f"At most {app_config.compare.max_sessions} sessions can be compared")
+    return targets
+
+
+async def resolve_location(year: int, location: str) -> str:
+    # "monza" or "Italian" -> "Monza", names that match nothing are left to the session lookup
+    try:
+        locations = await OpenF1.get_grand_prix_locations(year)
+    except (OpenF1Error, DatabaseError) as e:
+        logger.warning(f"Error getting the locations of {year}, looking up {location} as given: {e}")
+        return location
+    for candidate in locations:
+        if candidate.location.lower() == location.lower():
+            return candidate.location
+    matches = [candidate.location for candidate in locations if location.lower() in f"{candidate.location} {candidate.meeting_name}".lower()]
+    return matches[0] if len(matches) == 1 else location
+
+
+def align_laps(laps_per_session: List[List[Dict]]) -> Tuple[List[int], List[List[Optional[float]]]]:
+    # One column of lap times per session on the union of their lap numbers, pit out laps left out
+    lap_numbers = sorted({lap["lap_number"] for laps in laps_per_session for lap in laps})
+    index = {lap_number: i for i, lap_number in enumerate(lap_numbers)}
+    columns = []
+    for laps in laps_per_session:
+        column = [None] * len(lap_numbers)
+        for lap in laps:
+            if not lap.get("is_pit_out_lap"):
+                column[index[lap["lap_number"]]] = lap.get("lap_duration")
+        columns.append(column)
+    return lap_numbers, columns
+
+
+def pace(column: List[Optional[float]]) -> Optional[float]:
+    # Median of the laps within PACE_CUTOFF of the best one
+    times = [time for time in column if time]
+    if not times:
+        return None
+    cutoff = min(times) * PACE_CUTOFF
+    return round(statistics.median(time for time in times if time <= cutoff), 3)
+
+
+class Comparison(BaseModel):
+    title: Optional[str] = None
+    labels: Optional[List[str]] = None
+    driver_names: Optional[List[Optional[str]]] = None
+    lap_numbers: Optional[List[int]] = None
+    lap_times: Optional[List[List[Optional[float]]]] = None   # One column per session, aligned on lap_numbers
+    bests: Optional[List[DriverBests]] = None
+    paces: Optional[List[Optional[float]]] = None
+    notes: Optional[List[str]] = None   # Sessions left out and why
+    as_of: Optional[float] = None   # Fetch time of the oldest data shown
+
+    def to_image_bytes(self) -> BytesIO:
+        logger.info("Converting comparison to image bytes...")
+        key = cache_key(self)
+        cached = rendered_images.get(key)
+        if cached is not None:
+            logger.info("Using cached comparison image.")
+            return BytesIO(cached)
+
+        # Constrained layout fits everything on the fixed canvas, so no tight-bbox pass is needed
+        table_height = 0.3 * (len(self.labels) + 1)
+        fig = Figure(figsize=(12, 5 + table_height), layout="constrained")
+        fig.patch.set_facecolor('#333333')  # Dark grey background
+        chart, summary = fig.subplots(2, 1, height_ratios=[5, table_height])
+
+        chart.set_facecolor('#333333')
+        chart.set_ylabel("Lap time (s)", color='white')
+        chart.set_xlabel("Lap", color='white')
+        chart.tick_params(colors='white')
+        chart.grid(color='#555555', linewidth=0.5)
+        for spine in chart.spines.values():
+            spine.set_color('#555555')
+        lap_numbers = np.array(self.lap_numbers)
+        for i, label in enumerate(self.labels):
+            column = np.array(self.lap_times[i], dtype=float)   # None -> NaN, drawn as gaps
+            if np.isnan(column).all():
+                continue
+            chart.plot(lap_numbers, column, color=SESSION_COLORS[i % len(SESSION_COLORS)], marker='o', markersize=3, linewidth=1, label=label)
+        # Slow laps would flatten the representative ones
+        best = min((bests.lap.time for bests in self.bests if bests.lap), default=None)
+        slowest_pace = max((session_pace for session_pace in self.paces if session_pace), default=None)
+        if best and slowest_pace:
+            chart.set_ylim(best * 0.99, max(slowest_pace * 1.05, best * 1.02))
+        chart.set_title(self.title, color='white', fontweight='bold')
+        if chart.get_lines():
+            chart.legend(facecolor='#333333', edgecolor='#555555', labelcolor='white')
+        if self.as_of:
+            chart.text(1, 1.01, f"As of {datetime.fromtimestamp(self.as_of, tz=timezone.utc):%H:%M:%S} UTC", transform=chart.transAxes, color='#AAAAAA', fontsize=8, ha='right', va='bottom')
+
+        columns = ["Session", "Driver", "Best Lap", "Gap", "S1", "S2", "S3", "Theoretical", "Pace", "Laps"]
+        # Gaps are to the first session with a lap time
+        reference = next((i for i, bests in enumerate(self.bests) if bests.lap), None)
+        rows, gap_colors = [], []
+        for i, label in enumerate(self.labels):
+            bests = self.bests[i]
+            lap = bests.lap
+            gap = round(lap.time - self.bests[reference].lap.time, 3) if lap and i != reference else None
+            rows.append(
+                [label, self.driver_names[i] or "N/A", format_lap_time(lap.time if lap else None), f"{gap:+.3f}" if gap is not None else ""]
+                + [f"{sector.time:.3f}" if sector else "N/A" for sector in bests.sectors]
+                + [format_lap_time(bests.theoretical), format_lap_time(self.paces[i]), str(sum(1 for time in self.lap_times[i] if time))]
+            )
+            gap_colors.append('white' if gap is None else '#FF3333' if gap > 0 else '#49FF33')
+
+        summary.axis('off')
+        table = summary.table(cellText=rows, colLabels=columns, colWidths=[0.19] + [0.09] * (len(columns) - 1), cellLoc='center', bbox=[0, 0, 1, 1])
+        table.auto_set_font_size(False)
+        table.set_fontsize(9)
+        for (row, col), cell in table.get_celld().items():
+            cell.set_linewidth(0.5)
+            if row == 0:
+                cell.set_facecolor('#222222')
+                cell.set_text_props(color='white', fontweight='bold')
+                continue
+            cell.set_facecolor('#444444')
+            if col == 0:
+                cell.set_text_props(color=SESSION_COLORS[(row - 1) % len(SESSION_COLORS)], fontweight='bold')
+            else:
+                cell.set_text_props(color=gap_colors[row - 1] if col == 3 else 'white')
+
+        buf = render_figure(fig, "compare")
+        rendered_images.set(key, buf.getvalue())
+
+        logger.info("Finished converting comparison to image bytes.")
+
+        return buf
+
+
+class ComparisonBuilder:
+    # Every session's key, driver and laps are fetched as stages of one graph,
+    # so all the sessions are resolved and fetched at the same time. At most
+    # compare.max_concurrent_fetches of them run at once, so a comparison of
+    # many sessions doesn't fire all its requests at OpenF1 together.
+    def __init__(self, driver: str, targets: List[Target]):
+        self.comparison = Comparison(title=f"{driver.upper()} Across Sessions", labels=[target.label for target in targets])
+        self.driver = driver
+        self.targets = targets
+        self.session_keys: List[Optional[int]] = [None] * len(targets)
+        self.driver_numbers: List[Optional[int]] = [None] * len(targets)
+        self.laps: List[List[Dict]] = [[] for _ in targets]
+
+    def _update_as_of(self, fetched_at: float) -> None:
+        # The comparison is only as recent as its oldest data
+        if self.comparison.as_of is None or fetched_at < self.comparison.as_of:
+            self.comparison.as_of = fetched_at
+
+    async def get_session_key(self, i: int) -> None:
+        target = self.targets[i]
+        target.location = await resolve_location(target.year, target.location)
+        session_key = await OpenF1.get_session_key(target.year, target.location, target.session_name)
+        if not session_key:
+            raise CompareError(f"{target.label} doesn't exist or hasn't started yet")
+        self.session_keys[i] = session_key
+
+    async def add_driver(self, i: int) -> "ComparisonBuilder":
+        # Matched by acronym, or by number, which can change between seasons
+        target = self.targets[i]
+        drivers_data = await OpenF1.get_drivers(target.year, target.location, target.session_name)
+        for data in drivers_data:
+            if self.driver.upper() in (data.name_acronym.upper(), str(data.driver_number)):
+                self.driver_numbers[i] = data.driver_number
+                self.comparison.driver_names[i] = data.name_acronym
+                return self
+        raise CompareError(f"{self.driver.upper()} didn't take part in {target.label}")
+
+    async def add_laps(self, i: int) -> "ComparisonBuilder":
+        lap_data, fetched_at = await OpenF1.get_lap_times.with_age(self.session_keys[i])
+        self._update_as_of(fetched_at)
+        self.laps[i] = lap_data
+        return self
+
+    def add_alignment(self) -> "ComparisonBuilder":
+        logger.info("Aligning the laps of the sessions...")
+        laps_per_session = [
+            [lap for lap in laps if lap.get("lap_number") is not None and lap.get("driver_number") == driver_number]
+            for laps, driver_number in zip(self.laps, self.driver_numbers)
+        ]
+        self.comparison.lap_numbers, self.comparison.lap_times = align_laps(laps_per_session)
+        self.comparison.bests = []
+        for laps in laps_per_session:
+            bests = DriverBests()
+            for lap in laps:
+                bests.apply(lap)
+            self.comparison.bests.append(bests)
+        self.comparison.paces = [pace(column) for column in self.comparison.lap_times]
+        logger.info("Finished aligning the laps.")
+
+        return self
+
+    async def run_stages(self) -> Dict[str, StageResult]:
+        logger.info(f"Comparing {self.driver} across {len(self.targets)} sessions...")
+        self.comparison.driver_names = [None] * len(self.targets)
+        graph = StageGraph()
+        deadline = app_config.compare.deadline
+        slots = asyncio.Semaphore(app_config.compare.max_concurrent_fetches)
+
+        def limited(func):
+            async def run():
+                async with slots:
+                    return await func()
+            return run
+
+        for i in range(len(self.targets)):
+            graph.add(f"session_key_{i}", limited(lambda i=i: self.get_session_key(i)), deadline=deadline)
+            graph.add(f"driver_{i}", limited(lambda i=i: self.add_driver(i)), deps=[f"session_key_{i}"], deadline=deadline)
+            graph.add(f"laps_{i}", limited(lambda i=i: self.add_laps(i)), deps=[f"session_key_{i}"], deadline=deadline)
+        results = await graph.run()
+
+        # Sessions that failed are left out of the chart and reported, the first reason per session
+        self.comparison.notes = []
+        for i, target in enumerate(self.targets):
+            failed = [results[f"{stage}_{i}"] for stage in ("session_key", "driver", "laps") if results[f"{stage}_{i}"].status in ("failed", "timeout")]
+            if failed:
+                self.comparison.notes.append(failed[0].error if failed[0].status == "failed" else f"{target.label} timed out")
+                self.laps[i] = []
+        if len(self.comparison.notes) == len(self.targets):
+            # Only a selection problem when every session was left out for one
+            for name, stage in graph.stages.items():
+                if isinstance(stage.exception, TimeoutError):
+                    raise OpenF1Error(f"Stage {name} timed out")
+                if stage.exception is not None and not isinstance(stage.exception, CompareError):
+                    raise stage.exception
+            raise CompareError("; ".join(self.comparison.notes))
+
+        # Labels show the locations as resolved
+        self.comparison.labels = [target.label for target in self.targets]
+        self.add_alignment()
+        return results
+
+    def build(self) -> "Comparison":
+        return self.comparison
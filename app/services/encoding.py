@@ -0,0 +1,127 @@
+import hashlib
+import os
+import time
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from io import BytesIO
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from PIL import Image
+from pydantic import BaseModel
+
+from app.app_config import AppConfig
+
+import logging
+logger = logging.getLogger(__name__)
+logger.info("Logging is configured.")
+
+app_config_path = os.getenv("APP_CONFIG_PATH", f"{Path(__file__).parent.parent.parent.resolve()}/app_config.json")
+app_config = AppConfig.from_json(app_config_path)
+
+# (left, top, right, bottom) in pixels of the rendered canvas
+CropBox = Tuple[int, int, int, int]
+
+
+class EncodingStats(BaseModel):
+    renders: int = 0
+    raw_bytes: int = 0   # Uncompressed RGB pixels
+    encoded_bytes: int = 0
+    draw_time: float = 0.0
+    encode_time: float = 0.0
+    uploads: int = 0
+    uploaded_bytes: int = 0
+
+
+_stats: Dict[str, EncodingStats] = {}
+_stats_lock = threading.Lock()   # Renders run in threads
+
+
+def image_extension() -> str:
+    return "webp" if app_config.encoding.format == "webp" else "png"
+
+
+def cache_key(model: BaseModel) -> str:
+    # Rendered images depend on the encoding settings as well as on the model
+    settings = app_config.encoding.model_dump_json()
+    return hashlib.sha1((model.model_dump_json(warnings=False) + settings).encode()).hexdigest()
+
+
+def tight_crop_box(fig: Figure, pad_inches: float = 0.1) -> CropBox:
+    # Same area as savefig(bbox_inches='tight'), computed once for a fixed
+    # layout so the renders after it skip the extra layout pass
+    canvas = fig.canvas if isinstance(fig.canvas, FigureCanvasAgg) else FigureCanvasAgg(fig)
+    bbox = fig.get_tightbbox(canvas.get_renderer()).padded(pad_inches)
+    width, height = canvas.get_width_height()
+    dpi = fig.dpi
+    left = max(0, int(np.floor(bbox.x0 * dpi)))
+    right = min(width, int(np.ceil(bbox.x1 * dpi)))
+    top = max(0, int(np.floor(height - bbox.y1 * dpi)))   # Pixel rows start at the top
+    bottom = min(height, int(np.ceil(height - bbox.y0 * dpi)))
+    return left, top, right, bottom
+
+
+def encode_pixels(pixels: np.ndarray) -> bytes:
+    settings = app_config.encoding
+    image = Image.fromarray(np.ascontiguousarray(pixels[..., :3]))
+    buf = BytesIO()
+    if settings.format == "webp":
+        image.save(buf, format="WEBP", lossless=True, method=settings.webp_method)
+    elif settings.format == "png":
+        # Tables are flat colours plus anti-aliased text, a palette keeps them sharp
+        image = image.quantize(colors=settings.colors, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+        image.save(buf, format="PNG", compress_level=settings.compress_level)
+    else:
+        image.save(buf, format="PNG", compress_level=settings.compress_level)
+    return buf.getvalue()
+
+
+def render_figure(fig: Figure, name: str, crop: Optional[CropBox] = None) -> BytesIO:
+    t0 = time.perf_counter()
+    canvas = fig.canvas if isinstance(fig.canvas, FigureCanvasAgg) else FigureCanvasAgg(fig)
+    canvas.draw()
+    pixels = np.asarray(canvas.buffer_rgba())
+    if crop is not None:
+        left, top, right, bottom = crop
+        pixels = pixels[top:bottom, left:right]
+    return encode_rendered(pixels, name, time.perf_counter() - t0)
+
+
+def encode_rendered(pixels: np.ndarray, name: str, draw_time: float) -> BytesIO:
+    # Encodes pixels drawn in draw_time seconds and records both under name
+    t0 = time.perf_counter()
+    data = encode_pixels(pixels)
+    encode_time = time.perf_counter() - t0
+
+    with _stats_lock:
+        stats = _stats.setdefault(name, EncodingStats())
+        stats.renders += 1
+        stats.raw_bytes += pixels.shape[0] * pixels.shape[1] * 3
+        stats.encoded_bytes += len(data)
+        stats.draw_time += draw_time
+        stats.encode_time += encode_time
+    logger.debug(f"Encoded {name} as {app_config.encoding.format}: {len(data)} bytes, drawn in {draw_time:.3f}s, encoded in {encode_time:.3f}s")
+
+    return BytesIO(data)
+
+
+def record_upload(name: str, size: int) -> None:
+    with _stats_lock:
+        stats = _stats.setdefault(name, EncodingStats())
+        stats.uploads += 1
+        stats.uploaded_bytes += size
+
+
+def get_encoding_stats() -> Dict[str, EncodingStats]:
+    with _stats_lock:
+        return {name: stats.model_copy() for name, stats in _stats.items()}
+
+
+def log_encoding_stats() -> None:
+    for name, stats in get_encoding_stats().items():
+        logger.info(
+            f"Images {name}: {stats.renders} renders, {stats.encoded_bytes} bytes encoded from {stats.raw_bytes} raw, "
+            f"{stats.draw_time:.3f}s drawing and {stats.encode_time:.3f}s encoding, "
+            f"{stats.uploads} uploads of {stats.uploaded_bytes} bytes"
+        )
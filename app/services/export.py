@@ -0,0 +1,174 @@
+import os
+import re
+import csv
+import uuid
+import asyncio
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from app.app_config import AppConfig
+from app.services.models import Driver
+from app.services.openf1 import OpenF1, FINISHED
+from app.services.strategy import StrategyIndex, get_strategy_index
+from app.services.timeline import stint_at
+from app.exceptions import ExportError
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:   # pyarrow is optional, exports are CSV only without it
+    pyarrow = None
+
+import logging
+logger = logging.getLogger(__name__)
+logger.info("Logging is configured.")
+
+app_config_path = os.getenv("APP_CONFIG_PATH", f"{Path(__file__).parent.parent.parent.resolve()}/app_config.json")
+app_config = AppConfig.from_json(app_config_path)
+
+FORMATS = ["csv", "parquet"] if pyarrow else ["csv"]
+
+# One row per driver and lap, with the stint the lap was driven on and the pit stop made on it
+COLUMNS = [
+    ("driver_number", "int"), ("name_acronym", "str"), ("team_name", "str"), ("lap_number", "int"), ("date_start", "str"),
+    ("lap_duration", "float"), ("duration_sector_1", "float"), ("duration_sector_2", "float"), ("duration_sector_3", "float"),
+    ("is_pit_out_lap", "bool"), ("stint_number", "int"), ("compound", "str"), ("tyre_age", "int"), ("pit_duration", "float"),
+]
+
+
+class ExportFile(BaseModel):
+    path: str
+    rows: Optional[int] = None   # None when a pre-built file was served
+    temporary: bool   # Deleted once uploaded
+
+
+def resolve_drivers(drivers: List[Driver], spec: Optional[str]) -> Optional[List[int]]:
+    # "VER, 44 LEC" -> [1, 16, 44], None exports every driver
+    if not spec or not spec.strip():
+        return None
+    by_key = {driver.name_acronym.upper(): driver.driver_number for driver in drivers}
+    by_key.update({str(driver.driver_number): driver.driver_number for driver in drivers})
+    driver_numbers = set()
+    for part in re.split(r"[,\s]+", spec.strip()):
+        if part and part.upper() not in by_key:
+            raise ExportError(f"`{part}` isn't a driver of this session")
+        if part:
+            driver_numbers.add(by_key[part.upper()])
+    return sorted(driver_numbers)
+
+
+def iter_chunks(laps: List[Dict], drivers: List[Driver], strategy_index: StrategyIndex, driver_numbers: Optional[List[int]], chunk_rows: int) -> Iterator[List[Tuple]]:
+    # Rows by driver then lap, chunk_rows at a time. Only references to the
+    # cached lap rows are grouped, the table itself exists one chunk at a time.
+    by_driver: Dict[int, List[Dict]] = {}
+    for lap in laps:
+        if lap.get("lap_number") is not None and (driver_numbers is None or lap.get("driver_number") in driver_numbers):
+            by_driver.setdefault(lap.get("driver_number"), []).append(lap)
+    driver_info = {driver.driver_number: driver for driver in drivers}
+
+    chunk = []
+    for driver_number in sorted(by_driver):
+        driver = driver_info.get(driver_number)
+        strategy = strategy_index.drivers.get(driver_number)
+        stints = sorted(strategy.stints.values(), key=lambda stint: stint.lap_start) if strategy else []
+        for lap in sorted(by_driver[driver_number], key=lambda lap: lap["lap_number"]):
+            lap_number = lap["lap_number"]
+            stint = stint_at(stints, lap_number)
+            pit = strategy.pits.get(lap_number) if strategy else None
+            chunk.append((
+                driver_number,
+                driver.name_acronym if driver else None,
+                driver.team_name if driver else None,
+                lap_number,
+                lap.get("date_start"),
+                lap.get("lap_duration"),
+                lap.get("duration_sector_1"),
+                lap.get("duration_sector_2"),
+                lap.get("duration_sector_3"),
+                lap.get("is_pit_out_lap"),
+                stint.stint_number if stint else None,
+                stint.compound if stint else None,
+                stint.tyre_age_at_start + lap_number - stint.lap_start if stint else None,
+                pit.pit_duration if pit else None,
+            ))
+            if len(chunk) >= chunk_rows:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def write_csv(path: Path, chunks: Iterator[List[Tuple]]) -> int:
+    rows = 0
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([name for name, _ in COLUMNS])
+        for chunk in chunks:
+            writer.writerows(chunk)
+            rows += len(chunk)
+    return rows
+
+
+def write_parquet(path: Path, chunks: Iterator[List[Tuple]]) -> int:
+    # Every chunk is written out as a row group of its own
+    types = {"int": pyarrow.int32(), "str": pyarrow.string(), "float": pyarrow.float64(), "bool": pyarrow.bool_()}
+    schema = pyarrow.schema([(name, types[kind]) for name, kind in COLUMNS])
+    rows = 0
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        for chunk in chunks:
+            columns = [pyarrow.array(values, type=field.type) for values, field in zip(zip(*chunk), schema)]
+            writer.write_batch(pyarrow.record_batch(columns, schema=schema))
+            rows += len(chunk)
+    return rows
+
+
+WRITERS = {"csv": write_csv, "parquet": write_parquet}
+_locks: Dict[str, asyncio.Lock] = {}
+
+
+def prune_exports(directory: Path, max_files: int) -> None:
+    # Least recently served pre-built files go first
+    files = [path for path in directory.iterdir() if path.suffix.lstrip(".") in WRITERS]
+    files.sort(key=lambda path: path.stat().st_mtime, reverse=True)
+    for path in files[max_files:]:
+        logger.info(f"Removing export {path.name}...")
+        path.unlink(missing_ok=True)
+
+
+async def export_session(session_key: int, drivers: List[Driver], driver_numbers: Optional[List[int]], fmt: str) -> ExportFile:
+    # Exports of finished sessions are built once and kept under data_dir,
+    # those of live sessions are built per request into a temporary file.
+    settings = app_config.export
+    directory = Path(settings.data_dir)
+    selection = "-".join(str(driver_number) for driver_number in driver_numbers) if driver_numbers else "all"
+    name = f"{session_key}_{selection}.{fmt}"
+    final = await OpenF1.get_session_state(session_key) == FINISHED
+
+    lock = _locks.setdefault(name, asyncio.Lock()) if final else asyncio.Lock()
+    async with lock:
+        path = directory / name
+        if final and path.exists():
+            logger.info(f"Using pre-built export {name}")
+            os.utime(path)
+            return ExportFile(path=str(path), temporary=False)
+
+        laps, strategy_index = await asyncio.gather(OpenF1.get_lap_times(session_key), get_strategy_index(session_key))
+        if not final:
+            path = directory / "tmp" / f"{uuid.uuid4().hex}_{name}"
+        part = path.with_name(f"{path.name}.part")
+        part.parent.mkdir(parents=True, exist_ok=True)
+
+        logger.info(f"Exporting {name}...")
+        chunks = iter_chunks(laps, drivers, strategy_index, driver_numbers, settings.chunk_rows)
+        try:
+            rows = await asyncio.to_thread(WRITERS[fmt], part, chunks)
+            os.replace(part, path)
+        finally:
+            part.unlink(missing_ok=True)
+        logger.info(f"Exported {rows} rows to {path}")
+
+        if final:
+            await asyncio.to_thread(prune_exports, directory, settings.max_cached_files)
+        return ExportFile(path=str(path), rows=rows, temporary=not final)
@@ -0,0 +1,253 @@
+import time
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from io import BytesIO
+from matplotlib.figure import Figure
+from pydantic import BaseModel
+
+from app.services.openf1 import OpenF1
+from app.services.cache import TTLCache
+from app.services.stages import StageGraph, StageResult
+from app.services.telemetry import parse_date_ms
+from app.services.encoding import render_figure, cache_key
+
+import logging
+logger = logging.getLogger(__name__)
+logger.info("Logging is configured.")
+
+# Encoded images keyed by the model they were rendered from
+rendered_images = TTLCache(f"{__name__}.rendered_images", ttl=3600, maxsize=32)
+
+# Laps started this long before the newest lap have their final times
+SETTLE_MS = 5 * 60 * 1000
+NUM_SECTORS = 3
+OVERALL_BEST_COLOR = '#B138DD'   # Purple
+PERSONAL_BEST_COLOR = '#2FBF4A'   # Green
+
+
+def format_lap_time(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "N/A"
+    minutes, seconds = divmod(seconds, 60)
+    return f"{int(minutes)}:{seconds:06.3f}" if minutes else f"{seconds:.3f}"
+
+
+class BestTime(BaseModel):
+    time: float
+    lap_number: int
+
+
+class DriverBests(BaseModel):
+    lap: Optional[BestTime] = None
+    sectors: List[Optional[BestTime]] = [None] * NUM_SECTORS
+
+    def apply(self, row: Dict) -> None:
+        # Running minima, applying the same row again changes nothing
+        lap_number = row.get("lap_number")
+        duration = row.get("lap_duration")
+        if duration and (self.lap is None or duration < self.lap.time):
+            self.lap = BestTime(time=duration, lap_number=lap_number)
+        for i in range(NUM_SECTORS):
+            sector = row.get(f"duration_sector_{i + 1}")
+            if sector and (self.sectors[i] is None or sector < self.sectors[i].time):
+                self.sectors[i] = BestTime(time=sector, lap_number=lap_number)
+
+    @property
+    def theoretical(self) -> Optional[float]:
+        # Sum of the best sectors, from whichever laps they were set on
+        if any(sector is None for sector in self.sectors):
+            return None
+        return round(sum(sector.time for sector in self.sectors), 3)
+
+
+class FastestIndex(BaseModel):
+    # Best lap and sectors of one session per driver, kept up to date with
+    # only the lap rows that can have changed since the last refresh: the laps
+    # from the oldest one still without a lap time, or the newest one seen.
+    session_key: int
+    drivers: Dict[int, DriverBests] = {}
+    newest_start: Optional[str] = None   # date_start of the newest lap seen
+    open_laps: Dict[str, str] = {}   # date_start of laps still without a lap time, by "driver:lap"
+    refreshed_at: float = 0.0
+
+    def lap_cursor(self) -> Optional[str]:
+        if not self.open_laps:
+            return self.newest_start
+        return min(self.open_laps.values(), key=parse_date_ms)
+
+    def apply_laps(self, rows: List[Dict]) -> None:
+        for row in rows:
+            if row.get("lap_number") is None:
+                continue
+            driver_number = row.get("driver_number")
+            self.drivers.setdefault(driver_number, DriverBests()).apply(row)
+
+            date_start = row.get("date_start")
+            if not date_start:
+                continue
+            key = f"{driver_number}:{row.get('lap_number')}"
+            if row.get("lap_duration") is None:
+                self.open_laps[key] = date_start
+            else:
+                self.open_laps.pop(key, None)
+            if self.newest_start is None or parse_date_ms(date_start) > parse_date_ms(self.newest_start):
+                self.newest_start = date_start
+
+        # Laps that never got a time (retirements, aborted laps) stop holding the cursor back
+        if self.newest_start is not None:
+            settled = parse_date_ms(self.newest_start) - SETTLE_MS
+            self.open_laps = {key: date for key, date in self.open_laps.items() if parse_date_ms(date) >= settled}
+
+    def overall_lap(self) -> Optional[float]:
+        laps = [bests.lap.time for bests in self.drivers.values() if bests.lap]
+        return min(laps) if laps else None
+
+    def overall_sectors(self) -> List[Optional[float]]:
+        overall = []
+        for i in range(NUM_SECTORS):
+            sectors = [bests.sectors[i].time for bests in self.drivers.values() if bests.sectors[i]]
+            overall.append(min(sectors) if sectors else None)
+        return overall
+
+
+# Fastest index per session key, snapshotted with the other caches
+indexes = TTLCache(f"{__name__}.indexes", ttl=7 * 24 * 3600, maxsize=32)
+_locks: Dict[int, asyncio.Lock] = {}
+
+
+async def get_fastest_index(session_key: int) -> FastestIndex:
+    lock = _locks.setdefault(session_key, asyncio.Lock())
+    async with lock:
+        index = indexes.get(session_key) or FastestIndex(session_key=session_key)
+        if index.refreshed_at:
+            # Never refreshed again once refreshed after the session's data is final
+            soft_ttl, _ = await OpenF1.get_cache_ttls("laps", session_key, index.refreshed_at)
+            if time.time() - index.refreshed_at < soft_ttl:
+                return index
+
+        logger.info(f"Refreshing fastest index of session {session_key} from lap started at {index.lap_cursor()}...")
+        laps_data = await OpenF1.get_laps_since(session_key, index.lap_cursor())
+        index.apply_laps(laps_data)
+        index.refreshed_at = time.time()
+        indexes.set(session_key, index)
+        logger.info(f"Finished refreshing fastest index: {len(laps_data)} lap rows applied.")
+        return index
+
+
+class Fastest(BaseModel):
+    title: Optional[str] = None
+    driver_names: Optional[Dict[int, str]] = None
+    bests: Optional[Dict[int, DriverBests]] = None
+    overall_lap: Optional[float] = None
+    overall_sectors: Optional[List[Optional[float]]] = None
+    as_of: Optional[float] = None
+
+    def order(self) -> List[int]:
+        # Drivers by best lap, the ones without a lap time last
+        return sorted(self.bests, key=lambda driver: (self.bests[driver].lap is None, self.bests[driver].lap.time if self.bests[driver].lap else 0, driver))
+
+    def to_image_bytes(self) -> BytesIO:
+        logger.info("Converting fastest laps to image bytes...")
+        key = cache_key(self)
+        cached = rendered_images.get(key)
+        if cached is not None:
+            logger.info("Using cached fastest laps image.")
+            return BytesIO(cached)
+
+        columns = ["Driver", "Best Lap", "Gap", "Lap", "S1", "S2", "S3", "Theoretical"]
+        rows, colors = [], []
+        for driver in self.order():
+            bests = self.bests[driver]
+            lap = bests.lap
+            gap = f"+{lap.time - self.overall_lap:.3f}" if lap and lap.time != self.overall_lap else ""
+            rows.append(
+                [self.driver_names.get(driver, str(driver)), format_lap_time(lap.time if lap else None), gap, str(lap.lap_number) if lap else ""]
+                + [f"{sector.time:.3f}" if sector else "N/A" for sector in bests.sectors]
+                + [format_lap_time(bests.theoretical)]
+            )
+            # Overall bests purple, the other personal bests green
+            colors.append(
+                ['white', OVERALL_BEST_COLOR if lap and lap.time == self.overall_lap else PERSONAL_BEST_COLOR if lap else 'white', '#AAAAAA', '#AAAAAA']
+                + [OVERALL_BEST_COLOR if sector and sector.time == overall else PERSONAL_BEST_COLOR if sector else 'white' for sector, overall in zip(bests.sectors, self.overall_sectors)]
+                + ['white']
+            )
+        theoretical = round(sum(self.overall_sectors), 3) if all(self.overall_sectors) else None
+        rows.append(["Session", format_lap_time(self.overall_lap), "", ""] + [f"{sector:.3f}" if sector else "N/A" for sector in self.overall_sectors] + [format_lap_time(theoretical)])
+        colors.append(['white', OVERALL_BEST_COLOR, 'white', 'white'] + [OVERALL_BEST_COLOR] * NUM_SECTORS + ['white'])
+
+        # The table fills a fixed axes, so no tight-bbox pass is needed
+        height = 0.3 * (len(rows) + 1) + 0.7
+        fig = Figure(figsize=(9, height))
+        fig.patch.set_facecolor('#333333')  # Dark grey background
+        ax = fig.add_axes((0.02, 0.02, 0.96, 1 - 0.7 / height))
+        ax.axis('off')
+        table = ax.table(cellText=rows, rowLabels=[str(i) for i in range(1, len(rows))] + [""], colLabels=columns, cellLoc='center', bbox=[0.03, 0, 0.97, 1])
+        table.auto_set_font_size(False)
+        table.set_fontsize(9)
+        for (row, col), cell in table.get_celld().items():
+            cell.set_linewidth(0.5)
+            if row == 0:
+                cell.set_facecolor('#222222')
+                cell.set_text_props(color='white', fontweight='bold')
+            else:
+                cell.set_facecolor('#444444' if row < len(rows) else '#222222')
+                cell.set_text_props(color=colors[row - 1][col] if col >= 0 else 'white', fontweight='bold' if col <= 0 or row == len(rows) else 'normal')
+
+        fig.text(0.5, 1 - 0.3 / height, self.title, color='white', fontweight='bold', ha='center', va='center')
+        if self.as_of:
+            fig.text(0.98, 1 - 0.3 / height, f"As of {datetime.fromtimestamp(self.as_of, tz=timezone.utc):%H:%M:%S} UTC", color='#AAAAAA', fontsize=8, ha='right', va='center')
+
+        buf = render_figure(fig, "fastest")
+        rendered_images.set(key, buf.getvalue())
+
+        logger.info("Finished converting fastest laps to image bytes.")
+
+        return buf
+
+
+class FastestBuilder:
+    def __init__(self, year: int, location: str, session_name: str = 'Qualifying'):
+        self.fastest = Fastest(title=f"{year} {location} {session_name} Fastest Laps")
+        self.year = year
+        self.location = location
+        self.session_name = session_name
+        self.session_key = None
+
+    async def get_session_key(self) -> None:
+        # Get session key from OpenF1 API
+        logger.info("Getting session key...")
+        session_key = await OpenF1.get_session_key(self.year, self.location, self.session_name)
+        logger.info("Finished getting session key.")
+        self.session_key = session_key
+
+    async def add_drivers(self) -> "FastestBuilder":
+        logger.info("Adding drivers to the fastest laps...")
+        drivers_data = await OpenF1.get_drivers(
+            self.year, self.location, self.session_name
+        )
+        self.fastest.driver_names = {data.driver_number: data.name_acronym for data in drivers_data}
+        logger.info("Finished adding drivers.")
+
+        return self
+
+    async def add_bests(self) -> "FastestBuilder":
+        logger.info("Adding bests from the fastest index...")
+        index = await get_fastest_index(self.session_key)
+        self.fastest.bests = {driver: bests.model_copy(deep=True) for driver, bests in index.drivers.items()}
+        self.fastest.overall_lap = index.overall_lap()
+        self.fastest.overall_sectors = index.overall_sectors()
+        self.fastest.as_of = index.refreshed_at
+        logger.info("Finished adding bests.")
+
+        return self
+
+    async def run_stages(self) -> Dict[str, StageResult]:
+        graph = StageGraph()
+        graph.add("session_key", self.get_session_key, required=True)
+        graph.add("drivers", self.add_drivers, required=True)
+        graph.add("bests", self.add_bests, deps=["session_key"], required=True)
+        return await graph.run()
+
+    def build(self) -> "Fastest":
+        return self.fastest
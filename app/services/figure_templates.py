@@ -0,0 +1,59 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Generic, Hashable, Iterator, List, TypeVar
+
+import logging
+logger = logging.getLogger(__name__)
+logger.info("Logging is configured.")
+
+T = TypeVar("T")
+
+
+class FigureTemplates(Generic[T]):
+    # Pre-styled figures kept per layout, so a render only swaps cell text and
+    # colours instead of building and styling a new figure. A template is
+    # checked out by one render at a time; concurrent renders of the same
+    # layout build extra templates, of which up to max_idle are kept.
+    # Templates that raised during a render are dropped, not reused.
+    def __init__(self, name: str, build: Callable[[Hashable], T], maxsize: int = 16, max_idle: int = 2):
+        self.name = name
+        self.build = build
+        self.maxsize = maxsize
+        self.max_idle = max_idle
+        self._idle: "OrderedDict[Hashable, List[T]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def checkout(self, layout: Hashable) -> Iterator[T]:
+        with self._lock:
+            idle = self._idle.get(layout)
+            template = idle.pop() if idle else None
+            if template is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if template is None:
+            logger.info(f"Building {self.name} template for layout {layout}")
+            template = self.build(layout)
+
+        yield template
+
+        with self._lock:
+            idle = self._idle.setdefault(layout, [])
+            if len(idle) < self.max_idle:
+                idle.append(template)
+            self._idle.move_to_end(layout)
+            while len(self._idle) > self.maxsize:
+                self._idle.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"layouts": len(self._idle), "hits": self.hits, "misses": self.misses}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._idle.clear()
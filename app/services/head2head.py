@@ -1,16 +1,118 @@
-import time
+from datetime import datetime, timezone
 from pydantic import BaseModel
 from typing import List, Dict, Optional, Union
 import pandas as pd
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from io import BytesIO
 
 from app.services.openf1 import OpenF1
+from app.services.cache import TTLCache
+from app.services.figure_templates import FigureTemplates
+from app.services.encoding import render_figure, tight_crop_box, cache_key
+from app.services.stages import StageGraph, StageResult
 
 import logging
 logger = logging.getLogger(__name__)
 logger.info("Logging is configured.")
 
+# Encoded images keyed by the model they were rendered from
+rendered_images = TTLCache(f"{__name__}.rendered_images", ttl=3600, maxsize=64)
+
+
+class Head2HeadTemplate:
+    # Figure and table styled once per layout (number of laps shown)
+    def __init__(self, num_laps: int):
+        num_columns = num_laps * 4   # Three sectors and the total per lap
+
+        # Create a figure with appropriate size
+        #fig_width = max(10, len(df.columns) * 0.8)
+        #fig_height = max(5, len(df) * 1.0)
+        self.fig = Figure(figsize=(15, 2))
+        self.fig.patch.set_facecolor('#333333')  # Dark grey background
+        ax = self.fig.subplots()
+        ax.set_facecolor('#333333')
+        ax.axis('tight')
+        ax.axis('off')
+
+        # Create the table with empty cells, filled in on every render
+        self.table = ax.table(
+            cellText=[[""] * num_columns for _ in range(2)],
+            rowLabels=["", ""],
+            colLabels=[""] * num_columns,
+            loc='center',
+            cellLoc='center'
+        )
+        self.cells = self.table.get_celld()
+
+        for key, cell in self.cells.items():
+            # Add grid lines
+            cell.set_linewidth(0.5)
+            cell.set_text_props(color='white')
+
+            # Separate laps by different background colors
+            if key[0] > 0 and key[1] % 8 <= 3:
+                cell.set_facecolor('#444444')
+            elif key[0] > 0 and key[1] % 8 > 3:
+                cell.set_facecolor('#555555')
+
+        # Style header cells
+        for i in range(num_columns):
+            header_cell = self.table[(0, i)]
+
+            # Separate laps by different background colors
+            if i % 8 <= 3:
+                header_cell.set_facecolor('#222222')
+            else:
+                header_cell.set_facecolor('#333333')
+
+            header_cell.set_text_props(fontweight='bold')
+
+        for i in range(2):
+            self.table[(i+1, -1)].set_text_props(fontweight='bold')
+
+        # Adjust table appearance
+        self.table.auto_set_font_size(False)
+        self.table.set_fontsize(9)
+        self.table.scale(1.2, 1.6)
+
+        self.as_of_text = self.fig.text(0.5, 0.9, "", color='#AAAAAA', fontsize=8, ha='center', visible=False)
+
+        # The layout never changes, so the tight crop is measured once with the
+        # widest driver acronyms and the as-of text shown instead of on every render
+        for i in range(2):
+            self.cells[(i+1, -1)].get_text().set_text("MMM")
+        self.as_of_text.set(text="As of 00:00:00 UTC", visible=True)
+        self.crop = tight_crop_box(self.fig)
+        self.as_of_text.set_visible(False)
+
+    def render(self, rows, row_labels: List[str], columns: List[str], driver_colors: List[str], as_of: Optional[str]) -> BytesIO:
+        for col_idx, column in enumerate(columns):
+            self.cells[(0, col_idx)].get_text().set_text(column)
+
+        for row_idx, row in enumerate(rows):
+            self.cells[(row_idx+1, -1)].get_text().set_text(row_labels[row_idx])
+            # Apply driver colors to index cells
+            self.cells[(row_idx+1, -1)].set_facecolor(driver_colors[row_idx])
+            for col_idx, value in enumerate(row):
+                cell = self.cells[(row_idx+1, col_idx)]
+                cell.get_text().set_text(value)
+                if row_idx != 1:
+                    continue
+                # Second driver row holds the deltas to the first driver
+                try:
+                    value = float(cell.get_text().get_text())
+                    cell.set_text_props(color='#FF3333' if value > 0 else '#49FF33')
+                except ValueError:
+                    cell.set_text_props(color='white')
+
+        self.as_of_text.set_text(as_of or "")
+        self.as_of_text.set_visible(as_of is not None)
+
+        return render_figure(self.fig, "head2head", self.crop)
+
+
+templates = FigureTemplates(f"{__name__}.templates", Head2HeadTemplate)
+
 class Head2Head(BaseModel):
     driver_names: Optional[List[str]] = None
     driver_numbers: Optional[List[int]] = None
@@ -19,9 +121,15 @@ class Head2Head(BaseModel):
     sector_times: Optional[List[List[List[str]]]] = None
     current_interval: Optional[Union[str, float]] = None
     laps: Optional[List[int]] = None
+    as_of: Optional[float] = None   # Fetch time of the oldest data shown
     
     def to_image_bytes(self) -> BytesIO:
         logger.info("Converting head2head to image bytes...")
+        key = cache_key(self)
+        cached = rendered_images.get(key)
+        if cached is not None:
+            logger.info("Using cached head2head image.")
+            return BytesIO(cached)
 
         data = {}
         
@@ -44,86 +152,13 @@ class Head2Head(BaseModel):
         df = pd.DataFrame(data, index=self.driver_names)
         df.columns = pd.MultiIndex.from_tuples(df.columns, names=['Lap', ''])
         
-        # Format numbers for better display
-        #df = df.round(3)
-        
-        # Create a figure with appropriate size
-        #fig_width = max(10, len(df.columns) * 0.8)
-        #fig_height = max(5, len(df) * 1.0)
-        fig, ax = plt.subplots(figsize=(15, 2))
-        fig.patch.set_facecolor('#333333')  # Dark grey background
-        ax.set_facecolor('#333333')
-        ax.axis('tight')
-        ax.axis('off')
-        
         # Create flattened column headers
         flattened_columns = [f"{col[0]}\n{col[1]}" for col in df.columns]
-        
-        # Create the table
-        table = ax.table(
-            cellText=df.values,
-            rowLabels=df.index,
-            colLabels=flattened_columns,
-            loc='center',
-            cellLoc='center'
-        )
-        
-        # Add grid lines
-        for key, cell in table.get_celld().items():
-            cell.set_linewidth(0.5)
-            
-        # Apply dark theme to all cells
-        cells = table.get_celld()
-        for key, cell in cells.items():
-            #print(key)
-            #print(cell)
-            #print(cell.get_text().get_text())
-            if key[0] == 2 and key[1] >= 0: # Second driver row
-                try:
-                    value = float(cell.get_text().get_text())
-                    if value > 0:
-                        cell.set_text_props(color='#FF3333')
-                    else:
-                        cell.set_text_props(color='#49FF33')
-                except ValueError:
-                    cell.set_text_props(color='white')
-            else:
-                cell.set_text_props(color='white')
-            
-            # Separate laps by different background colors
-            if key[0] > 0 and key[1] % 8 <= 3:
-                cell.set_facecolor('#444444')
-            elif key[0] > 0 and key[1] % 8 > 3:
-                cell.set_facecolor('#555555')
-            
-        # Style header cells
-        for i in range(len(flattened_columns)):
-            header_cell = table[(0, i)]
+        as_of = f"As of {datetime.fromtimestamp(self.as_of, tz=timezone.utc):%H:%M:%S} UTC" if self.as_of else None
 
-            # Separate laps by different background colors
-            if i % 8 <= 3:
-                header_cell.set_facecolor('#222222')
-            else:
-                header_cell.set_facecolor('#333333')
-                
-            header_cell.set_text_props(fontweight='bold')
-        
-        # Apply driver colors to index cells
-        for i, color in enumerate(self.driver_colors):
-            row_cell = table[(i+1, -1)]
-            row_cell.set_facecolor(color)
-            row_cell.set_text_props(color='white', fontweight='bold')
-        
-        # Adjust table appearance
-        table.auto_set_font_size(False)
-        table.set_fontsize(9)
-        table.scale(1.2, 1.6)
-
-        # Save to BytesIO
-        buf = BytesIO()
-        plt.savefig(buf, format='png', bbox_inches='tight')
-        buf.seek(0)
-        plt.close(fig)
+        with templates.checkout(len(self.laps)) as template:
+            buf = template.render(df.values, list(df.index), flattened_columns, self.driver_colors, as_of)
+        rendered_images.set(key, buf.getvalue())
         
         logger.info("Finished converting head2head to image bytes.")
         
@@ -146,6 +181,11 @@ class Head2HeadBuilder:
         logger.info("Finished getting session key.")
         self.session_key = session_key
 
+    def _update_as_of(self, fetched_at: float) -> None:
+        # The comparison is only as recent as its oldest data
+        if self.h2h.as_of is None or fetched_at < self.h2h.as_of:
+            self.h2h.as_of = fetched_at
+
     async def add_drivers(self, driver_number_1: int, driver_number_2: int) -> "Head2HeadBuilder":
         logger.info("Adding driver numbers to the leaderboard...")
         drivers_data = await OpenF1.get_drivers(
@@ -172,7 +212,8 @@ class Head2HeadBuilder:
     
     async def add_laps_and_sectors_time(self, driver_number_1: int, driver_number_2: int, num_of_laps: int) -> "Head2HeadBuilder":
         logger.info("Adding lap and sector times to the leaderboard...")
-        lap_data = await OpenF1.get_lap_times(self.session_key)
+        lap_data, fetched_at = await OpenF1.get_lap_times.with_age(self.session_key)
+        self._update_as_of(fetched_at)
 
         driver1_laps = []
         driver2_laps = []
@@ -230,7 +271,8 @@ class Head2HeadBuilder:
 
     async def add_interval(self, driver_number_1: int, driver_number_2: int) -> "Head2HeadBuilder":
         logger.info("Adding intervals to the leaderboard...")
-        intervals_data = await OpenF1.get_intervals(self.session_key)
+        intervals_data, fetched_at = await OpenF1.get_intervals.with_age(self.session_key)
+        self._update_as_of(fetched_at)
 
         driver1_curr_gap_to_leader = 0
         driver2_curr_gap_to_leader = 0
@@ -250,5 +292,13 @@ class Head2HeadBuilder:
 
         return self
     
+    async def run_stages(self, driver_number_1: int, driver_number_2: int, num_of_laps: int) -> Dict[str, StageResult]:
+        graph = StageGraph()
+        graph.add("session_key", self.get_session_key, required=True)
+        graph.add("drivers", lambda: self.add_drivers(driver_number_1, driver_number_2), required=True)
+        graph.add("laps", lambda: self.add_laps_and_sectors_time(driver_number_1, driver_number_2, num_of_laps), deps=["session_key"], required=True)
+        graph.add("intervals", lambda: self.add_interval(driver_number_1, driver_number_2), deps=["session_key"])
+        return await graph.run()
+
     def build(self) -> "Head2Head":
         return self.h2h
\ No newline at end of file
@@ -1,16 +1,104 @@
-import time
+from datetime import datetime, timezone
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import pandas as pd
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from io import BytesIO
 
 from app.services.openf1 import OpenF1
+from app.services.cache import TTLCache
+from app.services.figure_templates import FigureTemplates
+from app.services.encoding import render_figure, tight_crop_box, cache_key
+from app.services.stages import StageGraph, StageResult
+from app.services.strategy import get_strategy_index
+from app.services.timeline import get_position_index, get_interval_index, get_lap_index, get_pit_index, stint_at, resolve_as_of
+from app.exceptions import AsOfError
 
 import logging
 logger = logging.getLogger(__name__)
 logger.info("Logging is configured.")
 
+# Encoded images keyed by the model they were rendered from
+rendered_images = TTLCache(f"{__name__}.rendered_images", ttl=3600, maxsize=64)
+
+
+class LiveTimingTemplate:
+    # Figure and table styled once per layout (columns shown, number of drivers)
+
+    # Custom column widths by position
+    COL_WIDTHS = {
+        0: 0.02,  # Color column
+        1: 0.08,  # Position
+        2: 0.1,  # Driver No.
+        3: 0.12,  # Driver Name
+        4: 0.14,  # Team Name
+        5: 0.1,  # Interval
+        6: 0.14,  # Gap to Leader
+        7: 0.08,  # Pit Stops
+        8: 0.14,  # Tyre Compound
+        9: 0.08   # Tyre Age
+    }
+
+    def __init__(self, layout: Tuple[Tuple[str, ...], int]):
+        columns, num_rows = layout
+
+        # Create a table figure with dark background
+        self.fig = Figure(figsize=(12, 6))
+        self.fig.patch.set_facecolor('#333333')  # Dark grey background
+        ax = self.fig.subplots()
+        ax.set_facecolor('#333333')
+        ax.axis('tight')
+        ax.axis('off')
+
+        # Create the table with empty cells, filled in on every render
+        self.table = ax.table(cellText=[[""] * len(columns) for _ in range(num_rows)], colLabels=list(columns), loc='center')
+        self.cells = self.table.get_celld()
+
+        # Apply custom widths and the dark theme to all cells
+        for (row, col), cell in self.cells.items():
+            cell.set_width(self.COL_WIDTHS.get(col, 0.1))  # Default width of 0.1 if not specified
+            cell.set_text_props(color='white')
+            cell.set_facecolor('#333333')
+
+        # Set header row style
+        for col in range(len(columns)):
+            self.cells[(0, col)].set_facecolor('#222222')
+            self.cells[(0, col)].set_text_props(fontweight='bold')
+
+        # Adjust table appearance
+        self.table.auto_set_font_size(False)
+        self.table.set_fontsize(9)
+        self.table.scale(1, 1.2)
+
+        self.as_of_text = self.fig.text(0.5, 0.95, "", color='#AAAAAA', fontsize=8, ha='center', visible=False)
+        self.note_text = self.fig.text(0.5, 0.02, "", color='#AAAAAA', fontsize=8, ha='center', visible=False)
+
+        # The layout never changes, so the tight crop is measured once with both
+        # texts shown instead of on every render
+        self.as_of_text.set(text="As of 00:00:00 UTC", visible=True)
+        self.note_text.set(text="N/A: Interval, Gap to Leader timed out", visible=True)
+        self.crop = tight_crop_box(self.fig)
+        self.as_of_text.set_visible(False)
+        self.note_text.set_visible(False)
+
+    def render(self, rows, driver_colors: List[Optional[str]], as_of: Optional[str], note: Optional[str]) -> BytesIO:
+        for row_idx, row in enumerate(rows):
+            for col_idx, value in enumerate(row):
+                self.cells[(row_idx + 1, col_idx)].get_text().set_text(value)
+            # Color the cells in the first column with driver colors
+            color = driver_colors[row_idx] if row_idx < len(driver_colors) and driver_colors[row_idx] else '#333333'
+            self.cells[(row_idx + 1, 0)].set_facecolor(color)
+
+        self.as_of_text.set_text(as_of or "")
+        self.as_of_text.set_visible(as_of is not None)
+        self.note_text.set_text(note or "")
+        self.note_text.set_visible(note is not None)
+
+        return render_figure(self.fig, "live_timing", self.crop)
+
+
+templates = FigureTemplates(f"{__name__}.templates", LiveTimingTemplate)
+
 
 class LiveTiming(BaseModel):
     driver_numbers: Optional[List[int]] = None
@@ -23,10 +111,18 @@ class LiveTiming(BaseModel):
     pit_stops: Optional[Dict[int, int]] = None
     tyres_compound: Optional[Dict[int, str]] = None
     tyres_age: Optional[Dict[int, int]] = None
+    missing: Optional[Dict[str, str]] = None   # Column name -> why its data is missing
+    as_of: Optional[float] = None   # Fetch time of the oldest data shown
+    at_label: Optional[str] = None   # Lap or time shown, when not showing the latest data
 
 
     def to_image_bytes(self) -> BytesIO:
         logger.info("Converting live timing to image bytes...")
+        key = cache_key(self)
+        cached = rendered_images.get(key)
+        if cached is not None:
+            logger.info("Using cached live timing image.")
+            return BytesIO(cached)
         drivers_data = []
         for driver in self.driver_numbers:
             driver_data = {
@@ -41,6 +137,8 @@ class LiveTiming(BaseModel):
             "Tyre Compound": self.tyres_compound.get(driver) if self.tyres_compound else None,
             "Tyre Age": self.tyres_age.get(driver) if self.tyres_age else None
             }
+            for column in (self.missing or {}):
+                driver_data[column] = "N/A"
             drivers_data.append(driver_data)
         
         # Convert the data to Pandas DataFrame
@@ -54,64 +152,18 @@ class LiveTiming(BaseModel):
         
         # Insert empty column at the beginning
         df.insert(0, "", [""] * len(df))
-        
-        # Create a table figure with dark background
-        fig, ax = plt.subplots(figsize=(12, 6))
-        fig.patch.set_facecolor('#333333')  # Dark grey background
-        ax.set_facecolor('#333333')
-        ax.axis('tight')
-        ax.axis('off')
-        
-        # Create the table
-        table = ax.table(cellText=df.values, colLabels=df.columns, loc='center')
-        
-        # Define custom column widths
-        col_widths = {
-            0: 0.02,  # Color column
-            1: 0.08,  # Position
-            2: 0.1,  # Driver No.
-            3: 0.12,  # Driver Name
-            4: 0.14,  # Team Name
-            5: 0.1,  # Interval
-            6: 0.14,  # Gap to Leader
-            7: 0.08,  # Pit Stops
-            8: 0.14,  # Tyre Compound
-            9: 0.08   # Tyre Age
-        }
-        
-        # Apply custom widths to each column
-        for col in range(len(df.columns)):
-            width = col_widths.get(col, 0.1)  # Default width of 0.1 if not specified
-            for row in range(len(df) + 1):  # +1 for header row
-                cell = table.get_celld().get((row, col))
-                if cell:
-                    cell.set_width(width)
-        
-        # Apply dark theme to all cells
-        cells = table.get_celld()
-        for key, cell in cells.items():
-            cell.set_text_props(color='white')
-            cell.set_facecolor('#333333')
-            
-        # Set header row style
-        for col in range(len(df.columns)):
-            cells[(0, col)].set_facecolor('#222222')
-            cells[(0, col)].set_text_props(fontweight='bold')
-            
-        # Color the cells in the first column with driver colors
-        for row_idx in range(len(df)):
-            color = driver_colors[row_idx] if row_idx < len(driver_colors) and driver_colors[row_idx] else '#333333'
-            cells[(row_idx+1, 0)].set_facecolor(color)
-        
-        # Adjust table appearance
-        table.auto_set_font_size(False)
-        table.set_fontsize(9)
-        table.scale(1, 1.2)
 
-        buf = BytesIO()
-        plt.savefig(buf, format='png', bbox_inches='tight')
-        buf.seek(0)
-        plt.close(fig)
+        as_of = self.at_label or (f"As of {datetime.fromtimestamp(self.as_of, tz=timezone.utc):%H:%M:%S} UTC" if self.as_of else None)
+        note = None
+        if self.missing:
+            reasons = {}
+            for column, reason in self.missing.items():
+                reasons.setdefault(reason, []).append(column)
+            note = "N/A: " + "; ".join(f"{', '.join(columns)} {reason}" for reason, columns in reasons.items())
+
+        with templates.checkout((tuple(df.columns), len(df))) as template:
+            buf = template.render(df.values, driver_colors, as_of, note)
+        rendered_images.set(key, buf.getvalue())
 
         #plt.show()
         logger.info("Finished converting live timing to image bytes.")
@@ -120,12 +172,21 @@ class LiveTiming(BaseModel):
     
 
 class LiveTimingBuilder:
-    def __init__(self, year: int, location: str, session_name: str = 'Race'):
+    # Live timing columns filled by each optional stage
+    STAGE_COLUMNS = {
+        "intervals": ["Interval", "Gap to Leader"],
+        "pit_stops": ["Pit Stops"],
+        "tyres": ["Tyre Compound", "Tyre Age"],
+    }
+
+    def __init__(self, year: int, location: str, session_name: str = 'Race', as_of: Optional[str] = None):
         self.live_timing = LiveTiming()
         self.year = year
         self.location = location
         self.session_name = session_name
         self.session_key = None   
+        self.as_of = as_of   # Lap or time to show instead of the latest data
+        self.at_ms = None
 
     async def get_session_key(self) -> None:
         # Get session key from OpenF1 API
@@ -134,6 +195,16 @@ class LiveTimingBuilder:
         logger.info("Finished getting session key.")
         self.session_key = session_key
 
+    async def resolve_as_of(self) -> None:
+        logger.info(f"Resolving live timing as of {self.as_of}...")
+        self.at_ms, self.live_timing.at_label = await resolve_as_of(self.session_key, self.as_of)
+        logger.info(f"Finished resolving live timing as of {self.as_of}.")
+
+    def _update_as_of(self, fetched_at: float) -> None:
+        # The table is only as recent as its oldest data
+        if self.live_timing.as_of is None or fetched_at < self.live_timing.as_of:
+            self.live_timing.as_of = fetched_at
+
     async def add_drivers(self) -> "LiveTimingBuilder":
         logger.info("Adding driver numbers to the live timing...")
         drivers_data = await OpenF1.get_drivers(
@@ -161,7 +232,16 @@ class LiveTimingBuilder:
 
     async def add_positions(self):
         logger.info("Adding position data to the live timing...")
-        position_data = await OpenF1.get_position(self.session_key)
+        if self.at_ms is not None:
+            index = await get_position_index(self.session_key)
+            self.live_timing.positions = index.at(self.at_ms)
+            if not self.live_timing.positions:
+                raise AsOfError("There are no positions yet at that point of the session")
+            logger.info("Finished adding position data.")
+            return self
+
+        position_data, fetched_at = await OpenF1.get_position.with_age(self.session_key)
+        self._update_as_of(fetched_at)
 
         processed_data = {}
         #position_data.sort(key=lambda x: x.get("date"))
@@ -176,7 +256,16 @@ class LiveTimingBuilder:
 
     async def add_intervals(self):
         logger.info("Adding intervals to the live timing...")
-        intervals_data = await OpenF1.get_intervals(self.session_key)
+        if self.at_ms is not None:
+            index = await get_interval_index(self.session_key)
+            state = index.at(self.at_ms)
+            self.live_timing.intervals = {driver_number: interval for driver_number, (interval, _) in state.items()}
+            self.live_timing.gaps_to_leader = {driver_number: gap for driver_number, (_, gap) in state.items()}
+            logger.info("Finished adding intervals.")
+            return self
+
+        intervals_data, fetched_at = await OpenF1.get_intervals.with_age(self.session_key)
+        self._update_as_of(fetched_at)
 
         intervals = {}
         gaps_to_leader = {}
@@ -193,12 +282,18 @@ class LiveTimingBuilder:
 
     async def add_pit_stops(self):
         logger.info("Adding pit stops data to the live timing...")
-        pit_stops_data = await OpenF1.get_pit_stops(self.session_key)
+        if self.at_ms is not None:
+            pit_index = await get_pit_index(self.session_key)
+            self.live_timing.pit_stops = {driver_number: count for driver_number, count in pit_index.count_at(self.at_ms).items() if count}
+            logger.info("Finished adding pit stops data.")
+            return self
+
+        index = await get_strategy_index(self.session_key)
 
         pit_stops = {}
-        for data in pit_stops_data:
-            driver_number = data.get("driver_number")
-            pit_stops[driver_number] = int(pit_stops.get(driver_number, 0) + 1)
+        for driver_number, strategy in index.drivers.items():
+            if strategy.pits:
+                pit_stops[driver_number] = len(strategy.pits)
 
         self.live_timing.pit_stops = pit_stops
         logger.info("Finished adding pit stops data.")
@@ -207,14 +302,28 @@ class LiveTimingBuilder:
 
     async def add_tyres(self):
         logger.info("Adding tyres data to the live timing...")
-        tyres_data = await OpenF1.get_tyres(self.session_key)
+        index = await get_strategy_index(self.session_key)
 
         tyres_compound = {}
         tyres_age = {}
-        for data in tyres_data:
-            driver_number = data.get("driver_number")
-            tyres_compound[driver_number] = data.get("compound")
-            tyres_age[driver_number] = int(data.get("tyre_age_at_start") + data.get("lap_end") - data.get("lap_start"))
+        if self.at_ms is not None:
+            # Stints are by lap, so find each driver's lap at that time first
+            lap_index = await get_lap_index(self.session_key)
+            for driver_number, lap in lap_index.at(self.at_ms).items():
+                strategy = index.drivers.get(driver_number)
+                stints = sorted(strategy.stints.values(), key=lambda stint: stint.lap_start) if strategy else []
+                stint = stint_at(stints, lap)
+                if stint is None:
+                    continue
+                tyres_compound[driver_number] = stint.compound
+                tyres_age[driver_number] = stint.tyre_age_at_start + lap - stint.lap_start
+        else:
+            for driver_number, strategy in index.drivers.items():
+                stint = strategy.current_stint()
+                if stint is None:
+                    continue
+                tyres_compound[driver_number] = stint.compound
+                tyres_age[driver_number] = stint.tyre_age
 
         self.live_timing.tyres_compound = tyres_compound
         self.live_timing.tyres_age = tyres_age
@@ -222,5 +331,31 @@ class LiveTimingBuilder:
 
         return self
 
+    async def run_stages(self, selected_fields: List[str]) -> Dict[str, StageResult]:
+        graph = StageGraph()
+        graph.add("session_key", self.get_session_key, required=True)
+        graph.add("drivers", self.add_drivers, required=True)
+        deps = ["session_key"]
+        if self.as_of:
+            graph.add("as_of", self.resolve_as_of, deps=["session_key"], required=True)
+            deps = ["as_of"]
+        graph.add("positions", self.add_positions, deps=deps, required=True)
+        if "Intervals" in selected_fields:
+            graph.add("intervals", self.add_intervals, deps=deps)
+        if "Pit Stops" in selected_fields:
+            graph.add("pit_stops", self.add_pit_stops, deps=deps)
+        if "Tyres" in selected_fields:
+            graph.add("tyres", self.add_tyres, deps=deps)
+        results = await graph.run()
+
+        missing = {}
+        for name, columns in self.STAGE_COLUMNS.items():
+            if name in results and results[name].status != "ok":
+                for column in columns:
+                    missing[column] = "timed out" if results[name].status == "timeout" else "unavailable"
+        self.live_timing.missing = missing or None
+
+        return results
+
     def build(self) -> "LiveTiming":
         return self.live_timing
\ No newline at end of file
@@ -1,3 +1,4 @@
+from typing import List, Optional
 from pydantic import BaseModel, Field
 
 
@@ -17,4 +18,29 @@ class Location(BaseModel):
     meeting_key: int = Field(...)
     meeting_name: str = Field(...)
     location: str = Field(...)
-    date_start: str = Field(...)   # Query need to be sorted by date_start
\ No newline at end of file
+    date_start: str = Field(...)   # Query need to be sorted by date_start
+
+class SessionInfo(BaseModel):
+    session_key: int = Field(...)
+    session_name: str = Field(...)
+    date_start: str = Field(...)
+    date_end: str = Field(...)
+    circuit_key: Optional[int] = Field(default=None)
+
+
+class Subscription(BaseModel):
+    channel_id: int = Field(...)   # One subscription per channel
+    guild_id: int = Field(...)
+    session_key: int = Field(...)
+    year: int = Field(...)
+    location: str = Field(...)
+    session_name: str = Field(...)
+    team_radio: bool = Field(default=False)
+
+
+class CircuitOutline(BaseModel):
+    circuit: str = Field(...)   # OpenF1 circuit key, or the location when it's unknown
+    session_key: int = Field(...)   # Session, driver and lap the outline was traced from
+    driver_number: int = Field(...)
+    lap_number: int = Field(...)
+    points: List[List[float]] = Field(...)   # Simplified [x, y] samples
@@ -1,14 +1,30 @@
 import os
+import gzip
+import json
+import time
+import zlib
+import math
+from collections import OrderedDict
+from datetime import datetime
 from pathlib import Path
+from urllib.parse import urlencode
 import aiohttp
-from async_lru import alru_cache
-from typing import Dict, Any
+from pydantic import BaseModel
+from pymongo import ReturnDocument
+from typing import Dict, Any, Optional, Tuple
 
 from app.app_config import AppConfig
 from app.database import db
-from app.services.models import Driver, Location
+from app.services.models import Driver, Location, SessionInfo
+from app.services.cache import async_ttl_cache
+from app.services.repository_cache import repository_cache
 from app.exceptions import OpenF1Error, DatabaseError
 
+try:
+    import brotli
+except ImportError:   # brotli is optional, only gzip/deflate are negotiated without it
+    brotli = None
+
 import logging
 logger = logging.getLogger(__name__)
 logger.info("Logging is configured.")
@@ -16,25 +32,186 @@ logger.info("Logging is configured.")
 app_config_path = os.getenv("APP_CONFIG_PATH", f"{Path(__file__).parent.parent.parent.resolve()}/app_config.json")
 app_config = AppConfig.from_json(app_config_path)
 
+ACCEPT_ENCODING = "gzip, deflate, br" if brotli else "gzip, deflate"
+
+# Session states, they decide how long a session's data is cached
+SCHEDULED = "scheduled"
+LIVE = "live"
+FINISHED = "finished"
+
+
+def session_state(session: Optional[SessionInfo], at: Optional[float] = None) -> str:
+    # Unknown sessions are treated as live, so their data gets the short TTLs
+    at = at or time.time()
+    if session is None:
+        return LIVE
+    if at < datetime.fromisoformat(session.date_start).timestamp():
+        return SCHEDULED
+    if at >= datetime.fromisoformat(session.date_end).timestamp() + app_config.cache.final_after:
+        return FINISHED
+    return LIVE
+
+
+def session_ttls(endpoint: str):
+    # TTL policy of the caches of per-session endpoints
+    async def policy(session_key: int, *args, **kwargs) -> Tuple[float, float]:
+        return await OpenF1.get_cache_ttls(endpoint, session_key)
+    return policy
+
+
+class ConditionalEntry(BaseModel):
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    result: Any = None
+    wire_bytes: int = 0
+    decoded_bytes: int = 0
+    decode_time: float = 0.0
+
+
+class EndpointTransferStats(BaseModel):
+    requests: int = 0
+    not_modified: int = 0
+    wire_bytes: int = 0
+    decoded_bytes: int = 0
+    decode_time: float = 0.0
+    saved_wire_bytes: int = 0   # Bodies not downloaded thanks to 304
+    saved_decode_time: float = 0.0   # Parsing skipped thanks to 304
+
+
+class OpenF1Client:
+    # Keeps the ETag/Last-Modified validators and the decoded result of the
+    # latest 200 response per URL, so unchanged data comes back as a 304 and
+    # is reused without downloading or parsing the body again. A 304 returns a
+    # shallow copy of the list, the rows in it are shared and mustn't be mutated.
+    # Cursor fetches pass conditional=False, their URL changes every poll.
+    max_entries = 512
+    _entries: "OrderedDict[str, ConditionalEntry]" = OrderedDict()
+    _stats: Dict[str, EndpointTransferStats] = {}
+
+    @staticmethod
+    def _decompress(body: bytes, encoding: str) -> bytes:
+        encoding = (encoding or "identity").lower()
+        if encoding == "gzip":
+            return gzip.decompress(body)
+        if encoding == "deflate":
+            return zlib.decompress(body)
+        if encoding == "br" and brotli:
+            return brotli.decompress(body)
+        return body
+
+    @classmethod
+    async def get(cls, endpoint: str, params: Dict[str, Any], description: str, conditional: bool = True):
+        url = f"{app_config.openf1.url}/{endpoint}"
+        key = f"{url}?{urlencode(sorted(params.items()))}"
+        stats = cls._stats.setdefault(endpoint, EndpointTransferStats())
+        entry = cls._entries.get(key) if conditional else None
+
+        headers = {"Accept-Encoding": ACCEPT_ENCODING}
+        if entry and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry and entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+
+        async with aiohttp.ClientSession(auto_decompress=False) as session:
+            async with session.get(url, params=params, headers=headers) as r:
+                stats.requests += 1
+                if r.status == 304 and entry:
+                    stats.not_modified += 1
+                    stats.saved_wire_bytes += entry.wire_bytes
+                    stats.saved_decode_time += entry.decode_time
+                    cls._entries.move_to_end(key)
+                    return entry.result.copy()
+                elif r.status == 200:
+                    raw = await r.read()
+                    t0 = time.perf_counter()
+                    body = cls._decompress(raw, r.headers.get("Content-Encoding"))
+                    result = json.loads(body)
+                    decode_time = time.perf_counter() - t0
+
+                    stats.wire_bytes += len(raw)
+                    stats.decoded_bytes += len(body)
+                    stats.decode_time += decode_time
+
+                    etag = r.headers.get("ETag")
+                    last_modified = r.headers.get("Last-Modified")
+                    if conditional and (etag or last_modified):
+                        cls._entries[key] = ConditionalEntry(
+                            etag=etag,
+                            last_modified=last_modified,
+                            result=result,
+                            wire_bytes=len(raw),
+                            decoded_bytes=len(body),
+                            decode_time=decode_time
+                        )
+                        cls._entries.move_to_end(key)
+                        while len(cls._entries) > cls.max_entries:
+                            cls._entries.popitem(last=False)
+                    return result
+                else:
+                    text = cls._decompress(await r.read(), r.headers.get("Content-Encoding")).decode(errors="replace")
+                    logger.error(f"Error getting {description}: {r.status} - {text}")
+                    raise OpenF1Error(f"Error getting {description}: {r.status} - {text}")
+
+    @classmethod
+    def get_transfer_stats(cls) -> Dict[str, EndpointTransferStats]:
+        return {endpoint: stats.model_copy() for endpoint, stats in cls._stats.items()}
+
+    @classmethod
+    def log_transfer_stats(cls) -> None:
+        for endpoint, stats in cls._stats.items():
+            logger.info(
+                f"OpenF1 /{endpoint}: {stats.requests} requests, {stats.not_modified} not modified, "
+                f"{stats.wire_bytes} bytes transferred ({stats.decoded_bytes} decoded), "
+                f"{stats.saved_wire_bytes} bytes and {stats.saved_decode_time:.3f}s of decoding saved"
+            )
+
+
 class OpenF1:
 
     @staticmethod
-    @alru_cache(ttl=3600)
+    @async_ttl_cache(ttl=3600)
     async def get_session_key(year: int, location: str, session_name: str):
-        url = f"{app_config.openf1.url}/sessions"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params={"year": year, "location": location, "session_name": session_name}) as r:
-                if r.status == 200:
-                    result = await r.json()
-                    if len(result) == 0:
-                        return None
-                    return result[0].get("session_key")
-                else:
-                    logger.error(f"Error getting session key: {r.status} - {await r.text()}")
-                    raise OpenF1Error(f"Error getting session key: {r.status} - {await r.text()}")
+        result = await OpenF1Client.get("sessions", {"year": year, "location": location, "session_name": session_name}, "session key")
+        if len(result) == 0:
+            return None
+        OpenF1.get_session.cache_set(SessionInfo(**result[0]), result[0].get("session_key"))
+        return result[0].get("session_key")
 
     @staticmethod
-    @alru_cache(ttl=3600)
+    @async_ttl_cache(ttl=3600)
+    async def get_session(session_key: int) -> Optional[SessionInfo]:
+        result = await OpenF1Client.get("sessions", {"session_key": session_key}, "session")
+        if len(result) == 0:
+            return None
+        return SessionInfo(**result[0])
+
+    @staticmethod
+    async def get_session_state(session_key: int, at: Optional[float] = None) -> str:
+        try:
+            session = await OpenF1.get_session(session_key)
+        except OpenF1Error as e:
+            logger.warning(f"Error getting session {session_key}, treating it as live: {e}")
+            session = None
+        return session_state(session, at)
+
+    @staticmethod
+    async def get_cache_ttls(endpoint: str, session_key: int, fetched_at: Optional[float] = None) -> Tuple[float, float]:
+        # Soft and hard TTL of an endpoint's data of a session fetched at fetched_at (now by default):
+        # final data of finished sessions never expires, nothing is published before the
+        # start of scheduled sessions, and live sessions use the endpoint's configured TTLs.
+        fetched_at = fetched_at or time.time()
+        state = await OpenF1.get_session_state(session_key, fetched_at)
+        if state == FINISHED:
+            return math.inf, math.inf
+        if state == SCHEDULED:
+            session = await OpenF1.get_session(session_key)
+            until_start = datetime.fromisoformat(session.date_start).timestamp() - fetched_at
+            return until_start, until_start
+        settings = app_config.cache.endpoint(endpoint)
+        return settings.soft_ttl, settings.hard_ttl
+
+    @staticmethod
+    @async_ttl_cache(ttl=3600)
     async def get_grand_prix_locations(year: int) -> list[Location]:
         location_repo = OpenF1LocationsRepository()
         locations = await location_repo.find({"year": int(year)})
@@ -42,41 +219,24 @@ class OpenF1:
             logger.info(f"Found {len(locations)} locations in the database.")
             return locations
         
-        url = f"{app_config.openf1.url}/meetings"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params={"year": year}) as r:
-                if r.status == 200:
-                    result = await r.json()
-                    locations = []
-                    for location in result:
-                        if "Grand Prix" in location["meeting_name"] and "Testing" not in location["meeting_name"]:
-                            locations.append(location)
-                            await location_repo.insert(Location(**location))
-                    return [Location(**location) for location in locations]
-                else:
-                    logger.error(f"Error getting grand prix locations: {r.status} - {await r.text()}")
-                    raise OpenF1Error(f"Error getting grand prix locations: {r.status} - {await r.text()}")
+        result = await OpenF1Client.get("meetings", {"year": year}, "grand prix locations")
+        locations = []
+        for location in result:
+            if "Grand Prix" in location["meeting_name"] and "Testing" not in location["meeting_name"]:
+                locations.append(location)
+                await location_repo.insert(Location(**location))
+        return [Location(**location) for location in locations]
 
     @staticmethod
     async def upsert_grand_prix_locations(year: int) -> None:
         location_repo = OpenF1LocationsRepository()
-        url = f"{app_config.openf1.url}/meetings"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params={"year": year}) as r:
-                if r.status == 200:
-                    result = await r.json()
-                    locations = []
-                    for location in result:
-                        if "Grand Prix" in location["meeting_name"] and "Testing" not in location["meeting_name"]:
-                            locations.append(location)
-                            await location_repo.upsert(Location(**location))
-                    return
-                else:
-                    logger.error(f"Error getting grand prix locations: {r.status} - {await r.text()}")
-                    raise OpenF1Error(f"Error getting grand prix locations: {r.status} - {await r.text()}")
+        result = await OpenF1Client.get("meetings", {"year": year}, "grand prix locations")
+        for location in result:
+            if "Grand Prix" in location["meeting_name"] and "Testing" not in location["meeting_name"]:
+                await location_repo.upsert(Location(**location))
 
     @staticmethod
-    @alru_cache(ttl=3600)
+    @async_ttl_cache(ttl=3600)
     async def get_drivers(year: int, location: str, session_name: str) -> list[Driver]:
         driver_repo = OpenF1DriversRepository()
         drivers = await driver_repo.find({"year": int(year), "location": location, "session_name": session_name})  
@@ -85,135 +245,167 @@ class OpenF1:
             return drivers
 
         session_key = await OpenF1.get_session_key(year, location, session_name)
-        url = f"{app_config.openf1.url}/drivers"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params={"session_key": session_key}) as r:
-                if r.status == 200:
-                    result = await r.json()
-                    drivers = []
-                    for driver in result:
-                        driver["year"] = year
-                        driver["location"] = location
-                        driver["session_name"] = session_name
-                        drivers.append(driver)
-                        await driver_repo.insert(Driver(**driver))
-                    return [Driver(**driver) for driver in drivers]
-                else:
-                    logger.error(f"Error getting drivers: {r.status} - {await r.text()}")
-                    raise OpenF1Error(f"Error getting drivers: {r.status} - {await r.text()}")
+        result = await OpenF1Client.get("drivers", {"session_key": session_key}, "drivers")
+        drivers = []
+        for driver in result:
+            driver = {**driver, "year": year, "location": location, "session_name": session_name}
+            drivers.append(driver)
+            await driver_repo.insert(Driver(**driver))
+        return [Driver(**driver) for driver in drivers]
 
     @staticmethod
-    @alru_cache(ttl=10)
+    @async_ttl_cache(ttl=app_config.cache.endpoint("position").soft_ttl, hard_ttl=app_config.cache.endpoint("position").hard_ttl, ttl_policy=session_ttls("position"))
     async def get_position(session_key: int):
-        url = f"{app_config.openf1.url}/position"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params={"session_key": session_key}) as r:
-                if r.status == 200:
-                    return await r.json()
-                else:
-                    logger.error(f"Error getting positions: {r.status} - {await r.text()}")
-                    raise OpenF1Error(f"Error getting positions: {r.status} - {await r.text()}")
+        return await OpenF1Client.get("position", {"session_key": session_key}, "positions")
                 
     @staticmethod
-    @alru_cache(ttl=10)
+    @async_ttl_cache(ttl=app_config.cache.endpoint("intervals").soft_ttl, hard_ttl=app_config.cache.endpoint("intervals").hard_ttl, ttl_policy=session_ttls("intervals"))
     async def get_intervals(session_key: int, driver_number: int = None):
-        url = f"{app_config.openf1.url}/intervals"
         params = {"session_key": session_key}
         if driver_number:
             params["driver_number"] = driver_number
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params) as r:
-                if r.status == 200:
-                    return await r.json()
-                else:
-                    logger.error(f"Error getting intervals: {r.status} - {await r.text()}")
-                    raise OpenF1Error(f"Error getting intervals: {r.status} - {await r.text()}")
+        return await OpenF1Client.get("intervals", params, "intervals")
                 
     @staticmethod
-    @alru_cache(ttl=30)
-    async def get_pit_stops(session_key: int):
-        url = f"{app_config.openf1.url}/pit"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params={"session_key": session_key}) as r:
-                if r.status == 200:
-                    return await r.json()
-                else:
-                    logger.error(f"Error getting pit stops: {r.status} - {await r.text()}")
-                    raise OpenF1Error(f"Error getting pit stops: {r.status} - {await r.text()}")
+    async def get_pit_stops(session_key: int, date_after: str = None):
+        # Not cached in memory, the strategy index keeps the rows instead
+        params = {"session_key": session_key}
+        if date_after:
+            params["date>"] = date_after   # Encoded as "date>=<date_after>"
+        return await OpenF1Client.get("pit", params, "pit stops", conditional=False)
                 
     @staticmethod
-    @alru_cache(ttl=30)
-    async def get_tyres(session_key: int):
-        url = f"{app_config.openf1.url}/stints"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params={"session_key": session_key}) as r:
-                if r.status == 200:
-                    return await r.json()
-                else:
-                    logger.error(f"Error getting tyres: {r.status} - {await r.text()}")
-                    raise OpenF1Error(f"Error getting tyres: {r.status} - {await r.text()}")
+    async def get_tyres(session_key: int, min_stint_number: int = None):
+        # Not cached in memory, the strategy index keeps the rows instead
+        params = {"session_key": session_key}
+        if min_stint_number:
+            params["stint_number>"] = min_stint_number   # Encoded as "stint_number>=<min_stint_number>"
+        return await OpenF1Client.get("stints", params, "tyres", conditional=False)
                 
     @staticmethod
-    @alru_cache(ttl=10)
+    @async_ttl_cache(ttl=app_config.cache.endpoint("laps").soft_ttl, hard_ttl=app_config.cache.endpoint("laps").hard_ttl, ttl_policy=session_ttls("laps"))
     async def get_lap_times(session_key: int):
-        url = f"{app_config.openf1.url}/laps"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params={"session_key": session_key}) as r:
-                if r.status == 200:
-                    return await r.json()
-                else:
-                    logger.error(f"Error getting lap times: {r.status} - {await r.text()}")
-                    raise OpenF1Error(f"Error getting lap times: {r.status} - {await r.text()}")
+        return await OpenF1Client.get("laps", {"session_key": session_key}, "lap times")
+
+    @staticmethod
+    async def get_laps_since(session_key: int, date_start_after: str = None):
+        # Not cached in memory, the fastest index keeps the running minima instead
+        params = {"session_key": session_key}
+        if date_start_after:
+            params["date_start>"] = date_start_after   # Encoded as "date_start>=<date_start_after>"
+        return await OpenF1Client.get("laps", params, "lap times", conditional=False)
+
+    @staticmethod
+    async def get_location(session_key: int, driver_number: int = None, date_after: str = None, date_before: str = None):
+        # Not cached in memory, the track map keeps the latest sample per driver instead
+        params = {"session_key": session_key}
+        if driver_number:
+            params["driver_number"] = driver_number
+        if date_after:
+            params["date>"] = date_after   # Encoded as "date>=<date_after>"
+        if date_before:
+            params["date<"] = date_before   # Encoded as "date<=<date_before>"
+        return await OpenF1Client.get("location", params, "location", conditional=False)
+
+    @staticmethod
+    async def get_car_data(session_key: int, driver_number: int, date_after: str = None):
+        # Not cached in memory, the samples are persisted by the telemetry store instead
+        params = {"session_key": session_key, "driver_number": driver_number}
+        if date_after:
+            params["date>"] = date_after   # Encoded as "date>=<date_after>"
+        return await OpenF1Client.get("car_data", params, "car data", conditional=False)
+
+    @staticmethod
+    async def get_race_control(session_key: int, date_after: str = None):
+        # Not cached, polled from the latest message seen by the race control feed
+        params = {"session_key": session_key}
+        if date_after:
+            params["date>"] = date_after   # Encoded as "date>=<date_after>"
+        return await OpenF1Client.get("race_control", params, "race control messages", conditional=False)
+
+    @staticmethod
+    async def get_team_radio(session_key: int, date_after: str = None):
+        params = {"session_key": session_key}
+        if date_after:
+            params["date>"] = date_after   # Encoded as "date>=<date_after>"
+        return await OpenF1Client.get("team_radio", params, "team radio", conditional=False)
 
 
 class OpenF1DriversRepository:
-    def __init__(self):
-        self.collection = db["drivers"]
+    def __init__(self, database=db):
+        self.collection = database["drivers"]
 
     async def find(self, query: Dict[str, Any]) -> list[Driver]:
+        cached = repository_cache.get(self.collection.name, query)
+        if cached is not None:
+            return cached
+        # Taken before the query, a write landing while it runs discards the result
+        version = repository_cache.version(self.collection.name)
         try:
             cursor = self.collection.find(query)
             drivers = await cursor.to_list()
         except Exception as e:
             logger.error(f"Error finding drivers: {e}")
             raise DatabaseError(f"Error finding drivers: {e}")
-        return [Driver(**driver) for driver in drivers] if drivers else []
+        drivers = [Driver(**driver) for driver in drivers] if drivers else []
+        repository_cache.set(self.collection.name, query, drivers, version)
+        return list(drivers)
     
     async def insert(self, driver: Driver):
+        document = driver.model_dump()
         try:
-            await self.collection.insert_one(driver.model_dump())
+            await self.collection.insert_one(document)
         except Exception as e:
             logger.error(f"Error inserting driver: {e}")
             raise DatabaseError(f"Error inserting driver: {e}")
+        finally:
+            # Also when the outcome of a failed write is unknown
+            repository_cache.invalidate(self.collection.name, [document])
         
 
 class OpenF1LocationsRepository:
-    def __init__(self):
-        self.collection = db["locations"]
+    def __init__(self, database=db):
+        self.collection = database["locations"]
 
     async def find(self, query: Dict[str, Any]) -> list[Location]:
+        cached = repository_cache.get(self.collection.name, query)
+        if cached is not None:
+            return cached
+        # Taken before the query, a write landing while it runs discards the result
+        version = repository_cache.version(self.collection.name)
         try:
             cursor = self.collection.find(query).sort("date_start", 1)
             locations = await cursor.to_list()
         except Exception as e:
             logger.error(f"Error finding locations: {e}")
             raise DatabaseError(f"Error finding locations: {e}")
-        return [Location(**location) for location in locations] if locations else []
+        locations = [Location(**location) for location in locations] if locations else []
+        repository_cache.set(self.collection.name, query, locations, version)
+        return list(locations)
     
     async def insert(self, location: Location):
+        document = location.model_dump()
         try:
-            await self.collection.insert_one(location.model_dump())
+            await self.collection.insert_one(document)
         except Exception as e:
             logger.error(f"Error inserting location: {e}")
             raise DatabaseError(f"Error inserting location: {e}")
+        finally:
+            repository_cache.invalidate(self.collection.name, [document])
         
     async def upsert(self, location: Location):
+        # The document before the update tells which cached queries it left
+        document = location.model_dump()
         try:
-            await self.collection.update_one(
+            before = await self.collection.find_one_and_update(
                 {"meeting_key": location.meeting_key},
-                {"$set": location.model_dump()},
-                upsert=True
+                {"$set": document},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
             )
         except Exception as e:
+            # Whatever the write did, what was there before is unknown
+            repository_cache.clear(self.collection.name)
             logger.error(f"Error upserting location: {e}")
-            raise DatabaseError(f"Error upserting location: {e}")
\ No newline at end of file
+            raise DatabaseError(f"Error upserting location: {e}")
+        repository_cache.invalidate(self.collection.name, [before, document])
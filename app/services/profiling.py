@@ -0,0 +1,216 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from types import FrameType
+from typing import List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from app.app_config import AppConfig
+from app.logging_utils import request_id
+from app.services.admission import admission
+from app.exceptions import ProfilingError
+
+import logging
+logger = logging.getLogger(__name__)
+logger.info("Logging is configured.")
+
+app_config_path = os.getenv("APP_CONFIG_PATH", f"{Path(__file__).parent.parent.parent.resolve()}/app_config.json")
+app_config = AppConfig.from_json(app_config_path)
+
+
+# Functions threads wait in, left out of the top list (they stay in the file)
+IDLE_FUNCTIONS = ("EpollSelector.select", "KqueueSelector.select", "SelectSelector.select", "_worker", "Condition.wait", "Event.wait", "LoopLagMonitor._watch")
+
+
+def frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame: Optional[FrameType]) -> List[str]:
+    # Outermost frame first, the order flame graph tools expect
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+class ProfileResult(BaseModel):
+    path: str
+    samples: int
+    duration: float
+    interactions: int
+    top: List[Tuple[str, int]]   # Functions with the most samples on top of the stack
+
+
+class SamplingProfiler:
+    # Samples the stacks of every thread (the event loop, render threads, the
+    # log listener) from a background thread, and writes them in the collapsed
+    # format read by flamegraph.pl and speedscope: "thread;outer;...;inner count".
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = ";".join([names.get(ident, str(ident))] + collapse_stack(frame))
+                self.stacks[stack] += 1
+            self.samples += 1
+
+    def top(self, n: int = 5) -> List[Tuple[str, int]]:
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaf = stack.rsplit(";", 1)[-1]
+            if leaf.split(" (", 1)[0] not in IDLE_FUNCTIONS:
+                leaves[leaf] += count
+        return leaves.most_common(n)
+
+    def write(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    # One profile at a time, for a number of seconds or until a number of
+    # interactions have been rendered, whichever the caller asks for
+    def __init__(self):
+        self.running = False
+
+    async def run(self, seconds: Optional[float] = None, interactions: Optional[int] = None) -> ProfileResult:
+        settings = app_config.profiling
+        if self.running:
+            raise ProfilingError("A profile is already running")
+        self.running = True
+
+        rendered = 0
+        done = asyncio.Event()
+
+        def observe(phase: str, duration: float) -> None:
+            nonlocal rendered
+            if phase == "render":
+                rendered += 1
+                if interactions and rendered >= interactions:
+                    done.set()
+
+        sampler = SamplingProfiler(settings.sample_interval)
+        admission.observers.append(observe)
+        timeout = min(seconds or settings.max_seconds, settings.max_seconds)
+        logger.info(f"Profiling for {timeout} seconds" + (f" or {interactions} interactions..." if interactions else "..."))
+        t0 = time.perf_counter()
+        sampler.start()
+        try:
+            try:
+                await asyncio.wait_for(done.wait(), timeout)
+            except TimeoutError:
+                pass
+        finally:
+            sampler.stop()
+            admission.observers.remove(observe)
+            self.running = False
+
+        path = Path(settings.output_dir) / f"profile-{datetime.now():%Y%m%d-%H%M%S}.folded"
+        await asyncio.to_thread(sampler.write, path)
+        result = ProfileResult(path=str(path), samples=sampler.samples, duration=time.perf_counter() - t0, interactions=rendered, top=sampler.top())
+        logger.info(f"Profile written to {path}: {result.samples} samples over {result.duration:.1f} seconds and {result.interactions} interactions.")
+        return result
+
+    def start_in_background(self, seconds: Optional[float] = None) -> None:
+        # For the signal handler, which can't await the result
+        if self.running:
+            logger.warning("A profile is already running, ignoring the request.")
+            return
+        task = asyncio.get_running_loop().create_task(self.run(seconds or app_config.profiling.signal_seconds))
+        task.add_done_callback(self._log_failure)
+
+    @staticmethod
+    def _log_failure(task: asyncio.Task) -> None:
+        # Nobody awaits a background profile, so its failure is only seen here
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Error profiling in the background", exc_info=task.exception())
+
+
+profiler = Profiler()
+
+
+class LoopLagMonitor:
+    # A callback on the loop stamps a heartbeat every check interval, and a
+    # watchdog thread reports when it stops: the loop thread's stack while it
+    # is blocked, the task running on it and the request id of that task.
+    def __init__(self, threshold: float, interval: float):
+        self.threshold = threshold
+        self.interval = interval
+        self.last_beat = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_ident: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        # Called on the loop's thread, again on every reconnect
+        if self._thread is not None:
+            return
+        self._loop = loop
+        self._loop_ident = threading.get_ident()
+        self.last_beat = time.monotonic()
+        loop.call_soon(self._beat)
+        self._thread = threading.Thread(target=self._watch, name="loop-lag-monitor", daemon=True)
+        self._thread.start()
+
+    def _beat(self) -> None:
+        self.last_beat = time.monotonic()
+        self._loop.call_later(self.interval, self._beat)
+
+    def _blocker(self) -> Tuple[str, Optional[str], str]:
+        # Name and request id of the task running on the loop, and the loop thread's stack
+        task = asyncio.current_task(self._loop)
+        task_name = task.get_name() if task is not None else "callback"
+        task_request_id = task.get_context().get(request_id) if task is not None else None
+        frame = sys._current_frames().get(self._loop_ident)
+        stack = "".join(traceback.format_stack(frame, limit=10)) if frame is not None else ""   # Innermost frames
+        return task_name, task_request_id, stack
+
+    def _watch(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            beat = self.last_beat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked < self.threshold:
+                continue
+
+            task_name, task_request_id, stack = self._blocker()
+            while self.last_beat == beat:
+                time.sleep(self.interval)
+            blocked = self.last_beat - beat - self.interval
+            logger.warning(
+                f"Event loop blocked for {blocked * 1000:.0f}ms by {task_name} (request {task_request_id}), at:\n{stack}",
+                extra={"request_id": task_request_id}
+            )
+
+
+lag_monitor = LoopLagMonitor(app_config.profiling.lag_threshold, app_config.profiling.lag_check_interval)
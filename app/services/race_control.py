@@ -0,0 +1,354 @@
+import os
+import time
+import asyncio
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import discord
+from pydantic import BaseModel
+
+from app.app_config import AppConfig
+from app.database import db
+from app.services.models import Subscription
+from app.services.openf1 import OpenF1, SCHEDULED, FINISHED
+from app.services.telemetry import parse_date_ms
+from app.exceptions import OpenF1Error, DatabaseError
+
+import logging
+logger = logging.getLogger(__name__)
+logger.info("Logging is configured.")
+
+app_config_path = os.getenv("APP_CONFIG_PATH", f"{Path(__file__).parent.parent.parent.resolve()}/app_config.json")
+app_config = AppConfig.from_json(app_config_path)
+
+MESSAGE_LIMIT = 2000   # Characters of a Discord message
+LINE_LIMIT = 1000   # Characters of a line, so any line fits in a message with the skipped note
+HIGHLIGHTED_CATEGORIES = ("Flag", "SafetyCar")
+
+
+class FeedEvent(BaseModel):
+    kind: str   # "race_control" or "team_radio"
+    date: str
+    date_ms: int
+    driver_number: Optional[int] = None
+    lap_number: Optional[int] = None
+    category: Optional[str] = None
+    message: Optional[str] = None
+    recording_url: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, kind: str, row: Dict[str, Any]) -> "FeedEvent":
+        return cls(
+            kind=kind,
+            date=row["date"],
+            date_ms=parse_date_ms(row["date"]),
+            driver_number=row.get("driver_number"),
+            lap_number=row.get("lap_number"),
+            category=row.get("category"),
+            message=row.get("message"),
+            recording_url=row.get("recording_url")
+        )
+
+    @property
+    def key(self) -> Tuple:
+        # Events sharing a timestamp (a flag and its message) are told apart by their content
+        return (self.kind, self.date_ms, self.driver_number, self.message or self.recording_url)
+
+
+class EventCursor:
+    # Date of the latest event seen on an endpoint. OpenF1 encodes "date>" as
+    # "date>=", so the events at the cursor are returned again by the next poll
+    # and are dropped by their keys.
+    def __init__(self):
+        self.date: Optional[str] = None
+        self.date_ms = -1
+        self.keys_at_date = set()
+
+    def advance(self, events: List[FeedEvent]) -> List[FeedEvent]:
+        new_events = []
+        for event in sorted(events, key=lambda event: event.date_ms):
+            if event.date_ms < self.date_ms or (event.date_ms == self.date_ms and event.key in self.keys_at_date):
+                continue
+            if event.date_ms > self.date_ms:
+                self.date, self.date_ms, self.keys_at_date = event.date, event.date_ms, set()
+            self.keys_at_date.add(event.key)
+            new_events.append(event)
+        return new_events
+
+
+class SubscriptionsRepository:
+    def __init__(self):
+        self.collection = db["race_control_subscriptions"]
+
+    async def find(self, query: Dict[str, Any]) -> list[Subscription]:
+        try:
+            cursor = self.collection.find(query)
+            subscriptions = await cursor.to_list()
+        except Exception as e:
+            logger.error(f"Error finding subscriptions: {e}")
+            raise DatabaseError(f"Error finding subscriptions: {e}")
+        return [Subscription(**subscription) for subscription in subscriptions] if subscriptions else []
+
+    async def upsert(self, subscription: Subscription):
+        try:
+            await self.collection.update_one(
+                {"channel_id": subscription.channel_id},
+                {"$set": subscription.model_dump()},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Error upserting subscription: {e}")
+            raise DatabaseError(f"Error upserting subscription: {e}")
+
+    async def delete(self, channel_id: int):
+        try:
+            await self.collection.delete_one({"channel_id": channel_id})
+        except Exception as e:
+            logger.error(f"Error deleting subscription: {e}")
+            raise DatabaseError(f"Error deleting subscription: {e}")
+
+
+class ChannelSender:
+    # Sends a channel's feed lines in order, combined into as few messages as
+    # possible and at most one message per send interval, below the per-channel
+    # rate limit of Discord. The queue is bounded: when a channel falls behind,
+    # its oldest lines are dropped and the next message says how many.
+    def __init__(self, channel: discord.abc.Messageable, on_gone: Callable[[int], Awaitable[Any]]):
+        settings = app_config.race_control
+        self.channel = channel
+        self.on_gone = on_gone
+        self.max_batch = settings.max_batch
+        self.send_interval = settings.send_interval
+        self.pending: deque = deque(maxlen=settings.queue_size)
+        self.dropped = 0
+        self.closing = False
+        self._ready = asyncio.Event()
+        self.task = asyncio.create_task(self._run(), name=f"race-control-sender-{channel.id}")
+
+    def put(self, lines: List[str]) -> None:
+        for line in lines:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append(line[:LINE_LIMIT])
+        self._ready.set()
+
+    def close(self) -> None:
+        # Lines already queued are still sent
+        self.closing = True
+        self._ready.set()
+
+    def _next_message(self) -> str:
+        lines = [f"_{self.dropped} older messages were skipped._"] if self.dropped else []
+        self.dropped = 0
+        length = sum(len(line) + 1 for line in lines)
+        while self.pending and len(lines) < self.max_batch and length + len(self.pending[0]) + 1 <= MESSAGE_LIMIT:
+            line = self.pending.popleft()
+            lines.append(line)
+            length += len(line) + 1
+        return "\n".join(lines)
+
+    async def _run(self) -> None:
+        while True:
+            await self._ready.wait()
+            if not self.pending:
+                if self.closing:
+                    return
+                self._ready.clear()
+                continue
+            try:
+                await self.channel.send(self._next_message())
+            except (discord.Forbidden, discord.NotFound) as e:
+                logger.warning(f"Channel {self.channel.id} can't be sent to anymore, unsubscribing it: {e}")
+                self.pending.clear()
+                try:
+                    await self.on_gone(self.channel.id)
+                except Exception as e:
+                    logger.exception(f"Error unsubscribing channel {self.channel.id}: {e}")
+                return
+            except discord.HTTPException as e:
+                logger.error(f"Error sending race control messages to channel {self.channel.id}: {e}")
+            except Exception as e:
+                logger.exception(f"Error sending race control messages to channel {self.channel.id}: {e}")
+            await asyncio.sleep(self.send_interval)
+
+
+class SessionFeed:
+    # A single poller per session fans its new events out to every subscribed
+    # channel. Each poll only asks for the events from the latest one seen.
+    def __init__(self, feeds: "RaceControlFeeds", session_key: int, label: str):
+        self.feeds = feeds
+        self.session_key = session_key
+        self.label = label
+        self.subscriptions: Dict[int, Subscription] = {}
+        self.cursors = {"race_control": EventCursor(), "team_radio": EventCursor()}
+        self.driver_acronyms: Dict[int, str] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self._run(), name=f"race-control-feed-{self.session_key}")
+
+    async def poll(self) -> List[FeedEvent]:
+        # Team radio is only metadata (driver, time and a link to the recording), so it's always polled
+        race_control, team_radio = await asyncio.gather(
+            OpenF1.get_race_control(self.session_key, self.cursors["race_control"].date),
+            OpenF1.get_team_radio(self.session_key, self.cursors["team_radio"].date)
+        )
+        events = []
+        for kind, rows in (("race_control", race_control), ("team_radio", team_radio)):
+            events.extend(self.cursors[kind].advance([FeedEvent.from_row(kind, row) for row in rows if row.get("date")]))
+        return sorted(events, key=lambda event: event.date_ms)
+
+    def format(self, event: FeedEvent) -> str:
+        at = datetime.fromtimestamp(event.date_ms / 1000, timezone.utc).strftime("%H:%M:%S")
+        if event.kind == "team_radio":
+            driver = self.driver_acronyms.get(event.driver_number, f"#{event.driver_number}")
+            return f"`{at}` Team radio {driver}: <{event.recording_url}>"
+        lap = f"Lap {event.lap_number} " if event.lap_number else ""
+        message = f"**{event.message}**" if event.category in HIGHLIGHTED_CATEGORIES else event.message
+        return f"`{at}` {lap}{message}"
+
+    def fan_out(self, events: List[FeedEvent]) -> None:
+        for event in events:
+            line = self.format(event)
+            for subscription in self.subscriptions.values():
+                if event.kind == "team_radio" and not subscription.team_radio:
+                    continue
+                self.feeds.send(subscription.channel_id, [line])
+
+    async def _run(self) -> None:
+        settings = app_config.race_control
+        subscription = next(iter(self.subscriptions.values()))
+        try:
+            drivers = await OpenF1.get_drivers(subscription.year, subscription.location, subscription.session_name)
+            self.driver_acronyms = {driver.driver_number: driver.name_acronym for driver in drivers}
+        except Exception as e:
+            logger.warning(f"Error getting drivers of session {self.session_key}, team radio shows car numbers: {e}")
+
+        # Events from before the feed started aren't pushed, unless the session started since
+        backlog_seen = False
+        while self.subscriptions:
+            try:
+                state = await OpenF1.get_session_state(self.session_key)
+                if state == SCHEDULED:
+                    session = await OpenF1.get_session(self.session_key)
+                    until_start = datetime.fromisoformat(session.date_start).timestamp() - time.time()
+                    backlog_seen = True
+                    await asyncio.sleep(max(min(until_start, settings.scheduled_check_interval), settings.poll_interval))
+                    continue
+
+                events = await self.poll()
+                if backlog_seen:
+                    self.fan_out(events)
+                elif events:
+                    logger.info(f"Skipped {len(events)} race control events of session {self.session_key} from before the feed started.")
+                backlog_seen = True
+
+                if state == FINISHED:
+                    await self.feeds.finish(self)
+                    return
+            except OpenF1Error as e:
+                logger.warning(f"Error polling race control of session {self.session_key}: {e}")
+            except Exception as e:
+                # Anything else (a database error while finishing, a malformed row) is retried on the next poll
+                logger.exception(f"Error in race control feed of session {self.session_key}: {e}")
+            await asyncio.sleep(settings.poll_interval)
+
+
+class RaceControlFeeds:
+    # Subscriptions, one per channel, are kept in the database and restored on startup
+    def __init__(self):
+        self.feeds: Dict[int, SessionFeed] = {}
+        self.senders: Dict[int, ChannelSender] = {}
+        self.repository = SubscriptionsRepository()
+        self.restored = False
+
+    def send(self, channel_id: int, lines: List[str]) -> None:
+        sender = self.senders.get(channel_id)
+        if sender is not None:
+            sender.put(lines)
+
+    def _add(self, channel: discord.abc.Messageable, subscription: Subscription) -> None:
+        sender = self.senders[subscription.channel_id] = ChannelSender(channel, self.unsubscribe)
+        sender.task.add_done_callback(lambda task: self._on_sender_done(subscription.channel_id, sender, task))
+        feed = self.feeds.get(subscription.session_key)
+        if feed is None:
+            label = f"{subscription.year} {subscription.location} {subscription.session_name}"
+            feed = self.feeds[subscription.session_key] = SessionFeed(self, subscription.session_key, label)
+            feed.subscriptions[subscription.channel_id] = subscription
+            logger.info(f"Starting race control feed of session {subscription.session_key}...")
+            feed.start()
+            feed.task.add_done_callback(lambda task: self._on_feed_done(feed, task))
+        else:
+            feed.subscriptions[subscription.channel_id] = subscription
+
+    def _on_feed_done(self, feed: SessionFeed, task: asyncio.Task) -> None:
+        # A feed that died is dropped, so the next subscriber to its session starts a new one
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Race control feed of session {feed.session_key} stopped", exc_info=task.exception())
+        if self.feeds.get(feed.session_key) is feed:
+            logger.warning(f"Race control feed of session {feed.session_key} stopped with {len(feed.subscriptions)} channels still subscribed.")
+            del self.feeds[feed.session_key]
+
+    def _on_sender_done(self, channel_id: int, sender: ChannelSender, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Race control sender of channel {channel_id} stopped", exc_info=task.exception())
+        if self.senders.get(channel_id) is sender:
+            del self.senders[channel_id]
+
+    def _remove(self, channel_id: int) -> Optional[Subscription]:
+        sender = self.senders.pop(channel_id, None)
+        if sender is not None:
+            sender.close()
+        for session_key, feed in list(self.feeds.items()):
+            subscription = feed.subscriptions.pop(channel_id, None)
+            if subscription is None:
+                continue
+            if not feed.subscriptions:
+                logger.info(f"Stopping race control feed of session {session_key}...")
+                del self.feeds[session_key]
+                if feed.task is not asyncio.current_task():
+                    feed.task.cancel()
+            return subscription
+        return None
+
+    async def subscribe(self, channel: discord.abc.Messageable, subscription: Subscription) -> None:
+        # Replaces the channel's previous subscription
+        await self.repository.upsert(subscription)
+        self._remove(subscription.channel_id)
+        self._add(channel, subscription)
+
+    async def unsubscribe(self, channel_id: int) -> Optional[Subscription]:
+        subscription = self._remove(channel_id)
+        await self.repository.delete(channel_id)
+        return subscription
+
+    async def finish(self, feed: SessionFeed) -> None:
+        for channel_id in list(feed.subscriptions):
+            self.send(channel_id, [f"{feed.label} has finished, this channel is unsubscribed from its race control messages."])
+            await self.unsubscribe(channel_id)
+
+    async def restore(self, bot: discord.Bot) -> None:
+        # Called from on_ready, only the first time across reconnects
+        if self.restored:
+            return
+        self.restored = True
+        for subscription in await self.repository.find({}):
+            channel = bot.get_channel(subscription.channel_id)
+            if channel is None:
+                try:
+                    channel = await bot.fetch_channel(subscription.channel_id)
+                except (discord.NotFound, discord.Forbidden) as e:
+                    logger.warning(f"Channel {subscription.channel_id} is gone, removing its subscription: {e}")
+                    await self.repository.delete(subscription.channel_id)
+                    continue
+                except discord.HTTPException as e:
+                    # Rate limits and server errors pass, the subscription is retried on the next start
+                    logger.error(f"Error fetching channel {subscription.channel_id}, keeping its subscription: {e}")
+                    continue
+            self._add(channel, subscription)
+        logger.info(f"Restored {len(self.senders)} race control subscriptions.")
+
+
+feeds = RaceControlFeeds()
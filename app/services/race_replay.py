@@ -0,0 +1,258 @@
+import hashlib
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple
+from io import BytesIO
+from matplotlib.figure import Figure
+from PIL import Image
+from pydantic import BaseModel
+
+from app.app_config import AppConfig
+from app.services.openf1 import OpenF1
+from app.services.cache import TTLCache
+from app.services.stages import StageGraph, StageResult
+from app.services.timeline import get_position_index, get_lap_index
+from app.exceptions import ReplayError
+
+import logging
+logger = logging.getLogger(__name__)
+logger.info("Logging is configured.")
+
+app_config_path = os.getenv("APP_CONFIG_PATH", f"{Path(__file__).parent.parent.parent.resolve()}/app_config.json")
+app_config = AppConfig.from_json(app_config_path)
+
+# Encoded animations keyed by the model they were rendered from. Neither these
+# nor the frames are snapshotted, they would dominate the snapshot size.
+rendered_images = TTLCache(f"{__name__}.rendered_images", ttl=3600, maxsize=16, snapshot=False)
+# Rendered frames keyed by their content. Frames of finished sessions, and of
+# completed laps of live ones, never change, so they are reused across lap
+# ranges and formats.
+frames = TTLCache(f"{__name__}.frames", ttl=24 * 3600, maxsize=app_config.race_replay.frame_cache_size, snapshot=False)
+
+FRAME_SIZE = (6, 8)   # Inches, every frame of an animation has the same canvas
+FRAME_DPI = 80
+
+# (title, lap, number of rows, [(driver name, colour, places gained)] in running order)
+FrameJob = Tuple[str, int, int, List[Tuple[str, str, int]]]
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def start_pool() -> None:
+    # Forked before the bot starts its threads, so the workers inherit the
+    # already imported modules instead of importing main.py again
+    global _pool
+    if _pool is None and app_config.race_replay.workers > 0:
+        _pool = ProcessPoolExecutor(max_workers=app_config.race_replay.workers, mp_context=multiprocessing.get_context("fork"))
+        _pool.submit(int).result()
+        logger.info(f"Started {app_config.race_replay.workers} race replay workers.")
+
+
+def stop_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+def render_frame(job: FrameJob) -> bytes:
+    # Runs in a worker process, returns the frame as PNG
+    title, lap, num_rows, rows = job
+    fig = Figure(figsize=FRAME_SIZE, dpi=FRAME_DPI)
+    fig.patch.set_facecolor('#333333')  # Dark grey background
+    ax = fig.add_axes((0.05, 0.02, 0.9, 0.88))
+    ax.set_facecolor('#333333')
+    ax.axis('off')
+    ax.set_xlim(0, 1)
+    ax.set_ylim(num_rows + 0.5, 0.5)
+
+    for position, (name, color, gained) in enumerate(rows, start=1):
+        ax.text(0.02, position, f"P{position}", color='#AAAAAA', fontsize=11, va='center')
+        ax.barh(position, 0.5, left=0.15, height=0.8, color=color)
+        ax.text(0.18, position, name, color='white', fontsize=11, fontweight='bold', va='center')
+        if gained > 0:
+            ax.text(0.72, position, f"▲{gained}", color='#49FF33', fontsize=11, va='center')
+        elif gained < 0:
+            ax.text(0.72, position, f"▼{-gained}", color='#FF3333', fontsize=11, va='center')
+
+    fig.text(0.5, 0.96, title, color='white', fontsize=13, fontweight='bold', ha='center')
+    fig.text(0.5, 0.92, f"Lap {lap}", color='#AAAAAA', fontsize=11, ha='center')
+
+    buf = BytesIO()
+    fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+
+def render_frames(jobs: List[FrameJob]) -> List[bytes]:
+    keys = [hashlib.sha1(repr(job).encode()).hexdigest() for job in jobs]
+    rendered = [frames.get(key) for key in keys]
+    missing = [i for i, frame in enumerate(rendered) if frame is None]
+    logger.info(f"Rendering {len(missing)} of {len(jobs)} race replay frames, {len(jobs) - len(missing)} cached.")
+
+    missing_jobs = [jobs[i] for i in missing]
+    if _pool is not None:
+        results = _pool.map(render_frame, missing_jobs, chunksize=max(1, len(missing_jobs) // (4 * app_config.race_replay.workers)))
+    else:
+        results = map(render_frame, missing_jobs)
+    for i, frame in zip(missing, results):
+        frames.set(keys[i], frame)
+        rendered[i] = frame
+    return rendered
+
+
+def encode_gif(images: List[Image.Image], duration: int) -> bytes:
+    # One palette shared by all frames without dithering, so pixels that didn't
+    # change stay identical and the GIF writer only stores the rectangle that
+    # differs from the previous frame
+    width, height = images[0].size
+    samples = [images[0], images[len(images) // 2], images[-1]]
+    sample = Image.new("RGB", (width, height * len(samples)))
+    for i, image in enumerate(samples):
+        sample.paste(image, (0, height * i))
+    palette = sample.quantize(colors=256, method=Image.Quantize.MEDIANCUT)
+    paletted = [image.quantize(palette=palette, dither=Image.Dither.NONE) for image in images]
+
+    buf = BytesIO()
+    paletted[0].save(buf, format="GIF", save_all=True, append_images=paletted[1:], duration=duration, loop=0, disposal=1)
+    return buf.getvalue()
+
+
+def encode_webp(images: List[Image.Image], duration: int) -> bytes:
+    # libwebp stores each frame as the sub-rectangle that changed when it is smaller
+    buf = BytesIO()
+    images[0].save(buf, format="WEBP", save_all=True, append_images=images[1:], duration=duration, loop=0, lossless=True, minimize_size=True)
+    return buf.getvalue()
+
+
+def encode_animation(frame_pngs: List[bytes], image_format: str, duration: int, max_bytes: int) -> bytes:
+    images = [Image.open(BytesIO(frame)).convert("RGB") for frame in frame_pngs]
+    encode = encode_webp if image_format == "webp" else encode_gif
+
+    # Scale the frames down until the animation fits in an upload
+    scale = 1.0
+    while True:
+        if scale < 1.0:
+            size = (int(images[0].width * scale), int(images[0].height * scale))
+            scaled = [image.resize(size, Image.Resampling.LANCZOS) for image in images]
+        else:
+            scaled = images
+        data = encode(scaled, duration)
+        if len(data) <= max_bytes:
+            logger.info(f"Encoded {len(images)} frames as {image_format} at {scale:.2f}x: {len(data)} bytes.")
+            return data
+        if scale < 0.4:
+            raise ReplayError("The replay is too large to upload")
+        scale *= 0.75
+
+
+class RaceReplay(BaseModel):
+    title: Optional[str] = None
+    driver_names: Optional[Dict[int, str]] = None
+    driver_colors: Optional[Dict[int, str]] = None
+    laps: Optional[List[int]] = None
+    orders: Optional[List[List[int]]] = None   # Driver numbers in running order at the end of each lap
+    previous_order: Optional[List[int]] = None   # Running order before the first lap shown
+    image_format: str = "gif"
+
+    def frame_jobs(self) -> List[FrameJob]:
+        num_rows = max(len(order) for order in self.orders)
+        jobs = []
+        previous = {driver: position for position, driver in enumerate(self.previous_order or [], start=1)}
+        for lap, order in zip(self.laps, self.orders):
+            rows = []
+            for position, driver in enumerate(order, start=1):
+                gained = previous.get(driver, position) - position
+                rows.append((self.driver_names.get(driver, str(driver)), self.driver_colors.get(driver, '#888888'), gained))
+            previous = {driver: position for position, driver in enumerate(order, start=1)}
+            jobs.append((self.title, lap, num_rows, rows))
+        return jobs
+
+    def to_image_bytes(self) -> BytesIO:
+        logger.info("Converting race replay to an animation...")
+        cache_key = hashlib.sha1(self.model_dump_json().encode()).hexdigest()
+        cached = rendered_images.get(cache_key)
+        if cached is not None:
+            logger.info("Using cached race replay animation.")
+            return BytesIO(cached)
+
+        frame_pngs = render_frames(self.frame_jobs())
+        data = encode_animation(frame_pngs, self.image_format, app_config.race_replay.frame_duration, app_config.race_replay.max_upload_bytes)
+        rendered_images.set(cache_key, data)
+
+        logger.info("Finished converting race replay to an animation.")
+
+        return BytesIO(data)
+
+
+class RaceReplayBuilder:
+    def __init__(self, year: int, location: str, session_name: str = 'Race'):
+        self.race_replay = RaceReplay(title=f"{year} {location} {session_name}")
+        self.year = year
+        self.location = location
+        self.session_name = session_name
+        self.session_key = None
+
+    async def get_session_key(self) -> None:
+        # Get session key from OpenF1 API
+        logger.info("Getting session key...")
+        session_key = await OpenF1.get_session_key(self.year, self.location, self.session_name)
+        logger.info("Finished getting session key.")
+        self.session_key = session_key
+
+    async def add_drivers(self) -> "RaceReplayBuilder":
+        logger.info("Adding drivers to the race replay...")
+        drivers_data = await OpenF1.get_drivers(
+            self.year, self.location, self.session_name
+        )
+
+        driver_names = {}
+        driver_colors = {}
+        for data in drivers_data:
+            driver_names[data.driver_number] = data.name_acronym
+            driver_colors[data.driver_number] = f"#{data.team_colour}"
+
+        self.race_replay.driver_names = driver_names
+        self.race_replay.driver_colors = driver_colors
+        logger.info("Finished adding drivers.")
+
+        return self
+
+    async def add_orders(self, start_lap: int, end_lap: Optional[int] = None) -> "RaceReplayBuilder":
+        logger.info("Adding running orders to the race replay...")
+        position_index, lap_index = await asyncio.gather(get_position_index(self.session_key), get_lap_index(self.session_key))
+
+        current_lap = lap_index.current_lap
+        if current_lap is None:
+            raise ReplayError("No laps have been started yet")
+        end_lap = min(end_lap or current_lap, current_lap)
+        if start_lap > end_lap:
+            raise ReplayError(f"Lap {start_lap} hasn't been started yet")
+        if end_lap - start_lap + 1 > app_config.race_replay.max_frames:
+            raise ReplayError(f"A replay can cover at most {app_config.race_replay.max_frames} laps")
+
+        # Running order at the end of each lap, looked up in the position index
+        def order_at(lap: int) -> List[int]:
+            positions = position_index.at(lap_index.lap_end(lap))
+            return [driver_number for driver_number, _ in sorted(positions.items(), key=lambda item: item[1])]
+
+        if start_lap > 1:
+            self.race_replay.previous_order = order_at(start_lap - 1)
+        self.race_replay.laps = list(range(start_lap, end_lap + 1))
+        self.race_replay.orders = [order_at(lap) for lap in self.race_replay.laps]
+        logger.info("Finished adding running orders.")
+
+        return self
+
+    async def run_stages(self, start_lap: int, end_lap: Optional[int], image_format: str) -> Dict[str, StageResult]:
+        self.race_replay.image_format = image_format
+        graph = StageGraph()
+        graph.add("session_key", self.get_session_key, required=True)
+        graph.add("drivers", self.add_drivers, required=True)
+        graph.add("orders", lambda: self.add_orders(start_lap, end_lap), deps=["session_key"], required=True)
+        return await graph.run()
+
+    def build(self) -> "RaceReplay":
+        return self.race_replay
@@ -0,0 +1,134 @@
+import os
+import asyncio
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pydantic import BaseModel
+from pymongo.errors import OperationFailure, PyMongoError
+
+from app.app_config import AppConfig
+from app.services.cache import TTLCache
+
+import logging
+logger = logging.getLogger(__name__)
+logger.info("Logging is configured.")
+
+app_config_path = os.getenv("APP_CONFIG_PATH", f"{Path(__file__).parent.parent.parent.resolve()}/app_config.json")
+app_config = AppConfig.from_json(app_config_path)
+
+# Error code of a change stream opened on a standalone server
+CHANGE_STREAM_UNSUPPORTED = 40573
+
+
+class RepositoryCache:
+    # Validated models per collection and query, so a hot lookup is a
+    # dictionary read. A write through a repository invalidates the queries
+    # matching the document before and after it, and a change stream does the
+    # same for writes made by other processes. Only equality filters are cached.
+    #
+    # Every invalidation bumps the collection's version, and the result of a
+    # query started before it isn't stored, so a write racing a read never
+    # leaves the read's stale result behind.
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.caches: Dict[str, TTLCache] = {}
+        self.versions: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self._watch_task: Optional[asyncio.Task] = None
+
+    def _cache(self, collection: str) -> TTLCache:
+        cache = self.caches.get(collection)
+        if cache is None:
+            # Not snapshotted, writes made while the bot is down would be missed
+            cache = self.caches[collection] = TTLCache(f"{__name__}.{collection}", ttl=self.ttl, maxsize=self.maxsize, snapshot=False)
+        return cache
+
+    @staticmethod
+    def query_key(query: Dict[str, Any]) -> Optional[Tuple]:
+        if any(field.startswith("$") or isinstance(value, (dict, list)) for field, value in query.items()):
+            return None
+        return tuple(sorted(query.items()))
+
+    def version(self, collection: str) -> int:
+        return self.versions.get(collection, 0)
+
+    def get(self, collection: str, query: Dict[str, Any]) -> Optional[List[BaseModel]]:
+        key = self.query_key(query)
+        models = self._cache(collection).get(key) if key is not None else None
+        if models is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return list(models)
+
+    def set(self, collection: str, query: Dict[str, Any], models: List[BaseModel], version: int) -> None:
+        key = self.query_key(query)
+        if key is not None and version == self.version(collection):
+            self._cache(collection).set(key, list(models))
+
+    def invalidate(self, collection: str, documents: Iterable[Optional[Dict[str, Any]]] = (), fields: Iterable[str] = ()) -> None:
+        # Drops the queries any of the documents match, and the ones filtering on any of the fields
+        self.versions[collection] = self.version(collection) + 1
+        documents = [document for document in documents if document]
+        fields = set(fields)
+        cache = self._cache(collection)
+        for key in cache.keys():
+            if any(field in fields for field, _ in key) or any(all(document.get(field) == value for field, value in key) for document in documents):
+                cache.invalidate(key)
+
+    def clear(self, collection: Optional[str] = None) -> None:
+        for name in [collection] if collection else list(self.caches):
+            self.versions[name] = self.version(name) + 1
+            self._cache(name).clear()
+
+    def apply_change(self, change: Dict[str, Any]) -> None:
+        operation = change.get("operationType")
+        collection = change.get("ns", {}).get("coll")
+        document = change.get("fullDocument")
+        if operation == "insert":
+            self.invalidate(collection, [document])
+        elif operation == "update" and document:
+            # A query not filtering on a changed field matched the document before
+            # exactly when it matches it now, the others are dropped either way
+            description = change.get("updateDescription", {})
+            fields = list(description.get("updatedFields", {})) + list(description.get("removedFields", []))
+            self.invalidate(collection, [document], [field.split(".")[0] for field in fields])
+        elif collection:
+            # Replaced or deleted, or updated and deleted since: what matched before is unknown
+            self.clear(collection)
+        else:
+            self.clear()
+
+    async def watch(self, db, collections: List[str]) -> None:
+        pipeline = [{"$match": {"ns.coll": {"$in": collections}}}]
+        while True:
+            try:
+                async with await db.watch(pipeline, full_document="updateLookup") as stream:
+                    logger.info(f"Watching {', '.join(collections)} for changes...")
+                    async for change in stream:
+                        self.apply_change(change)
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAM_UNSUPPORTED:
+                    logger.warning("MongoDB isn't a replica set, the repository cache is only invalidated by this process's writes and its TTL.")
+                    return
+                logger.error(f"Error watching for changes: {e}")
+            except PyMongoError as e:
+                logger.error(f"Error watching for changes: {e}")
+            # Changes made while the stream was closed are unknown
+            self.clear()
+            await asyncio.sleep(app_config.repository_cache.watch_retry_interval)
+
+    def start_watching(self, db, collections: List[str]) -> None:
+        # Called from on_ready, only starts once across reconnects
+        if self._watch_task is None:
+            self._watch_task = asyncio.get_running_loop().create_task(self.watch(db, collections), name="repository-cache-watch")
+
+    def log_stats(self) -> None:
+        lookups = self.hits + self.misses
+        if lookups:
+            logger.info(f"Repository cache: {self.hits} of {lookups} lookups served from memory ({self.hits / lookups:.0%}).")
+
+
+repository_cache = RepositoryCache(app_config.repository_cache.ttl, app_config.repository_cache.maxsize)
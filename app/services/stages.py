@@ -0,0 +1,101 @@
+import os
+import time
+import asyncio
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+from pydantic import BaseModel
+
+from app.app_config import AppConfig
+from app.exceptions import OpenF1Error
+
+import logging
+logger = logging.getLogger(__name__)
+logger.info("Logging is configured.")
+
+app_config_path = os.getenv("APP_CONFIG_PATH", f"{Path(__file__).parent.parent.parent.resolve()}/app_config.json")
+app_config = AppConfig.from_json(app_config_path)
+
+
+class StageResult(BaseModel):
+    name: str
+    status: str   # "ok", "timeout", "failed" or "skipped"
+    duration: float = 0.0
+    error: Optional[str] = None
+
+
+class Stage:
+    def __init__(self, name: str, func: Callable[[], Awaitable], deps: List[str], deadline: float, required: bool):
+        self.name = name
+        self.func = func
+        self.deps = deps
+        self.deadline = deadline
+        self.required = required
+        self.exception: Optional[BaseException] = None
+
+
+class StageGraph:
+    # Runs each stage as soon as the stages it depends on have succeeded.
+    # Deadlines are counted from the start of the graph, so a slow dependency
+    # eats into the budget of the stages after it instead of extending it.
+    # Optional stages that time out or fail are reported, not raised.
+
+    # Called with the results of every run, e.g. to collect stage timings
+    observers: List[Callable[[Dict[str, StageResult]], None]] = []
+
+    def __init__(self):
+        self.stages: Dict[str, Stage] = {}
+
+    def add(self, name: str, func: Callable[[], Awaitable], deps: Optional[List[str]] = None, required: bool = False, deadline: Optional[float] = None) -> "StageGraph":
+        deps = deps or []
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dep}")
+        deadline = deadline or app_config.stages.deadlines.get(name, app_config.stages.default_deadline)
+        self.stages[name] = Stage(name, func, deps, deadline, required)
+        return self
+
+    async def _run_stage(self, stage: Stage, tasks: Dict[str, asyncio.Task], start: float) -> StageResult:
+        for dep in stage.deps:
+            dep_result = await tasks[dep]
+            if dep_result.status != "ok":
+                return StageResult(name=stage.name, status="skipped", error=f"{dep} {dep_result.status}")
+
+        t0 = time.perf_counter()
+        try:
+            async with asyncio.timeout_at(start + stage.deadline):
+                await stage.func()
+            status, error = "ok", None
+        except TimeoutError as e:
+            stage.exception = e
+            status, error = "timeout", f"deadline of {stage.deadline}s exceeded"
+        except Exception as e:
+            stage.exception = e
+            status, error = "failed", str(e)
+            logger.warning(f"Stage {stage.name} failed: {e}")
+        return StageResult(name=stage.name, status=status, duration=time.perf_counter() - t0, error=error)
+
+    async def run(self) -> Dict[str, StageResult]:
+        start = asyncio.get_running_loop().time()
+        tasks: Dict[str, asyncio.Task] = {}
+        for name, stage in self.stages.items():
+            tasks[name] = asyncio.create_task(self._run_stage(stage, tasks, start))
+        results = {name: await task for name, task in tasks.items()}
+
+        logger.info(
+            "Stages: " + ", ".join(f"{name} {result.status} ({result.duration:.3f}s)" for name, result in results.items()),
+            extra={"stages": {name: result.model_dump(exclude={"name"}) for name, result in results.items()}}
+        )
+        for observer in StageGraph.observers:
+            observer(results)
+
+        for name, result in results.items():
+            stage = self.stages[name]
+            if not stage.required or result.status == "ok":
+                continue
+            if result.status == "timeout":
+                raise OpenF1Error(f"Stage {name} timed out")
+            if stage.exception is not None:
+                raise stage.exception
+            raise OpenF1Error(f"Stage {name} was skipped: {result.error}")
+
+        return results
@@ -0,0 +1,260 @@
+import os
+import time
+import asyncio
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Dict, Optional
+from io import BytesIO
+from matplotlib.figure import Figure
+from matplotlib.patches import Patch
+from pydantic import BaseModel
+
+from app.app_config import AppConfig
+from app.services.openf1 import OpenF1
+from app.services.cache import TTLCache
+from app.services.stages import StageGraph, StageResult
+from app.services.telemetry import parse_date_ms
+from app.services.encoding import render_figure, cache_key
+
+import logging
+logger = logging.getLogger(__name__)
+logger.info("Logging is configured.")
+
+app_config_path = os.getenv("APP_CONFIG_PATH", f"{Path(__file__).parent.parent.parent.resolve()}/app_config.json")
+app_config = AppConfig.from_json(app_config_path)
+
+# Encoded images keyed by the model they were rendered from
+rendered_images = TTLCache(f"{__name__}.rendered_images", ttl=3600, maxsize=32)
+
+COMPOUND_COLORS = {
+    "SOFT": "#FF3333",
+    "MEDIUM": "#FFD12E",
+    "HARD": "#F0F0F0",
+    "INTERMEDIATE": "#43B02A",
+    "WET": "#0067AD",
+}
+
+
+class StintRecord(BaseModel):
+    stint_number: int
+    compound: Optional[str] = None
+    lap_start: int
+    lap_end: Optional[int] = None   # None while the stint hasn't completed a lap
+    tyre_age_at_start: int = 0
+
+    @property
+    def tyre_age(self) -> int:
+        return self.tyre_age_at_start + (self.lap_end or self.lap_start) - self.lap_start
+
+
+class PitRecord(BaseModel):
+    lap_number: int
+    pit_duration: Optional[float] = None
+    date: str
+
+
+class DriverStrategy(BaseModel):
+    stints: Dict[int, StintRecord] = {}   # By stint number
+    pits: Dict[int, PitRecord] = {}   # By lap number
+
+    def current_stint(self) -> Optional[StintRecord]:
+        if not self.stints:
+            return None
+        return self.stints[max(self.stints)]
+
+
+class StrategyIndex(BaseModel):
+    # Stints and pit stops of one session per driver, kept up to date with
+    # only the rows that can have changed since the last refresh: stints from
+    # the oldest stint still running, and pit stops from the latest one seen.
+    session_key: int
+    drivers: Dict[int, DriverStrategy] = {}
+    pit_cursor: Optional[str] = None   # Date of the latest pit stop seen
+    refreshed_at: float = 0.0
+
+    def stint_cursor(self) -> Optional[int]:
+        current = [strategy.current_stint() for strategy in self.drivers.values()]
+        current = [stint.stint_number for stint in current if stint is not None]
+        return min(current) if current else None
+
+    def apply_stints(self, rows: List[Dict]) -> None:
+        for row in rows:
+            strategy = self.drivers.setdefault(row.get("driver_number"), DriverStrategy())
+            strategy.stints[row.get("stint_number")] = StintRecord(
+                stint_number=row.get("stint_number"),
+                compound=row.get("compound"),
+                lap_start=row.get("lap_start"),
+                lap_end=row.get("lap_end"),
+                tyre_age_at_start=row.get("tyre_age_at_start") or 0
+            )
+
+    def apply_pits(self, rows: List[Dict]) -> None:
+        for row in rows:
+            if not row.get("date"):
+                continue
+            strategy = self.drivers.setdefault(row.get("driver_number"), DriverStrategy())
+            strategy.pits[row.get("lap_number")] = PitRecord(lap_number=row.get("lap_number"), pit_duration=row.get("pit_duration"), date=row.get("date"))
+            if self.pit_cursor is None or parse_date_ms(row.get("date")) > parse_date_ms(self.pit_cursor):
+                self.pit_cursor = row.get("date")
+
+
+# Strategy index per session key, snapshotted with the other caches
+indexes = TTLCache(f"{__name__}.indexes", ttl=7 * 24 * 3600, maxsize=32)
+_locks: Dict[int, asyncio.Lock] = {}
+
+
+async def get_strategy_index(session_key: int) -> StrategyIndex:
+    lock = _locks.setdefault(session_key, asyncio.Lock())
+    async with lock:
+        index = indexes.get(session_key) or StrategyIndex(session_key=session_key)
+        if index.refreshed_at:
+            # Never refreshed again once refreshed after the session's data is final
+            soft_ttl, _ = await OpenF1.get_cache_ttls("stints", session_key, index.refreshed_at)
+            if time.time() - index.refreshed_at < soft_ttl:
+                return index
+
+        logger.info(f"Refreshing strategy index of session {session_key} from stint {index.stint_cursor()} and pit stop {index.pit_cursor}...")
+        stints_data, pit_stops_data = await asyncio.gather(
+            OpenF1.get_tyres(session_key, index.stint_cursor()),
+            OpenF1.get_pit_stops(session_key, index.pit_cursor)
+        )
+        index.apply_stints(stints_data)
+        index.apply_pits(pit_stops_data)
+        index.refreshed_at = time.time()
+        indexes.set(session_key, index)
+        logger.info(f"Finished refreshing strategy index: {len(stints_data)} stint rows and {len(pit_stops_data)} pit stop rows applied.")
+        return index
+
+
+class Strategy(BaseModel):
+    title: Optional[str] = None
+    driver_names: Optional[Dict[int, str]] = None
+    order: Optional[List[int]] = None   # Drivers from top to bottom
+    stints: Optional[Dict[int, List[StintRecord]]] = None
+    pits: Optional[Dict[int, List[PitRecord]]] = None
+    as_of: Optional[float] = None
+
+    def to_image_bytes(self) -> BytesIO:
+        logger.info("Converting strategy to image bytes...")
+        key = cache_key(self)
+        cached = rendered_images.get(key)
+        if cached is not None:
+            logger.info("Using cached strategy image.")
+            return BytesIO(cached)
+
+        total_laps = max([stint.lap_end or stint.lap_start for stints in self.stints.values() for stint in stints] or [1])
+
+        # Constrained layout fits everything on the fixed canvas, so no tight-bbox pass is needed
+        fig = Figure(figsize=(12, 0.35 * len(self.order) + 1.5), layout="constrained")
+        fig.patch.set_facecolor('#333333')  # Dark grey background
+        ax = fig.subplots()
+        ax.set_facecolor('#333333')
+
+        compounds = set()
+        for y, driver in enumerate(self.order):
+            for stint in self.stints.get(driver, []):
+                compounds.add(stint.compound)
+                width = (stint.lap_end or stint.lap_start) - stint.lap_start + 1
+                ax.barh(y, width, left=stint.lap_start - 0.5, height=0.7, color=COMPOUND_COLORS.get(stint.compound, '#888888'), edgecolor='#333333')
+                if width >= 3:
+                    label = (stint.compound or "?")[0]
+                    if stint.tyre_age_at_start:
+                        label += f" ({stint.tyre_age_at_start})"   # Used set
+                    ax.text(stint.lap_start - 0.5 + width / 2, y, label, color='#222222', fontsize=7, fontweight='bold', ha='center', va='center')
+            for pit in self.pits.get(driver, []):
+                if pit.pit_duration:
+                    ax.text(pit.lap_number + 0.5, y - 0.45, f"{pit.pit_duration:.1f}s", color='#AAAAAA', fontsize=6, ha='center', va='bottom')
+
+        ax.set_yticks(range(len(self.order)), [self.driver_names.get(driver, str(driver)) for driver in self.order])
+        ax.set_ylim(len(self.order) - 0.5, -0.7)
+        ax.set_xlim(0.5, total_laps + 0.5)
+        ax.set_xlabel("Lap", color='white')
+        ax.tick_params(colors='white')
+        for spine in ax.spines.values():
+            spine.set_color('#555555')
+
+        handles = [Patch(color=COMPOUND_COLORS[compound], label=compound.title()) for compound in COMPOUND_COLORS if compound in compounds]
+        if handles:
+            ax.legend(handles=handles, loc='lower left', bbox_to_anchor=(0.0, 1.0), ncol=len(handles), frameon=False,
+                      labelcolor='white', fontsize=8)
+
+        fig.suptitle(self.title, color='white', fontweight='bold')
+        if self.as_of:
+            # Axes title rather than figure text, so the constrained layout makes room for it
+            ax.set_title(f"As of {datetime.fromtimestamp(self.as_of, tz=timezone.utc):%H:%M:%S} UTC", color='#AAAAAA', fontsize=8, loc='right')
+
+        buf = render_figure(fig, "strategy")
+        rendered_images.set(key, buf.getvalue())
+
+        logger.info("Finished converting strategy to image bytes.")
+
+        return buf
+
+
+class StrategyBuilder:
+    def __init__(self, year: int, location: str, session_name: str = 'Race'):
+        self.strategy = Strategy(title=f"{year} {location} {session_name} Strategy")
+        self.year = year
+        self.location = location
+        self.session_name = session_name
+        self.session_key = None
+        self.positions: Dict[int, int] = {}
+
+    async def get_session_key(self) -> None:
+        # Get session key from OpenF1 API
+        logger.info("Getting session key...")
+        session_key = await OpenF1.get_session_key(self.year, self.location, self.session_name)
+        logger.info("Finished getting session key.")
+        self.session_key = session_key
+
+    async def add_drivers(self) -> "StrategyBuilder":
+        logger.info("Adding drivers to the strategy...")
+        drivers_data = await OpenF1.get_drivers(
+            self.year, self.location, self.session_name
+        )
+        self.strategy.driver_names = {data.driver_number: data.name_acronym for data in drivers_data}
+        logger.info("Finished adding drivers.")
+
+        return self
+
+    async def add_positions(self) -> "StrategyBuilder":
+        # Only used to order the drivers, the timeline is drawn without it
+        logger.info("Adding positions to the strategy...")
+        position_data = await OpenF1.get_position(self.session_key)
+        for data in position_data:
+            self.positions[data.get("driver_number")] = data.get("position")
+        logger.info("Finished adding positions.")
+
+        return self
+
+    async def add_strategies(self) -> "StrategyBuilder":
+        logger.info("Adding strategies from the strategy index...")
+        index = await get_strategy_index(self.session_key)
+        self.strategy.stints = {
+            driver: sorted(strategy.stints.values(), key=lambda stint: stint.stint_number)
+            for driver, strategy in index.drivers.items()
+        }
+        self.strategy.pits = {
+            driver: sorted(strategy.pits.values(), key=lambda pit: pit.lap_number)
+            for driver, strategy in index.drivers.items()
+        }
+        self.strategy.as_of = index.refreshed_at
+        logger.info("Finished adding strategies.")
+
+        return self
+
+    async def run_stages(self) -> Dict[str, StageResult]:
+        graph = StageGraph()
+        graph.add("session_key", self.get_session_key, required=True)
+        graph.add("drivers", self.add_drivers, required=True)
+        graph.add("positions", self.add_positions, deps=["session_key"])
+        graph.add("strategies", self.add_strategies, deps=["session_key"], required=True)
+        results = await graph.run()
+
+        drivers = set(self.strategy.driver_names) | set(self.strategy.stints)
+        self.strategy.order = sorted(drivers, key=lambda driver: (self.positions.get(driver, len(drivers) + 1), driver))
+
+        return results
+
+    def build(self) -> "Strategy":
+        return self.strategy
@@ -0,0 +1,280 @@
+import os
+import json
+import asyncio
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple
+from io import BytesIO
+import numpy as np
+from matplotlib.figure import Figure
+from pydantic import BaseModel
+
+from app.app_config import AppConfig
+from app.services.openf1 import OpenF1, FINISHED
+from app.services.cache import TTLCache
+from app.services.stages import StageGraph, StageResult
+from app.services.encoding import render_figure, cache_key
+from app.exceptions import TelemetryError
+
+import logging
+logger = logging.getLogger(__name__)
+logger.info("Logging is configured.")
+
+# Encoded images keyed by the model they were rendered from
+rendered_images = TTLCache(f"{__name__}.rendered_images", ttl=3600, maxsize=64)
+
+app_config_path = os.getenv("APP_CONFIG_PATH", f"{Path(__file__).parent.parent.parent.resolve()}/app_config.json")
+app_config = AppConfig.from_json(app_config_path)
+
+
+def parse_date_ms(date: str) -> int:
+    # OpenF1 dates are ISO 8601 strings, store them as milliseconds since epoch
+    return int(datetime.fromisoformat(date).timestamp() * 1000)
+
+
+class TelemetryStore:
+    # Append-only columnar store, one raw binary file per channel under
+    # <data_dir>/<session_key>/<driver_number>/, read back with np.memmap so a
+    # lap slice only touches the pages it needs.
+    COLUMNS = {
+        "date": np.int64,
+        "speed": np.float32,
+        "throttle": np.float32,
+        "brake": np.float32,
+        "rpm": np.float32,
+        "n_gear": np.int8,
+        "drs": np.int8,
+    }
+
+    _locks: Dict[Tuple[int, int], asyncio.Lock] = {}
+
+    def __init__(self, data_dir: Optional[str] = None):
+        self.data_dir = Path(data_dir or app_config.telemetry.data_dir)
+
+    def _driver_dir(self, session_key: int, driver_number: int) -> Path:
+        return self.data_dir / str(session_key) / str(driver_number)
+
+    def _read_meta(self, session_key: int, driver_number: int) -> Optional[Dict]:
+        meta_path = self._driver_dir(session_key, driver_number) / "meta.json"
+        if not meta_path.exists():
+            return None
+        with open(meta_path, "r") as f:
+            return json.load(f)
+
+    def _write_meta(self, session_key: int, driver_number: int, meta: Dict) -> None:
+        meta_path = self._driver_dir(session_key, driver_number) / "meta.json"
+        tmp_path = meta_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def append(self, session_key: int, driver_number: int, rows: List[Dict]) -> int:
+        meta = self._read_meta(session_key, driver_number) or {"rows": 0, "last_date": None, "last_ms": None}
+        dated_rows = [(parse_date_ms(row["date"]), row) for row in rows if row.get("date")]
+        if meta["last_ms"] is not None:
+            dated_rows = [(date_ms, row) for date_ms, row in dated_rows if date_ms > meta["last_ms"]]
+        if not dated_rows:
+            return meta["rows"]
+        dated_rows.sort(key=lambda item: item[0])
+        rows = [row for _, row in dated_rows]
+
+        driver_dir = self._driver_dir(session_key, driver_number)
+        driver_dir.mkdir(parents=True, exist_ok=True)
+        for column, dtype in self.COLUMNS.items():
+            if column == "date":
+                values = np.array([date_ms for date_ms, _ in dated_rows], dtype=dtype)
+            else:
+                values = np.array([row.get(column) or 0 for row in rows], dtype=dtype)
+            # Bytes past the rows in meta are left by an append that crashed, cut them off
+            # before writing or every later row would land at a column-dependent offset
+            path = driver_dir / f"{column}.bin"
+            path.touch()
+            with open(path, "r+b") as f:
+                f.truncate(meta["rows"] * np.dtype(dtype).itemsize)
+                f.seek(0, os.SEEK_END)
+                f.write(values.tobytes())
+
+        # Meta is written last, so the rows only count once every column has them
+        meta["rows"] += len(rows)
+        meta["last_date"] = rows[-1]["date"]
+        meta["last_ms"] = dated_rows[-1][0]
+        self._write_meta(session_key, driver_number, meta)
+        return meta["rows"]
+
+    def slice(self, session_key: int, driver_number: int, start_ms: int, end_ms: int) -> Dict[str, np.ndarray]:
+        meta = self._read_meta(session_key, driver_number)
+        if not meta or meta["rows"] == 0:
+            return {column: np.empty(0, dtype=dtype) for column, dtype in self.COLUMNS.items()}
+
+        driver_dir = self._driver_dir(session_key, driver_number)
+        dates = np.memmap(driver_dir / "date.bin", dtype=self.COLUMNS["date"], mode="r", shape=(meta["rows"],))
+        start_idx, end_idx = np.searchsorted(dates, [start_ms, end_ms])
+        result = {"date": np.array(dates[start_idx:end_idx])}
+        del dates
+
+        for column, dtype in self.COLUMNS.items():
+            if column == "date":
+                continue
+            values = np.memmap(driver_dir / f"{column}.bin", dtype=dtype, mode="r", shape=(meta["rows"],))
+            result[column] = np.array(values[start_idx:end_idx])
+            del values
+        return result
+
+    def mark_final(self, session_key: int, driver_number: int) -> None:
+        meta = self._read_meta(session_key, driver_number) or {"rows": 0, "last_date": None, "last_ms": None}
+        meta["final"] = True
+        self._driver_dir(session_key, driver_number).mkdir(parents=True, exist_ok=True)
+        self._write_meta(session_key, driver_number, meta)
+
+    async def sync(self, session_key: int, driver_number: int) -> None:
+        # Only download the samples newer than what is already on disk, and
+        # nothing at all once synced after the session's data is final
+        lock = self._locks.setdefault((session_key, driver_number), asyncio.Lock())
+        async with lock:
+            meta = self._read_meta(session_key, driver_number)
+            if meta and meta.get("final"):
+                return
+            final = await OpenF1.get_session_state(session_key) == FINISHED
+            last_date = meta["last_date"] if meta else None
+            logger.info(f"Syncing car data for driver {driver_number} in session {session_key} since {last_date}...")
+            rows = await OpenF1.get_car_data(session_key, driver_number, date_after=last_date)
+            total = await asyncio.to_thread(self.append, session_key, driver_number, rows)
+            if final:
+                await asyncio.to_thread(self.mark_final, session_key, driver_number)
+            logger.info(f"Finished syncing car data for driver {driver_number}: {len(rows)} new rows, {total} rows on disk.")
+
+
+class Telemetry(BaseModel):
+    driver_names: Optional[List[str]] = None
+    driver_colors: Optional[List[str]] = None
+    lap: Optional[int] = None
+    times: Optional[List[List[float]]] = None
+    speeds: Optional[List[List[float]]] = None
+    throttles: Optional[List[List[float]]] = None
+    brakes: Optional[List[List[float]]] = None
+
+    def to_image_bytes(self) -> BytesIO:
+        logger.info("Converting telemetry to image bytes...")
+        key = cache_key(self)
+        cached = rendered_images.get(key)
+        if cached is not None:
+            logger.info("Using cached telemetry image.")
+            return BytesIO(cached)
+
+        # Constrained layout fits everything on the fixed canvas, so no tight-bbox pass is needed
+        fig = Figure(figsize=(12, 8), layout="constrained")
+        axes = fig.subplots(3, 1, sharex=True)
+        fig.patch.set_facecolor('#333333')  # Dark grey background
+
+        channels = [("Speed (km/h)", self.speeds), ("Throttle (%)", self.throttles), ("Brake", self.brakes)]
+        for ax, (label, traces) in zip(axes, channels):
+            ax.set_facecolor('#333333')
+            ax.set_ylabel(label, color='white')
+            ax.tick_params(colors='white')
+            ax.grid(color='#555555', linewidth=0.5)
+            for spine in ax.spines.values():
+                spine.set_color('#555555')
+            for i in range(len(self.driver_names)):
+                # Teammates share a colour, so draw the second driver dashed
+                linestyle = '--' if i == 1 and self.driver_colors[0] == self.driver_colors[1] else '-'
+                ax.plot(self.times[i], traces[i], color=self.driver_colors[i], linestyle=linestyle, linewidth=1, label=self.driver_names[i])
+
+        axes[0].set_title(f"Lap {self.lap}", color='white', fontweight='bold')
+        axes[0].legend(facecolor='#333333', edgecolor='#555555', labelcolor='white')
+        axes[-1].set_xlabel("Time (s)", color='white')
+
+        buf = render_figure(fig, "telemetry")
+        rendered_images.set(key, buf.getvalue())
+
+        logger.info("Finished converting telemetry to image bytes.")
+
+        return buf
+
+
+class TelemetryBuilder:
+    def __init__(self, year: int, location: str, session_name: str = 'Race'):
+        self.telemetry = Telemetry()
+        self.year = year
+        self.location = location
+        self.session_name = session_name
+        self.session_key = None
+        self.store = TelemetryStore()
+
+    async def get_session_key(self) -> None:
+        # Get session key from OpenF1 API
+        logger.info("Getting session key...")
+        session_key = await OpenF1.get_session_key(self.year, self.location, self.session_name)
+        logger.info("Finished getting session key.")
+        self.session_key = session_key
+
+    async def add_drivers(self, driver_number_1: int, driver_number_2: int) -> "TelemetryBuilder":
+        logger.info("Adding driver numbers to the telemetry...")
+        drivers_data = await OpenF1.get_drivers(
+            self.year, self.location, self.session_name
+        )
+
+        driver_names = [None, None]
+        driver_colors = [None, None]
+        for data in drivers_data:
+            if data.driver_number == driver_number_1:
+                driver_names[0] = data.name_acronym
+                driver_colors[0] = f"#{data.team_colour}"
+            elif data.driver_number == driver_number_2:
+                driver_names[1] = data.name_acronym
+                driver_colors[1] = f"#{data.team_colour}"
+
+        self.telemetry.driver_names = driver_names
+        self.telemetry.driver_colors = driver_colors
+        logger.info("Finished adding driver numbers.")
+
+        return self
+
+    def _lap_range(self, lap_data: List[Dict], driver_number: int, lap: int) -> Tuple[int, int]:
+        driver_laps = {data.get("lap_number"): data for data in lap_data if data.get("driver_number") == driver_number}
+        current = driver_laps.get(lap)
+        if not current or not current.get("date_start"):
+            raise TelemetryError(f"Lap {lap} of driver {driver_number} isn't available")
+
+        start_ms = parse_date_ms(current["date_start"])
+        following = driver_laps.get(lap + 1)
+        if following and following.get("date_start"):
+            end_ms = parse_date_ms(following["date_start"])
+        elif current.get("lap_duration"):
+            end_ms = start_ms + int(current["lap_duration"] * 1000)
+        else:
+            raise TelemetryError(f"Lap {lap} of driver {driver_number} hasn't finished yet")
+        return start_ms, end_ms
+
+    async def add_traces(self, driver_number_1: int, driver_number_2: int, lap: int) -> "TelemetryBuilder":
+        logger.info("Adding telemetry traces...")
+        lap_data = await OpenF1.get_lap_times(self.session_key)
+        driver_numbers = [driver_number_1, driver_number_2]
+        await asyncio.gather(*[self.store.sync(self.session_key, driver_number) for driver_number in driver_numbers])
+
+        times, speeds, throttles, brakes = [], [], [], []
+        for driver_number in driver_numbers:
+            start_ms, end_ms = self._lap_range(lap_data, driver_number, lap)
+            trace = await asyncio.to_thread(self.store.slice, self.session_key, driver_number, start_ms, end_ms)
+            times.append(((trace["date"] - start_ms) / 1000).tolist())
+            speeds.append(trace["speed"].tolist())
+            throttles.append(trace["throttle"].tolist())
+            brakes.append(trace["brake"].tolist())
+
+        self.telemetry.lap = lap
+        self.telemetry.times = times
+        self.telemetry.speeds = speeds
+        self.telemetry.throttles = throttles
+        self.telemetry.brakes = brakes
+        logger.info("Finished adding telemetry traces.")
+
+        return self
+
+    async def run_stages(self, driver_number_1: int, driver_number_2: int, lap: int) -> Dict[str, StageResult]:
+        graph = StageGraph()
+        graph.add("session_key", self.get_session_key, required=True)
+        graph.add("drivers", lambda: self.add_drivers(driver_number_1, driver_number_2), required=True)
+        graph.add("traces", lambda: self.add_traces(driver_number_1, driver_number_2, lap), deps=["session_key"], required=True)
+        return await graph.run()
+
+    def build(self) -> "Telemetry":
+        return self.telemetry
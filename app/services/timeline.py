@@ -0,0 +1,140 @@
+import math
+import asyncio
+from bisect import bisect_right
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from app.services.openf1 import OpenF1
+from app.services.cache import TTLCache
+from app.services.strategy import StintRecord, get_strategy_index
+from app.services.telemetry import parse_date_ms
+from app.exceptions import AsOfError
+
+import logging
+logger = logging.getLogger(__name__)
+logger.info("Logging is configured.")
+
+
+class TimeIndex:
+    # Rows of one endpoint per driver, sorted by time, so each driver's latest
+    # row at any instant is found by binary search instead of replaying history
+    def __init__(self, rows: List[Dict], date_key: str, value: Callable[[Dict], Any], fetched_at: float = 0.0):
+        self.fetched_at = fetched_at
+        self.times: Dict[int, List[int]] = {}
+        self.values: Dict[int, List[Any]] = {}
+        dated_rows = sorted(
+            ((parse_date_ms(row[date_key]), row.get("driver_number"), value(row)) for row in rows if row.get(date_key)),
+            key=lambda item: item[0]
+        )
+        for date_ms, driver_number, row_value in dated_rows:
+            self.times.setdefault(driver_number, []).append(date_ms)
+            self.values.setdefault(driver_number, []).append(row_value)
+
+    def at(self, date_ms: float) -> Dict[int, Any]:
+        state = {}
+        for driver_number, times in self.times.items():
+            idx = bisect_right(times, date_ms)
+            if idx:
+                state[driver_number] = self.values[driver_number][idx - 1]
+        return state
+
+    def count_at(self, date_ms: float) -> Dict[int, int]:
+        return {driver_number: bisect_right(times, date_ms) for driver_number, times in self.times.items()}
+
+
+class LapIndex(TimeIndex):
+    # Lap number of each driver by time, plus the start of each lap by the leader
+    def __init__(self, rows: List[Dict], fetched_at: float = 0.0):
+        super().__init__(rows, "date_start", lambda row: row.get("lap_number"), fetched_at)
+        self.lap_starts: Dict[int, int] = {}
+        for driver_number, times in self.times.items():
+            for date_ms, lap_number in zip(times, self.values[driver_number]):
+                if lap_number not in self.lap_starts or date_ms < self.lap_starts[lap_number]:
+                    self.lap_starts[lap_number] = date_ms
+
+    @property
+    def current_lap(self) -> Optional[int]:
+        return max(self.lap_starts) if self.lap_starts else None
+
+    def lap_end(self, lap: int) -> float:
+        # A lap ends when the leader starts the next one, the lap still running never ends
+        if self.current_lap is None:
+            raise AsOfError("No laps have been started yet")
+        if lap > self.current_lap:
+            raise AsOfError(f"Lap {lap} hasn't been started yet")
+        return self.lap_starts.get(lap + 1, math.inf)
+
+
+# Indexes keyed by (endpoint, session key). They are rebuilt when the cached
+# rows they were built from are refreshed, so finished sessions build them once.
+indexes = TTLCache(f"{__name__}.indexes", ttl=3600, maxsize=32, snapshot=False)
+_locks: Dict[Hashable, asyncio.Lock] = {}
+
+
+async def _get_index(key: Tuple[str, int], rows: List[Dict], fetched_at: float, build: Callable[[List[Dict], float], TimeIndex]) -> TimeIndex:
+    lock = _locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        index = indexes.get(key)
+        if index is None or index.fetched_at != fetched_at:
+            logger.info(f"Building {key[0]} time index of session {key[1]} from {len(rows)} rows...")
+            index = await asyncio.to_thread(build, rows, fetched_at)
+            indexes.set(key, index)
+        return index
+
+
+async def get_position_index(session_key: int) -> TimeIndex:
+    rows, fetched_at = await OpenF1.get_position.with_age(session_key)
+    return await _get_index(("position", session_key), rows, fetched_at,
+                            lambda rows, fetched_at: TimeIndex(rows, "date", lambda row: row.get("position"), fetched_at))
+
+
+async def get_interval_index(session_key: int) -> TimeIndex:
+    rows, fetched_at = await OpenF1.get_intervals.with_age(session_key)
+    return await _get_index(("intervals", session_key), rows, fetched_at,
+                            lambda rows, fetched_at: TimeIndex(rows, "date", lambda row: (row.get("interval"), row.get("gap_to_leader")), fetched_at))
+
+
+async def get_lap_index(session_key: int) -> LapIndex:
+    rows, fetched_at = await OpenF1.get_lap_times.with_age(session_key)
+    return await _get_index(("laps", session_key), rows, fetched_at, LapIndex)
+
+
+async def get_pit_index(session_key: int) -> TimeIndex:
+    strategy_index = await get_strategy_index(session_key)
+    rows = [
+        {"driver_number": driver_number, "date": pit.date, "lap_number": pit.lap_number}
+        for driver_number, strategy in strategy_index.drivers.items() for pit in strategy.pits.values()
+    ]
+    return await _get_index(("pit", session_key), rows, strategy_index.refreshed_at,
+                            lambda rows, fetched_at: TimeIndex(rows, "date", lambda row: row.get("lap_number"), fetched_at))
+
+
+def stint_at(stints: List[StintRecord], lap: int) -> Optional[StintRecord]:
+    # Stints sorted by lap_start, the last one started on or before the lap
+    idx = bisect_right([stint.lap_start for stint in stints], lap)
+    return stints[idx - 1] if idx else None
+
+
+async def resolve_as_of(session_key: int, as_of: str) -> Tuple[float, str]:
+    # A lap number ("20", "lap 20") means the end of that lap, anything else is
+    # a UTC time of day ("14:32:05") on the session's date or an ISO timestamp.
+    # Returns the instant in milliseconds and a label for the image.
+    as_of = as_of.strip()
+    lap = as_of.lower().removeprefix("lap").strip()
+    if lap.isdigit():
+        lap_index = await get_lap_index(session_key)
+        lap_end = lap_index.lap_end(int(lap))
+        return lap_end, f"At the end of lap {lap}" if lap_end != math.inf else f"Lap {lap}, latest data"
+
+    try:
+        if "T" in as_of or "-" in as_of:
+            date = datetime.fromisoformat(as_of)
+        else:
+            session = await OpenF1.get_session(session_key)
+            session_date = datetime.fromisoformat(session.date_start).astimezone(timezone.utc).date()
+            date = datetime.combine(session_date, datetime.strptime(as_of, "%H:%M:%S" if as_of.count(":") == 2 else "%H:%M").time())
+    except ValueError:
+        raise AsOfError(f"`{as_of}` is neither a lap number nor a time like 14:32:05")
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp() * 1000, f"At {date.astimezone(timezone.utc):%H:%M:%S} UTC"
@@ -0,0 +1,363 @@
+import os
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from io import BytesIO
+import numpy as np
+from matplotlib import font_manager
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from PIL import Image, ImageDraw, ImageFont
+from pydantic import BaseModel
+
+from app.app_config import AppConfig
+from app.database import db
+from app.services.models import CircuitOutline
+from app.services.openf1 import OpenF1
+from app.services.cache import TTLCache
+from app.services.stages import StageGraph, StageResult
+from app.services.telemetry import parse_date_ms
+from app.services.encoding import encode_rendered, cache_key
+from app.exceptions import DatabaseError, TrackMapError
+
+import logging
+logger = logging.getLogger(__name__)
+logger.info("Logging is configured.")
+
+app_config_path = os.getenv("APP_CONFIG_PATH", f"{Path(__file__).parent.parent.parent.resolve()}/app_config.json")
+app_config = AppConfig.from_json(app_config_path)
+
+# Encoded images keyed by the model they were rendered from
+rendered_images = TTLCache(f"{__name__}.rendered_images", ttl=3600, maxsize=32)
+
+STALE_COLOR = (0x88, 0x88, 0x88)
+MARKER_RADIUS = 9
+
+
+def simplify(points: np.ndarray, tolerance: float) -> np.ndarray:
+    # Ramer-Douglas-Peucker: keeps the samples straying more than tolerance
+    # from the line between the samples kept around them
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = np.hypot(*segment)
+        if length:
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        else:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.extend([(start, split), (split, end)])
+    return points[keep]
+
+
+class CircuitOutlinesRepository:
+    def __init__(self):
+        self.collection = db["circuit_outlines"]
+
+    async def find_one(self, circuit: str) -> Optional[CircuitOutline]:
+        try:
+            outline = await self.collection.find_one({"circuit": circuit})
+        except Exception as e:
+            logger.error(f"Error finding circuit outline: {e}")
+            raise DatabaseError(f"Error finding circuit outline: {e}")
+        return CircuitOutline(**outline) if outline else None
+
+    async def upsert(self, outline: CircuitOutline):
+        try:
+            await self.collection.update_one(
+                {"circuit": outline.circuit},
+                {"$set": outline.model_dump()},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Error upserting circuit outline: {e}")
+            raise DatabaseError(f"Error upserting circuit outline: {e}")
+
+
+# Outlines never change, they are traced once per circuit and kept in MongoDB
+outlines = TTLCache(f"{__name__}.outlines", ttl=7 * 24 * 3600, maxsize=32)
+_outline_locks: Dict[str, asyncio.Lock] = {}
+
+
+async def trace_outline(session_key: int, circuit: str) -> Optional[CircuitOutline]:
+    # The fastest clean lap of the session follows the racing line most closely
+    laps = await OpenF1.get_lap_times(session_key)
+    laps = [lap for lap in laps if lap.get("date_start")]
+    # Only laps finished before the newest lap started have all their samples published
+    newest_start = max([parse_date_ms(lap["date_start"]) for lap in laps] or [0])
+    laps = [
+        lap for lap in laps
+        if lap.get("lap_duration") and not lap.get("is_pit_out_lap")
+        and parse_date_ms(lap["date_start"]) + lap["lap_duration"] * 1000 <= newest_start
+    ]
+    if not laps:
+        return None
+    lap = min(laps, key=lambda lap: lap["lap_duration"])
+    lap_start = parse_date_ms(lap["date_start"])
+    lap_end = lap_start + lap["lap_duration"] * 1000
+    # Bounded to the lap, the samples run on to the end of the session otherwise
+    date_end = (datetime.fromisoformat(lap["date_start"]) + timedelta(seconds=lap["lap_duration"])).isoformat()
+    rows = await OpenF1.get_location(session_key, lap["driver_number"], lap["date_start"], date_end)
+    samples = [
+        (row["x"], row["y"]) for row in rows
+        if row.get("date") and parse_date_ms(row["date"]) <= lap_end and (row.get("x") or row.get("y"))
+    ]
+    if len(samples) < 10:
+        return None
+
+    points = simplify(np.array(samples, dtype=float), app_config.track_map.outline_tolerance)
+    logger.info(f"Traced outline of circuit {circuit} from lap {lap['lap_number']} of driver {lap['driver_number']}: {len(samples)} samples simplified to {len(points)} points.")
+    return CircuitOutline(
+        circuit=circuit,
+        session_key=session_key,
+        driver_number=lap["driver_number"],
+        lap_number=lap["lap_number"],
+        points=points.round(1).tolist()
+    )
+
+
+async def get_outline(session_key: int, circuit: str) -> Optional[CircuitOutline]:
+    lock = _outline_locks.setdefault(circuit, asyncio.Lock())
+    async with lock:
+        outline = outlines.get(circuit)
+        if outline is None:
+            outline = await repository.find_one(circuit)
+            if outline is None:
+                outline = await trace_outline(session_key, circuit)
+                if outline is None:
+                    return None
+                await repository.upsert(outline)
+            outlines.set(circuit, outline)
+        return outline
+
+
+repository = CircuitOutlinesRepository()
+
+
+class CarLocation(BaseModel):
+    x: float
+    y: float
+    date: str
+
+
+class LocationState(BaseModel):
+    # Latest location sample per driver of one session, kept up to date with
+    # only the samples from the newest one seen
+    session_key: int
+    cursor: Optional[str] = None   # Date of the newest sample seen
+    cars: Dict[int, CarLocation] = {}
+    refreshed_at: float = 0.0
+
+    def apply_locations(self, rows: List[Dict]) -> None:
+        cursor_ms = parse_date_ms(self.cursor) if self.cursor else None
+        for row in rows:
+            if not row.get("date") or not (row.get("x") or row.get("y")):
+                continue   # No signal
+            date_ms = parse_date_ms(row["date"])
+            car = self.cars.get(row.get("driver_number"))
+            if car is None or date_ms >= parse_date_ms(car.date):
+                self.cars[row.get("driver_number")] = CarLocation(x=row["x"], y=row["y"], date=row["date"])
+            if cursor_ms is None or date_ms > cursor_ms:
+                self.cursor, cursor_ms = row["date"], date_ms
+
+
+# Location state per session key, snapshotted with the other caches
+states = TTLCache(f"{__name__}.states", ttl=24 * 3600, maxsize=32)
+_state_locks: Dict[int, asyncio.Lock] = {}
+
+
+async def get_location_state(session_key: int) -> LocationState:
+    lock = _state_locks.setdefault(session_key, asyncio.Lock())
+    async with lock:
+        state = states.get(session_key) or LocationState(session_key=session_key)
+        if state.refreshed_at:
+            # Never refreshed again once refreshed after the session's data is final
+            soft_ttl, _ = await OpenF1.get_cache_ttls("location", session_key, state.refreshed_at)
+            if time.time() - state.refreshed_at < soft_ttl:
+                return state
+
+        cursor = state.cursor
+        if cursor is None:
+            # Every car still running has a sample since the start of the latest lap, the samples before it are never needed
+            laps = await OpenF1.get_lap_times(session_key)
+            lap_starts = [lap["date_start"] for lap in laps if lap.get("date_start")]
+            cursor = max(lap_starts, key=parse_date_ms) if lap_starts else None
+        logger.info(f"Refreshing locations of session {session_key} from {cursor}...")
+        rows = await OpenF1.get_location(session_key, date_after=cursor)
+        state.apply_locations(rows)
+        state.refreshed_at = time.time()
+        states.set(session_key, state)
+        logger.info(f"Finished refreshing locations: {len(rows)} samples applied.")
+        return state
+
+
+@lru_cache(maxsize=8)
+def get_font(size: int, bold: bool = False) -> ImageFont.FreeTypeFont:
+    # Same typeface as the matplotlib tables
+    path = font_manager.findfont(font_manager.FontProperties(family="DejaVu Sans", weight="bold" if bold else "normal"))
+    return ImageFont.truetype(path, size)
+
+
+class OutlineRaster:
+    # Circuit outline drawn once per circuit with matplotlib, every map is a
+    # copy of its pixels with the cars drawn on top
+    def __init__(self, points: List[List[float]], width: int):
+        points = np.array(points + points[:1])   # Closed loop
+        span_x, span_y = np.ptp(points[:, 0]) or 1, np.ptp(points[:, 1]) or 1
+        height = int(np.clip(width * span_y / span_x, width * 0.5, width * 1.2)) + 60   # Room for the title
+
+        fig = Figure(figsize=(width / 100, height / 100), dpi=100)
+        fig.patch.set_facecolor('#333333')
+        ax = fig.add_axes((0.05, 0.04, 0.9, 1 - 80 / height))
+        ax.set_aspect('equal', adjustable='datalim')
+        ax.axis('off')
+        ax.plot(points[:, 0], points[:, 1], color='#555555', linewidth=14, solid_joinstyle='round', solid_capstyle='round')
+        ax.plot(points[:, 0], points[:, 1], color='#777777', linewidth=2)
+        ax.plot(points[0, 0], points[0, 1], marker='s', color='white', markersize=6)   # Where the traced lap started
+
+        canvas = FigureCanvasAgg(fig)
+        canvas.draw()
+        self.pixels = np.asarray(canvas.buffer_rgba())[..., :3].copy()
+
+        # Data to pixel coordinates, the y axis flipped as pixel rows start at the top
+        (x0, y0), (x1, y1) = ax.transData.transform([(0, 0), (1, 1)])
+        self.scale = (x1 - x0, -(y1 - y0))
+        self.offset = (x0, self.pixels.shape[0] - y0)
+
+    def to_pixel(self, x: float, y: float) -> Tuple[float, float]:
+        return self.scale[0] * x + self.offset[0], self.scale[1] * y + self.offset[1]
+
+
+# Rasters are rebuilt from the outline in memory, they aren't worth snapshotting
+rasters = TTLCache(f"{__name__}.rasters", ttl=24 * 3600, maxsize=16, snapshot=False)
+
+
+def get_raster(circuit: str, points: List[List[float]]) -> OutlineRaster:
+    width = app_config.track_map.width
+    key = (circuit, width, len(points))
+    raster = rasters.get(key)
+    if raster is None:
+        logger.info(f"Drawing outline raster of circuit {circuit}...")
+        raster = OutlineRaster(points, width)
+        rasters.set(key, raster)
+    return raster
+
+
+class TrackMap(BaseModel):
+    title: Optional[str] = None
+    circuit: Optional[str] = None
+    outline: Optional[List[List[float]]] = None
+    driver_names: Optional[Dict[int, str]] = None
+    driver_colors: Optional[Dict[int, str]] = None
+    cars: Optional[Dict[int, CarLocation]] = None
+    as_of: Optional[str] = None
+
+    def to_image_bytes(self) -> BytesIO:
+        logger.info("Converting track map to image bytes...")
+        key = cache_key(self)
+        cached = rendered_images.get(key)
+        if cached is not None:
+            logger.info("Using cached track map image.")
+            return BytesIO(cached)
+
+        t0 = time.perf_counter()
+        raster = get_raster(self.circuit, self.outline)
+        image = Image.fromarray(raster.pixels)   # A copy, the raster stays clean
+        draw = ImageDraw.Draw(image)
+        label_font = get_font(13, bold=True)
+
+        newest_ms = max([parse_date_ms(car.date) for car in self.cars.values()] or [0])
+        stale_ms = app_config.track_map.stale_after * 1000
+        # Stale cars first, so the cars still running are drawn over them
+        for driver, car in sorted(self.cars.items(), key=lambda item: item[1].date):
+            px, py = raster.to_pixel(car.x, car.y)
+            stale = newest_ms - parse_date_ms(car.date) > stale_ms
+            color = STALE_COLOR if stale else f"#{self.driver_colors.get(driver, 'FFFFFF')}"
+            draw.ellipse((px - MARKER_RADIUS, py - MARKER_RADIUS, px + MARKER_RADIUS, py + MARKER_RADIUS), fill=color, outline='white', width=2)
+            draw.text((px + MARKER_RADIUS + 3, py), self.driver_names.get(driver, str(driver)), fill='#AAAAAA' if stale else 'white', font=label_font, anchor='lm')
+
+        draw.text((image.width / 2, 24), self.title, fill='white', font=get_font(16, bold=True), anchor='mm')
+        if self.as_of:
+            draw.text((image.width - 12, 24), self.as_of, fill='#AAAAAA', font=get_font(11), anchor='rm')
+
+        buf = encode_rendered(np.asarray(image), "track_map", time.perf_counter() - t0)
+        rendered_images.set(key, buf.getvalue())
+
+        logger.info("Finished converting track map to image bytes.")
+
+        return buf
+
+
+class TrackMapBuilder:
+    def __init__(self, year: int, location: str, session_name: str = 'Race'):
+        self.track_map = TrackMap(title=f"{year} {location} {session_name} Track Map")
+        self.year = year
+        self.location = location
+        self.session_name = session_name
+        self.session_key = None
+
+    async def get_session_key(self) -> None:
+        # Get session key from OpenF1 API
+        logger.info("Getting session key...")
+        session_key = await OpenF1.get_session_key(self.year, self.location, self.session_name)
+        logger.info("Finished getting session key.")
+        self.session_key = session_key
+
+    async def add_drivers(self) -> "TrackMapBuilder":
+        logger.info("Adding drivers to the track map...")
+        drivers_data = await OpenF1.get_drivers(
+            self.year, self.location, self.session_name
+        )
+        self.track_map.driver_names = {data.driver_number: data.name_acronym for data in drivers_data}
+        self.track_map.driver_colors = {data.driver_number: data.team_colour for data in drivers_data}
+        logger.info("Finished adding drivers.")
+
+        return self
+
+    async def add_outline(self) -> "TrackMapBuilder":
+        logger.info("Adding circuit outline to the track map...")
+        session = await OpenF1.get_session(self.session_key)
+        # Sessions restored from an older cache snapshot don't have a circuit key
+        circuit_key = getattr(session, "circuit_key", None)
+        circuit = str(circuit_key) if circuit_key else self.location
+        outline = await get_outline(self.session_key, circuit)
+        if outline is None:
+            raise TrackMapError(f"No lap of {self.year} {self.location} {self.session_name} has been completed yet to trace the circuit from")
+        self.track_map.circuit = circuit
+        self.track_map.outline = outline.points
+        logger.info("Finished adding circuit outline.")
+
+        return self
+
+    async def add_cars(self) -> "TrackMapBuilder":
+        logger.info("Adding car locations to the track map...")
+        state = await get_location_state(self.session_key)
+        self.track_map.cars = dict(state.cars)
+        if state.cursor:
+            self.track_map.as_of = f"As of {datetime.fromtimestamp(parse_date_ms(state.cursor) / 1000, tz=timezone.utc):%H:%M:%S} UTC"
+        logger.info("Finished adding car locations.")
+
+        return self
+
+    async def run_stages(self) -> Dict[str, StageResult]:
+        graph = StageGraph()
+        graph.add("session_key", self.get_session_key, required=True)
+        graph.add("drivers", self.add_drivers, required=True)
+        graph.add("outline", self.add_outline, deps=["session_key"], required=True)
+        graph.add("cars", self.add_cars, deps=["session_key"], required=True)
+        return await graph.run()
+
+    def build(self) -> "TrackMap":
+        return self.track_map
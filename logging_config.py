@@ -1,3 +1,15 @@
+import os
+from pathlib import Path
+
+from app.app_config import AppConfig
+
+app_config_path = os.getenv("APP_CONFIG_PATH", f"{Path(__file__).parent.resolve()}/app_config.json")
+app_config = AppConfig.from_json(app_config_path)
+
+output_formatter = 'json' if app_config.logging.json_output else 'standard'
+
+# Loggers only put records on a queue, the stream and file handlers run on the
+# queue listener's thread (started in main.py) so log I/O stays off the event loop.
 LOGGING_CONFIG = { 
     'version': 1,
     'disable_existing_loggers': True,
@@ -8,37 +20,56 @@ LOGGING_CONFIG = {
         'verbose': { 
             'format': '%(asctime)s [%(levelname)s] <%(name)s>: %(message)s'
         },
+        'json': {
+            '()': 'app.logging_utils.JsonFormatter'
+        },
+    },
+    'filters': {
+        'request_context': {
+            '()': 'app.logging_utils.RequestContextFilter'
+        },
+        'sampling': {
+            '()': 'app.logging_utils.SamplingFilter',
+            'sample_rate': app_config.logging.sample_rate,
+            'prefixes': app_config.logging.sampled_prefixes
+        },
     },
     'handlers': { 
         'default': { 
             'level': 'INFO',
-            'formatter': 'standard',
+            'formatter': output_formatter,
             'class': 'logging.StreamHandler',
             'stream': 'ext://sys.stdout',  # Default is stderr
         },
         'file': { 
             'level': 'INFO',
-            'formatter': 'standard',
+            'formatter': output_formatter,
             'class': 'logging.handlers.RotatingFileHandler',
             'filename': 'logs/app.log',
             'mode': 'a',  # Append mode
             'maxBytes': 10485760, 
             'backupCount': 5,     
         },
+        'queue': {
+            'class': 'logging.handlers.QueueHandler',
+            'handlers': ['default', 'file'],
+            'respect_handler_level': True,
+            'filters': ['sampling', 'request_context'],
+        },
     },
     'loggers': { 
         '': {  # root logger
-            'handlers': ['default', 'file'],
+            'handlers': ['queue'],
             'level': 'INFO',
             'propagate': False
         },
         'app': { 
-            'handlers': ['default', 'file'],
+            'handlers': ['queue'],
             'level': 'INFO',
             'propagate': False
         },
         '__main__': { 
-            'handlers': ['default', 'file'],
+            'handlers': ['queue'],
             'level': 'INFO',
             'propagate': False
         },
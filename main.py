@@ -1,13 +1,23 @@
 import os
+import signal
 from datetime import datetime
 import time
 import threading
 import asyncio
 import discord
 import dotenv
+import matplotlib
+matplotlib.use("Agg")   # Images are rendered off the main thread
 import logging.config
 
-from app.services.openf1 import OpenF1
+from app.services.openf1 import OpenF1, OpenF1Client
+from app.services.cache import CacheSnapshot
+from app.services import race_replay
+from app.services.encoding import log_encoding_stats
+from app.services.profiling import profiler, lag_monitor
+from app.services.race_control import feeds
+from app.services.repository_cache import repository_cache
+from app.database import db
 
 import logging
 from logging_config import LOGGING_CONFIG
@@ -21,6 +31,26 @@ DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 bot = discord.Bot()
 bot.load_extension(name='app.cogs.live_timing')
 bot.load_extension(name='app.cogs.head2head')
+bot.load_extension(name='app.cogs.telemetry')
+bot.load_extension(name='app.cogs.race_replay')
+bot.load_extension(name='app.cogs.strategy')
+bot.load_extension(name='app.cogs.fastest')
+bot.load_extension(name='app.cogs.track_map')
+bot.load_extension(name='app.cogs.race_control')
+bot.load_extension(name='app.cogs.export')
+bot.load_extension(name='app.cogs.compare')
+bot.load_extension(name='app.cogs.admin')
+
+# Restore the caches of the previous run before accepting any interaction
+cache_snapshot = CacheSnapshot()
+cache_snapshot.restore()
+
+# Fork the frame rendering workers while this is still the only thread
+race_replay.start_pool()
+
+# Records logged so far wait on the queue until the listener thread writes them
+queue_listener = logging.getHandlerByName("queue").listener
+queue_listener.start()
 
 @bot.command(description="Sends the bot's latency.") # this decorator makes a slash command
 async def ping(ctx): # a slash command will be created with the name "ping"
@@ -37,14 +67,46 @@ async def upsert_locations_task():
             logger.error(f"Error upserting grand prix locations: {e}")
         await asyncio.sleep(3600)
 
+# Background task for reporting OpenF1 bandwidth and decode savings, uploaded image sizes and repository cache hits
+async def report_transfer_stats_task():
+    while True:
+        await asyncio.sleep(600)
+        OpenF1Client.log_transfer_stats()
+        log_encoding_stats()
+        repository_cache.log_stats()
+
+# Background task for snapshotting the in-process caches
+async def snapshot_caches_task():
+    while True:
+        await asyncio.sleep(cache_snapshot.interval)
+        try:
+            await cache_snapshot.save()
+        except Exception as e:
+            logger.error(f"Error saving cache snapshot: {e}")
+
 @bot.event
 async def on_ready():
     logger.info(f"Bot is ready as {bot.user}")
+    # Started here, after the render pool has forked, and only once across reconnects
+    lag_monitor.start(bot.loop)
+    if hasattr(signal, "SIGUSR1"):
+        bot.loop.add_signal_handler(signal.SIGUSR1, profiler.start_in_background)   # kill -USR1 <pid> profiles for a while
     # Start the background task
     bot.loop.create_task(upsert_locations_task())
+    bot.loop.create_task(report_transfer_stats_task())
+    bot.loop.create_task(snapshot_caches_task())
+    # Invalidates the cached drivers and locations when another process writes them
+    repository_cache.start_watching(db, ["drivers", "locations"])
+    try:
+        await feeds.restore(bot)
+    except Exception as e:
+        logger.error(f"Error restoring race control subscriptions: {e}")
 
 # Run the bot
 logger.info("Starting bot...")
 bot.run(DISCORD_TOKEN)
+cache_snapshot.save_sync()
+race_replay.stop_pool()
 
-logger.info("Done!")
\ No newline at end of file
+logger.info("Done!")
+queue_listener.stop()   # Writes out the records still on the queue
\ No newline at end of file
@@ -0,0 +1,5 @@
+import os
+from pathlib import Path
+
+# The app modules read their settings on import
+os.environ.setdefault("APP_CONFIG_PATH", str(Path(__file__).parent.parent / "app_config.json.example"))
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta, timezone
+
+from app.services.fastest import FastestIndex, SETTLE_MS
+
+START = datetime(2025, 9, 7, 13, 0, tzinfo=timezone.utc)
+
+
+def lap(driver_number, lap_number, seconds, duration=None, sectors=(None, None, None)):
+    return {
+        "driver_number": driver_number, "lap_number": lap_number, "date_start": (START + timedelta(seconds=seconds)).isoformat(),
+        "lap_duration": duration, "duration_sector_1": sectors[0], "duration_sector_2": sectors[1], "duration_sector_3": sectors[2],
+    }
+
+
+def test_reapplying_rows_at_the_cursor_changes_nothing():
+    index = FastestIndex(session_key=1)
+    rows = [lap(1, 1, 0, 91.0, (30.0, 30.5, 30.5)), lap(44, 1, 2, 90.5, (30.2, 30.0, 30.3)), lap(1, 2, 91, 90.8, (29.9, 30.6, 30.3))]
+    index.apply_laps(rows)
+    before = index.model_copy(deep=True)
+
+    # The next poll asks for date_start >= the cursor, so the newest lap comes back again
+    assert index.lap_cursor() == rows[-1]["date_start"]
+    index.apply_laps([row for row in rows if row["date_start"] >= index.lap_cursor()])
+    assert index == before
+    assert index.overall_lap() == 90.5
+    assert index.overall_sectors() == [29.9, 30.0, 30.3]
+    assert index.drivers[1].theoretical == 90.7
+
+
+def test_open_laps_hold_the_cursor_until_timed():
+    index = FastestIndex(session_key=1)
+    index.apply_laps([lap(1, 1, 0, 91.0), lap(44, 1, 2), lap(1, 2, 91)])
+    assert set(index.open_laps) == {"44:1", "1:2"}
+    assert index.lap_cursor() == lap(44, 1, 2)["date_start"]
+
+    index.apply_laps([lap(44, 1, 2, 92.0)])
+    assert set(index.open_laps) == {"1:2"}
+    assert index.lap_cursor() == lap(1, 2, 91)["date_start"]
+
+
+def test_laps_never_timed_drop_out_after_settling():
+    index = FastestIndex(session_key=1)
+    index.apply_laps([lap(1, 1, 0, 91.0), lap(44, 1, 2)])   # 44 retired on lap 1
+    assert "44:1" in index.open_laps
+
+    settle = SETTLE_MS / 1000
+    index.apply_laps([lap(1, 2, 2 + settle)])
+    assert "44:1" in index.open_laps   # Exactly SETTLE_MS before the newest lap is still open
+    index.apply_laps([lap(1, 3, 3 + settle)])
+    assert "44:1" not in index.open_laps
+    assert index.lap_cursor() == lap(1, 2, 2 + settle)["date_start"]
@@ -0,0 +1,35 @@
+from datetime import datetime, timedelta, timezone
+
+from app.services.race_control import EventCursor, FeedEvent
+
+START = datetime(2025, 9, 7, 13, 0, tzinfo=timezone.utc)
+
+
+def event(seconds, message, kind="race_control"):
+    return FeedEvent.from_row(kind, {"date": (START + timedelta(seconds=seconds)).isoformat(), "message": message, "category": "Flag"})
+
+
+def test_events_sharing_a_timestamp_are_all_new():
+    cursor = EventCursor()
+    events = [event(10, "YELLOW IN TRACK SECTOR 4"), event(10, "YELLOW IN TRACK SECTOR 5"), event(5, "GREEN LIGHT - PIT EXIT OPEN")]
+    assert [e.message for e in cursor.advance(events)] == ["GREEN LIGHT - PIT EXIT OPEN", "YELLOW IN TRACK SECTOR 4", "YELLOW IN TRACK SECTOR 5"]
+    assert cursor.date == events[0].date
+
+
+def test_events_at_the_cursor_are_not_delivered_twice():
+    cursor = EventCursor()
+    cursor.advance([event(5, "GREEN LIGHT - PIT EXIT OPEN"), event(10, "YELLOW IN TRACK SECTOR 4")])
+
+    # date>= returns the events at the cursor again, along with one published since at the same instant
+    again = cursor.advance([event(10, "YELLOW IN TRACK SECTOR 4"), event(10, "CAR 44 (HAM) TIME DELETED")])
+    assert [e.message for e in again] == ["CAR 44 (HAM) TIME DELETED"]
+    assert cursor.advance([event(10, "YELLOW IN TRACK SECTOR 4"), event(10, "CAR 44 (HAM) TIME DELETED")]) == []
+
+    later = cursor.advance([event(10, "YELLOW IN TRACK SECTOR 4"), event(12, "CLEAR IN TRACK SECTOR 4")])
+    assert [e.message for e in later] == ["CLEAR IN TRACK SECTOR 4"]
+    assert cursor.advance([event(11, "LATE ROW BEHIND THE CURSOR")]) == []
+
+
+def test_kinds_at_the_same_instant_are_told_apart():
+    cursor = EventCursor()
+    assert len(cursor.advance([event(10, "BLACK AND WHITE FLAG FOR CAR 1"), event(10, "BLACK AND WHITE FLAG FOR CAR 1", kind="team_radio")])) == 2
@@ -0,0 +1,86 @@
+from app.services.models import Driver
+from app.services.repository_cache import RepositoryCache
+
+MONZA = {"year": 2025, "location": "Monza", "session_name": "Race"}
+SPA = {"year": 2025, "location": "Spa", "session_name": "Race"}
+
+
+def driver(driver_number, location="Monza", team_name="Team"):
+    return Driver(
+        session_key=9000, year=2025, location=location, session_name="Race", driver_number=driver_number,
+        name_acronym=f"D{driver_number:02d}", team_colour="FFFFFF", team_name=team_name
+    )
+
+
+def cached(*queries):
+    cache = RepositoryCache(ttl=60, maxsize=16)
+    for query in queries:
+        cache.set("drivers", query, [driver(1, query.get("location", "Monza"))], cache.version("drivers"))
+    return cache
+
+
+def update(document, updated_fields=None, removed_fields=()):
+    return {
+        "operationType": "update", "ns": {"db": "f1_discord_app", "coll": "drivers"}, "fullDocument": document,
+        "updateDescription": {"updatedFields": updated_fields or {}, "removedFields": list(removed_fields)},
+    }
+
+
+def test_hits_return_copies():
+    cache = cached(MONZA)
+    models = cache.get("drivers", MONZA)
+    models.clear()
+    assert len(cache.get("drivers", MONZA)) == 1
+    assert cache.get("drivers", {"year": {"$gte": 2025}}) is None
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_update_of_an_unfiltered_field_drops_only_matching_queries():
+    cache = cached(MONZA, SPA)
+    cache.apply_change(update(driver(1, team_name="Other").model_dump(), {"team_name": "Other"}))
+    assert cache.get("drivers", MONZA) is None
+    assert cache.get("drivers", SPA) is not None
+
+
+def test_update_of_a_filtered_field_drops_the_query_the_document_left():
+    cache = cached(MONZA, SPA)
+    # After the update the document only matches Spa, Monza is dropped through the updated field
+    cache.apply_change(update(driver(1, "Spa").model_dump(), {"location": "Spa"}))
+    assert cache.get("drivers", MONZA) is None
+    assert cache.get("drivers", SPA) is None
+
+
+def test_removed_fields_and_nested_paths_count_as_changed():
+    cache = cached(MONZA, {"year": 2025})
+    cache.apply_change(update({"year": 2024}, removed_fields=["location.alias"]))
+    assert cache.get("drivers", MONZA) is None
+    assert cache.get("drivers", {"year": 2025}) is not None
+
+
+def test_changes_without_the_document_clear_the_collection():
+    cache = cached(MONZA, SPA)
+    cache.apply_change(update(None, {"team_name": "Other"}))
+    assert cache.get("drivers", MONZA) is None and cache.get("drivers", SPA) is None
+
+    cache = cached(MONZA)
+    cache.apply_change({"operationType": "delete", "ns": {"coll": "drivers"}, "documentKey": {"_id": 1}})
+    assert cache.get("drivers", MONZA) is None
+
+
+def test_result_of_a_read_racing_a_write_is_discarded():
+    cache = RepositoryCache(ttl=60, maxsize=16)
+    version = cache.version("drivers")   # Read starts
+    cache.invalidate("drivers", [driver(16).model_dump()])   # Write lands while the query runs
+    cache.set("drivers", MONZA, [driver(1)], version)   # Read finishes with what it saw before the write
+    assert cache.get("drivers", MONZA) is None
+
+    cache.set("drivers", MONZA, [driver(1), driver(16)], cache.version("drivers"))
+    assert len(cache.get("drivers", MONZA)) == 2
+
+
+def test_writes_to_other_collections_keep_the_version():
+    cache = RepositoryCache(ttl=60, maxsize=16)
+    version = cache.version("drivers")
+    cache.invalidate("locations", [{"year": 2025}])
+    cache.set("drivers", MONZA, [driver(1)], version)
+    assert cache.get("drivers", MONZA) is not None
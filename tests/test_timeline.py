@@ -0,0 +1,87 @@
+import math
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.services import timeline
+from app.services.models import SessionInfo
+from app.services.openf1 import OpenF1
+from app.services.telemetry import parse_date_ms
+from app.services.timeline import TimeIndex, LapIndex, resolve_as_of
+from app.exceptions import AsOfError
+
+START = datetime(2025, 9, 7, 13, 0, tzinfo=timezone.utc)
+
+
+def date(seconds: float) -> str:
+    return (START + timedelta(seconds=seconds)).isoformat()
+
+
+def ms(seconds: float) -> int:
+    return parse_date_ms(date(seconds))
+
+
+def laps(drivers=(1, 44), num_laps=3, lap_time=90):
+    # The second driver starts every lap 2 seconds behind, the last lap is still running
+    return [
+        {"driver_number": driver, "lap_number": lap, "date_start": date((lap - 1) * lap_time + i * 2)}
+        for i, driver in enumerate(drivers) for lap in range(1, num_laps + 1)
+    ]
+
+
+def test_time_index_includes_rows_at_the_instant():
+    rows = [
+        {"driver_number": 1, "date": date(0), "position": 2},
+        {"driver_number": 1, "date": date(10), "position": 1},
+        {"driver_number": 44, "date": date(10), "position": 2},
+    ]
+    index = TimeIndex(rows, "date", lambda row: row["position"])
+    assert index.at(ms(10) - 1) == {1: 2}
+    assert index.at(ms(10)) == {1: 1, 44: 2}
+    assert index.count_at(ms(10)) == {1: 2, 44: 1}
+
+
+def test_time_index_at_infinity_is_the_latest_row():
+    rows = [{"driver_number": 1, "date": date(seconds), "position": seconds} for seconds in (5, 0, 20, 10)]
+    index = TimeIndex(rows, "date", lambda row: row["position"])
+    assert index.at(math.inf) == {1: 20}
+    assert index.at(ms(0) - 1) == {}
+
+
+def test_lap_end_is_the_leaders_next_lap_start():
+    index = LapIndex(laps())
+    assert index.current_lap == 3
+    assert index.lap_end(1) == ms(90)
+    assert index.lap_end(2) == ms(180)
+
+
+def test_lap_end_of_the_running_lap_never_comes():
+    index = LapIndex(laps())
+    assert index.lap_end(3) == math.inf
+    with pytest.raises(AsOfError):
+        index.lap_end(4)
+    with pytest.raises(AsOfError):
+        LapIndex([]).lap_end(1)
+
+
+def test_resolve_as_of_lap(monkeypatch):
+    async def get_lap_index(session_key):
+        return LapIndex(laps(num_laps=25))
+    monkeypatch.setattr(timeline, "get_lap_index", get_lap_index)
+
+    assert asyncio.run(resolve_as_of(1, "lap 20")) == (ms(20 * 90), "At the end of lap 20")
+    assert asyncio.run(resolve_as_of(1, "20")) == (ms(20 * 90), "At the end of lap 20")
+    assert asyncio.run(resolve_as_of(1, "Lap 25")) == (math.inf, "Lap 25, latest data")
+
+
+def test_resolve_as_of_time_of_day(monkeypatch):
+    async def get_session(session_key):
+        return SessionInfo(session_key=1, session_name="Race", date_start="2025-09-07T15:00:00+02:00", date_end="2025-09-07T17:00:00+02:00")
+    monkeypatch.setattr(OpenF1, "get_session", get_session)
+
+    date_ms, label = asyncio.run(resolve_as_of(1, "14:32:05"))
+    assert date_ms == datetime(2025, 9, 7, 14, 32, 5, tzinfo=timezone.utc).timestamp() * 1000
+    assert label == "At 14:32:05 UTC"
+    with pytest.raises(AsOfError):
+        asyncio.run(resolve_as_of(1, "half time"))
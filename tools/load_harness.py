@@ -0,0 +1,347 @@
+"""Drive the slash-command callbacks concurrently without Discord.
+
+    # Synthetic 20-driver race served by a local replay server
+    python -m tools.load_harness --synthetic --mix live_timing=3,h2h=1 --rate 20 --duration 60 --skip-mongo
+
+    # A recorded session (see tools/replay_server.py)
+    python -m tools.load_harness --recording data/replays/9158.json.gz --rate 50 --duration 60
+
+Reports throughput, latency percentiles per command, per builder stage and
+per admission phase, event-loop lag and peak RSS.
+"""
+import sys
+import json
+import gzip
+import time
+import random
+import socket
+import asyncio
+import argparse
+import resource
+import tempfile
+import subprocess
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import matplotlib
+matplotlib.use("Agg")
+
+import logging
+logger = logging.getLogger(__name__)
+
+FIELDS = ["Intervals", "Pit Stops", "Tyres"]
+COMPOUNDS = ["SOFT", "MEDIUM", "HARD"]
+
+
+def synthetic_recording(num_drivers: int = 20, num_laps: int = 50, lap_time: float = 90.0) -> Dict[str, List[Dict[str, Any]]]:
+    start = datetime(2025, 1, 1, 13, 0, tzinfo=timezone.utc)
+    date = lambda seconds: (start + timedelta(seconds=seconds)).isoformat()
+    session_key = 1
+    driver_numbers = list(range(1, num_drivers + 1))
+    recording = {
+        "sessions": [{
+            "session_key": session_key, "meeting_key": 1, "year": 2025, "location": "Synthetic",
+            "session_name": "Race", "date_start": date(0), "date_end": date(num_laps * lap_time + 600)
+        }],
+        "meetings": [{"meeting_key": 1, "meeting_name": "Synthetic Grand Prix", "location": "Synthetic", "year": 2025, "date_start": date(0)}],
+        "drivers": [{
+            "session_key": session_key, "driver_number": n, "name_acronym": f"D{n:02d}",
+            "team_colour": f"{(n * 2654435761) % 0xFFFFFF:06X}", "team_name": f"Team {(n + 1) // 2}"
+        } for n in driver_numbers],
+        "position": [], "intervals": [], "laps": [], "stints": [], "pit": [], "race_control": [], "team_radio": [],
+    }
+
+    order = list(driver_numbers)
+    for lap in range(1, num_laps + 1):
+        lap_start = (lap - 1) * lap_time
+        order[:4] = random.sample(order[:4], 4)
+        for position, n in enumerate(order, start=1):
+            gap = position * 1.3 + random.random()
+            recording["position"].append({"session_key": session_key, "driver_number": n, "position": position, "date": date(lap_start + 1)})
+            for t in range(0, int(lap_time), 4):
+                recording["intervals"].append({
+                    "session_key": session_key, "driver_number": n, "date": date(lap_start + t + 0.5),
+                    "gap_to_leader": round(gap, 3) if position > 1 else 0, "interval": round(1.3 + random.random(), 3) if position > 1 else 0
+                })
+            sectors = [round(lap_time / 3 + random.random(), 3) for _ in range(3)]
+            recording["laps"].append({
+                "session_key": session_key, "driver_number": n, "lap_number": lap, "date_start": date(lap_start + gap),
+                "lap_duration": round(sum(sectors), 3), "duration_sector_1": sectors[0], "duration_sector_2": sectors[1], "duration_sector_3": sectors[2]
+            })
+    for n in driver_numbers:
+        pit_lap = random.randint(num_laps // 3, 2 * num_laps // 3)
+        recording["stints"].append({"session_key": session_key, "driver_number": n, "stint_number": 1, "lap_start": 1, "lap_end": pit_lap, "compound": random.choice(COMPOUNDS), "tyre_age_at_start": 0})
+        recording["stints"].append({"session_key": session_key, "driver_number": n, "stint_number": 2, "lap_start": pit_lap + 1, "lap_end": num_laps, "compound": random.choice(COMPOUNDS), "tyre_age_at_start": 0})
+        recording["pit"].append({"session_key": session_key, "driver_number": n, "lap_number": pit_lap, "pit_duration": round(20 + random.random() * 5, 1), "date": date(pit_lap * lap_time)})
+        recording["team_radio"].append({"session_key": session_key, "driver_number": n, "date": date(pit_lap * lap_time - 30), "recording_url": f"https://example.com/team_radio/{n}_{pit_lap}.mp3"})
+    recording["race_control"].append({"session_key": session_key, "category": "Flag", "flag": "GREEN", "lap_number": 1, "message": "GREEN LIGHT - PIT EXIT OPEN", "date": date(0)})
+    for lap in range(5, num_laps + 1, 5):
+        recording["race_control"].append({"session_key": session_key, "category": "Flag", "flag": "YELLOW", "lap_number": lap, "message": f"YELLOW IN TRACK SECTOR {lap % 3 + 1}", "date": date(lap * lap_time + 10)})
+        recording["race_control"].append({"session_key": session_key, "category": "Flag", "flag": "CLEAR", "lap_number": lap, "message": f"CLEAR IN TRACK SECTOR {lap % 3 + 1}", "date": date(lap * lap_time + 40)})
+    recording["race_control"].append({"session_key": session_key, "category": "SafetyCar", "lap_number": num_laps // 2, "message": "SAFETY CAR DEPLOYED", "date": date(num_laps // 2 * lap_time + 10)})
+    recording["race_control"].append({"session_key": session_key, "category": "SafetyCar", "lap_number": num_laps // 2 + 2, "message": "SAFETY CAR IN THIS LAP", "date": date((num_laps // 2 + 2) * lap_time + 10)})
+    return recording
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.name = f"load-{user_id}"
+
+
+class FakeResponse:
+    async def defer(self, *args, **kwargs):
+        pass
+
+
+class FakeFollowup:
+    def __init__(self):
+        self.messages: List[Tuple[Optional[str], Any]] = []
+
+    async def send(self, content: Optional[str] = None, file: Any = None, **kwargs):
+        self.messages.append((content, file))
+
+
+class FakeInteraction:
+    def __init__(self, user_id: int, guild_id: int):
+        self.user = FakeUser(user_id)
+        self.guild_id = guild_id
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+
+    async def respond(self, content: Optional[str] = None, **kwargs):
+        self.followup.messages.append((content, None))
+
+
+class FakeSelectState(dict):
+    # Stands in for the component interaction data a select is refreshed with
+    @property
+    def data(self):
+        return self
+
+
+def select_values(select, values: List[str]) -> None:
+    select.refresh_state(FakeSelectState(values=values))
+
+
+def percentiles(values: List[float]) -> str:
+    if not values:
+        return "n/a"
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return f"n={len(values):<6} p50={pick(0.5) * 1000:8.1f}ms  p90={pick(0.9) * 1000:8.1f}ms  p99={pick(0.99) * 1000:8.1f}ms  max={values[-1] * 1000:8.1f}ms"
+
+
+class LoadHarness:
+    def __init__(self, year: int, location: str, session_name: str, mix: Dict[str, int], rate: float, duration: float, num_users: int, num_guilds: int):
+        self.year = year
+        self.location = location
+        self.session_name = session_name
+        self.mix = mix
+        self.rate = rate
+        self.duration = duration
+        self.num_users = num_users
+        self.num_guilds = num_guilds
+
+        self.latencies: Dict[str, List[float]] = {}
+        self.outcomes: Dict[str, int] = {}
+        self.stage_latencies: Dict[str, List[float]] = {}
+        self.phase_latencies: Dict[str, List[float]] = {}
+        self.loop_lags: List[float] = []
+
+    def observe_stages(self, results) -> None:
+        for name, result in results.items():
+            if result.status == "ok":
+                self.stage_latencies.setdefault(name, []).append(result.duration)
+
+    def observe_phase(self, phase: str, duration: float) -> None:
+        self.phase_latencies.setdefault(phase, []).append(duration)
+
+    async def monitor_loop_lag(self, interval: float = 0.05) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            self.loop_lags.append(max(0.0, loop.time() - expected))
+
+    async def live_timing_request(self, interaction: FakeInteraction) -> None:
+        from app.cogs.live_timing import LiveTimingView
+
+        view = LiveTimingView(self.year, self.location, self.session_name)
+        view.selected_values = random.sample(FIELDS, random.randint(0, len(FIELDS)))
+        await view.button_callback.callback(interaction)
+
+    async def h2h_request(self, interaction: FakeInteraction) -> None:
+        from app.cogs.head2head import Head2HeadView
+        from app.cogs.helpers import get_drivers_select_options
+
+        driver_options = await get_drivers_select_options(self.year, self.location, self.session_name)
+        view = Head2HeadView(self.year, self.location, self.session_name, driver_options)
+        driver1, driver2 = random.sample([option.value for option in driver_options], 2)
+        select_values(view.driver1_select, [driver1])
+        select_values(view.driver2_select, [driver2])
+        select_values(view.num_laps_select, [str(random.randint(1, 5))])
+        await view.button_callback.callback(interaction)
+
+    async def one_request(self, kind: str) -> None:
+        interaction = FakeInteraction(random.randrange(self.num_users), random.randrange(self.num_guilds))
+        t0 = time.perf_counter()
+        try:
+            if kind == "live_timing":
+                await self.live_timing_request(interaction)
+            else:
+                await self.h2h_request(interaction)
+        except Exception as e:
+            logger.exception(e)
+            self.outcomes["crashed"] = self.outcomes.get("crashed", 0) + 1
+            return
+        self.latencies.setdefault(kind, []).append(time.perf_counter() - t0)
+
+        contents = " ".join(content or "" for content, _ in interaction.followup.messages)
+        if any(file is not None for _, file in interaction.followup.messages):
+            outcome = "stale" if "showing the result from" in contents else "ok"
+        elif "busy" in contents:
+            outcome = "rejected"
+        else:
+            outcome = "error"
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    async def run(self) -> None:
+        from app.services.stages import StageGraph
+        from app.services.admission import admission
+
+        StageGraph.observers.append(self.observe_stages)
+        admission.observers.append(self.observe_phase)
+        lag_task = asyncio.create_task(self.monitor_loop_lag())
+
+        kinds = [kind for kind, weight in self.mix.items() for _ in range(weight)]
+        tasks = []
+        t0 = time.perf_counter()
+        while time.perf_counter() - t0 < self.duration:
+            # Open-loop arrivals: requests keep coming whether or not earlier ones finished
+            tasks.append(asyncio.create_task(self.one_request(random.choice(kinds))))
+            await asyncio.sleep(random.expovariate(self.rate))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - t0
+        lag_task.cancel()
+
+        self.report(elapsed)
+
+    def report(self, elapsed: float) -> None:
+        completed = sum(self.outcomes.get(outcome, 0) for outcome in ("ok", "stale"))
+        print(f"\n{sum(self.outcomes.values())} requests in {elapsed:.1f}s, {completed / elapsed:.1f} images/s")
+        print("Outcomes: " + ", ".join(f"{outcome}={count}" for outcome, count in sorted(self.outcomes.items())))
+        print("\nEnd-to-end latency")
+        for kind, values in self.latencies.items():
+            print(f"  {kind:<14} {percentiles(values)}")
+        print("\nAdmission phases")
+        for phase, values in self.phase_latencies.items():
+            print(f"  {phase:<14} {percentiles(values)}")
+        print("\nBuilder stages")
+        for name, values in sorted(self.stage_latencies.items()):
+            print(f"  {name:<14} {percentiles(values)}")
+        print("\nEvent-loop lag")
+        print(f"  {'lag':<14} {percentiles(self.loop_lags)}")
+        # ru_maxrss is in KiB on Linux
+        print(f"\nPeak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_stub(recording_path: Path, speed: float, start_offset: float) -> Tuple[subprocess.Popen, str]:
+    # The stub runs in its own process so its JSON encoding doesn't load the loop under test
+    port = free_port()
+    process = subprocess.Popen([
+        sys.executable, "-m", "tools.replay_server", "serve", str(recording_path),
+        "--speed", str(speed), "--start-offset", str(start_offset), "--port", str(port)
+    ], stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    return process, f"http://127.0.0.1:{port}/v1"
+
+
+def use_in_memory_repositories() -> None:
+    # Leave MongoDB out of the measurement: drivers always come from the stub
+    from app.services import openf1
+
+    async def find(self, query):
+        return []
+
+    async def insert(self, model):
+        return None
+
+    openf1.OpenF1DriversRepository.find = find
+    openf1.OpenF1DriversRepository.insert = insert
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    weights = {}
+    for part in mix.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in ("live_timing", "h2h"):
+            raise argparse.ArgumentTypeError(f"Unknown request kind {kind}")
+        weights[kind] = int(weight or 1)
+    return weights
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Fire synthetic interactions at the cog callbacks.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--synthetic", action="store_true", help="Serve a generated 20-driver race")
+    source.add_argument("--recording", type=Path, help="Serve a session recorded with tools.replay_server")
+    source.add_argument("--openf1-url", help="Use an already running OpenF1-compatible server")
+    parser.add_argument("--year", type=int, help="Session year, required with --openf1-url")
+    parser.add_argument("--location", help="Session location, required with --openf1-url")
+    parser.add_argument("--session-name", default="Race")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed of the stub")
+    parser.add_argument("--start-offset", type=float, default=3600.0, help="Seconds into the session the stub starts at")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("live_timing=3,h2h=1"), help="Weighted request mix, e.g. live_timing=3,h2h=1")
+    parser.add_argument("--rate", type=float, default=10.0, help="Target requests per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to generate load for")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--guilds", type=int, default=50)
+    parser.add_argument("--skip-mongo", action="store_true", help="Don't read or write drivers in MongoDB")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s [%(levelname)s] <%(name)s>: %(message)s')
+
+    stub = None
+    if args.openf1_url:
+        if args.year is None or args.location is None:
+            parser.error("--year and --location are required with --openf1-url")
+        url, year, location, session_name = args.openf1_url, args.year, args.location, args.session_name
+    else:
+        recording_path = args.recording
+        if args.synthetic:
+            recording_path = Path(tempfile.mkdtemp()) / "synthetic.json.gz"
+            with gzip.open(recording_path, "wt") as f:
+                json.dump(synthetic_recording(), f)
+        with gzip.open(recording_path, "rt") as f:
+            session = json.load(f)["sessions"][0]
+        year, location, session_name = session["year"], session["location"], session["session_name"]
+        stub, url = start_stub(recording_path, args.speed, args.start_offset)
+
+    try:
+        from app.services import openf1
+        openf1.app_config.openf1.url = url
+        if args.skip_mongo:
+            use_in_memory_repositories()
+
+        harness = LoadHarness(year, location, session_name, args.mix, args.rate, args.duration, args.users, args.guilds)
+        asyncio.run(harness.run())
+    finally:
+        if stub is not None:
+            stub.terminate()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
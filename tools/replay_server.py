@@ -0,0 +1,261 @@
+"""Record an OpenF1 session and replay it through the same REST shape.
+
+    # Record a finished session to a file
+    python -m tools.replay_server record --session-key 9158 --output data/replays/9158.json.gz
+
+    # Replay it at 10x from the start of the session
+    python -m tools.replay_server serve data/replays/9158.json.gz --speed 10 --port 8001
+
+Then point `openf1.url` in app_config.json at http://localhost:8001/v1.
+"""
+import sys
+import json
+import gzip
+import time
+import asyncio
+import hashlib
+import argparse
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Column revealing a row on the replay clock, per endpoint. Endpoints without
+# one are static, except stints which are revealed by lap.
+TIME_COLUMNS = {
+    "position": "date",
+    "intervals": "date",
+    "laps": "date_start",
+    "pit": "date",
+    "race_control": "date",
+    "team_radio": "date",
+    "location": "date",
+}
+RECORDED_ENDPOINTS = ["drivers", "position", "intervals", "laps", "stints", "pit", "race_control", "team_radio"]
+# Lap row fields published as the lap is driven, in order
+LAP_TIME_FIELDS = ["duration_sector_1", "duration_sector_2", "duration_sector_3"]
+
+
+def parse_date(date: str) -> datetime:
+    if "T" in date:
+        date = date.replace(" ", "+")   # An unescaped "+" of the UTC offset arrives as a space
+    parsed = datetime.fromisoformat(date)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+async def record(session_key: int, output: Path) -> None:
+    from app.services.openf1 import OpenF1Client
+
+    sessions = await OpenF1Client.get("sessions", {"session_key": session_key}, "session")
+    if not sessions:
+        raise SystemExit(f"Session {session_key} not found")
+    session = sessions[0]
+    meetings = await OpenF1Client.get("meetings", {"meeting_key": session["meeting_key"]}, "meeting")
+
+    recording = {"sessions": sessions, "meetings": meetings}
+    for endpoint in RECORDED_ENDPOINTS:
+        recording[endpoint] = await OpenF1Client.get(endpoint, {"session_key": session_key}, endpoint, conditional=False)
+        logger.info(f"Recorded {len(recording[endpoint])} rows from /{endpoint}")
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(output, "wt") as f:
+        json.dump(recording, f)
+    logger.info(f"Saved session {session_key} to {output}")
+
+
+class ReplayClock:
+    def __init__(self, session_start: datetime, speed: float, start_offset: float):
+        self.session_start = session_start
+        self.speed = speed
+        self.start_offset = start_offset
+        self.started_at = time.time()
+
+    def elapsed(self) -> float:
+        # Seconds of the session replayed so far
+        return self.start_offset + (time.time() - self.started_at) * self.speed
+
+    def now(self) -> datetime:
+        return self.session_start + timedelta(seconds=self.elapsed())
+
+
+class ReplayServer:
+    def __init__(self, recording: Dict[str, List[Dict[str, Any]]], speed: float, start_offset: float):
+        self.recording = recording
+        self.session = recording["sessions"][0]
+        self.clock = ReplayClock(parse_date(self.session["date_start"]), speed, start_offset)
+
+        # Rows sorted by their time column, with the parsed times kept for bisecting
+        self.timelines: Dict[str, Tuple[List[datetime], List[Dict[str, Any]]]] = {}
+        for endpoint, column in TIME_COLUMNS.items():
+            rows = sorted((row for row in recording.get(endpoint, []) if row.get(column)), key=lambda row: parse_date(row[column]))
+            self.timelines[endpoint] = ([parse_date(row[column]) for row in rows], rows)
+
+        # When each timed field of a lap row becomes known: the end of its sector, and the end of the lap.
+        # A sector after one without a time is known at the end of the lap.
+        self.lap_reveals: List[Dict[str, datetime]] = []
+        self.longest_lap = timedelta(0)
+        for date_start, row in zip(*self.timelines["laps"]):
+            reveals, elapsed = {}, 0.0
+            lap_end = date_start + timedelta(seconds=row["lap_duration"]) if row.get("lap_duration") else None
+            for field in LAP_TIME_FIELDS:
+                if elapsed is not None and row.get(field) is not None:
+                    elapsed += row[field]
+                    reveals[field] = date_start + timedelta(seconds=elapsed)
+                else:
+                    elapsed = None
+                    reveals[field] = lap_end
+            reveals["lap_duration"] = lap_end
+            self.lap_reveals.append(reveals)
+            if lap_end:
+                self.longest_lap = max(self.longest_lap, lap_end - date_start)
+
+    def revealed(self, endpoint: str) -> List[Dict[str, Any]]:
+        if endpoint == "laps":
+            return self.revealed_laps()
+        if endpoint in self.timelines:
+            times, rows = self.timelines[endpoint]
+            return rows[:bisect_right(times, self.clock.now())]
+        if endpoint == "stints":
+            return self.revealed_stints()
+        if endpoint == "sessions":
+            return [self.live_session()]
+        return self.recording.get(endpoint, [])
+
+    def revealed_laps(self) -> List[Dict[str, Any]]:
+        # Laps appear at their start, with their sector and lap times only once driven
+        now = self.clock.now()
+        times, rows = self.timelines["laps"]
+        rows = rows[:bisect_right(times, now)]
+        # Only laps started within the longest lap can still be running
+        first_running = bisect_right(times, now - self.longest_lap) - 1
+        for i in range(max(first_running, 0), len(rows)):
+            reveals = self.lap_reveals[i]
+            hidden = [field for field, revealed_at in reveals.items() if rows[i].get(field) is not None and (revealed_at is None or revealed_at > now)]
+            if hidden:
+                rows[i] = {**rows[i], **{field: None for field in hidden}}
+        return rows
+
+    def revealed_stints(self) -> List[Dict[str, Any]]:
+        # Stints have no timestamp, reveal them up to each driver's current lap
+        current_laps: Dict[int, int] = {}
+        for lap in self.revealed("laps"):
+            current_laps[lap["driver_number"]] = max(current_laps.get(lap["driver_number"], 0), lap["lap_number"])
+
+        stints = []
+        for stint in self.recording.get("stints", []):
+            current_lap = current_laps.get(stint["driver_number"])
+            if current_lap is None or stint["lap_start"] > current_lap:
+                continue
+            stints.append({**stint, "lap_end": min(stint["lap_end"] or current_lap, current_lap)})
+        return stints
+
+    def live_session(self) -> Dict[str, Any]:
+        # Shift the session onto the wall clock so the bot sees it as live
+        session_start = datetime.now(timezone.utc) - timedelta(seconds=self.clock.elapsed() / self.clock.speed)
+        duration = parse_date(self.session["date_end"]) - parse_date(self.session["date_start"])
+        return {
+            **self.session,
+            "date_start": session_start.isoformat(),
+            "date_end": (session_start + duration / self.clock.speed).isoformat(),
+        }
+
+    @staticmethod
+    def parse_filters(query) -> List[Tuple[str, str, str]]:
+        # OpenF1 filters: "field=value", "field>=value" (parsed as key "field>"),
+        # and "field>value" (parsed as key "field>value" with an empty value)
+        filters = []
+        for key, value in query.items():
+            if key.endswith(">") or key.endswith("<"):
+                filters.append((key[:-1], key[-1] + "=", value))
+            elif ">" in key or "<" in key:
+                op = ">" if ">" in key else "<"
+                field, value = key.split(op, 1)
+                filters.append((field, op, value))
+            else:
+                filters.append((key, "=", value))
+        return filters
+
+    @staticmethod
+    def matches(row: Dict[str, Any], field: str, op: str, value: str) -> bool:
+        actual = row.get(field)
+        if actual is None:
+            return False
+        if field.startswith("date"):
+            actual, value = parse_date(actual), parse_date(value)
+        elif isinstance(actual, (int, float)) and not isinstance(actual, bool):
+            try:
+                value = float(value)
+            except ValueError:
+                return False
+        else:
+            actual = str(actual)
+        if op == "=":
+            return actual == value
+        if op == ">=":
+            return actual >= value
+        if op == "<=":
+            return actual <= value
+        if op == ">":
+            return actual > value
+        return actual < value
+
+    async def handle(self, request: web.Request) -> web.Response:
+        endpoint = request.match_info["endpoint"]
+        rows = self.revealed(endpoint)
+        filters = self.parse_filters(request.query)
+        rows = [row for row in rows if all(self.matches(row, *f) for f in filters)]
+
+        body = json.dumps(rows).encode()
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        response = web.Response(body=body, content_type="application/json", headers={"ETag": etag})
+        response.enable_compression()
+        return response
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/v1/{endpoint}", self.handle)
+        return app
+
+
+def load_recording(path: Path) -> Dict[str, List[Dict[str, Any]]]:
+    with gzip.open(path, "rt") as f:
+        return json.load(f)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Record OpenF1 sessions and replay them at accelerated speed.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record", help="Record a session from OpenF1")
+    record_parser.add_argument("--session-key", type=int, required=True)
+    record_parser.add_argument("--output", type=Path, required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Replay a recorded session")
+    serve_parser.add_argument("recording", type=Path)
+    serve_parser.add_argument("--speed", type=float, default=1.0, help="Replay speed, from 1x to 50x")
+    serve_parser.add_argument("--start-offset", type=float, default=0.0, help="Seconds into the session to start from")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8001)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] <%(name)s>: %(message)s')
+
+    if args.command == "record":
+        asyncio.run(record(args.session_key, args.output))
+    else:
+        if not 1 <= args.speed <= 50:
+            parser.error("--speed must be between 1 and 50")
+        server = ReplayServer(load_recording(args.recording), args.speed, args.start_offset)
+        logger.info(f"Replaying session {server.session['session_key']} at {args.speed}x on http://{args.host}:{args.port}/v1")
+        web.run_app(server.make_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
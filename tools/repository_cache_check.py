@@ -0,0 +1,133 @@
+"""Check the repository cache against a MongoDB replica set.
+
+    # Single-node replica set on port 37018
+    docker compose --profile test up -d mongodb-rs
+    python -m tools.repository_cache_check --uri "mongodb://localhost:37018/?directConnection=true"
+
+Runs the drivers and locations repositories against a scratch database and
+checks that repeated lookups are served from memory, that writes through the
+repositories invalidate exactly the queries they touch, and that writes made
+by another client are picked up through the change stream.
+"""
+import sys
+import time
+import asyncio
+import argparse
+from typing import List, Optional
+
+from pymongo import AsyncMongoClient
+
+import logging
+logger = logging.getLogger(__name__)
+
+DATABASE = "f1_discord_app_cache_check"
+
+
+def driver(driver_number: int, location: str = "Monza"):
+    from app.services.models import Driver
+    return Driver(
+        session_key=9000, year=2025, location=location, session_name="Race", driver_number=driver_number,
+        name_acronym=f"D{driver_number:02d}", team_colour="FFFFFF", team_name="Team"
+    )
+
+
+def location(meeting_key: int, year: int, name: str):
+    from app.services.models import Location
+    return Location(year=year, meeting_key=meeting_key, meeting_name=f"{name} Grand Prix", location=name, date_start=f"{year}-01-{meeting_key % 28 + 1:02d}T13:00:00+00:00")
+
+
+async def wait_for(predicate, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        await asyncio.sleep(0.05)
+    return predicate()
+
+
+async def run(uri: str, timeout: float) -> List[str]:
+    from app.services.openf1 import OpenF1DriversRepository, OpenF1LocationsRepository
+    from app.services.repository_cache import repository_cache
+
+    failures = []
+
+    def check(name: str, ok: bool) -> None:
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+        if not ok:
+            failures.append(name)
+
+    client, other = AsyncMongoClient(uri), AsyncMongoClient(uri)
+    await client.drop_database(DATABASE)
+    db = client[DATABASE]
+    await db.create_collection("drivers")
+    await db.create_collection("locations")
+    drivers, locations = OpenF1DriversRepository(db), OpenF1LocationsRepository(db)
+    repository_cache.clear()
+    repository_cache.start_watching(db, ["drivers", "locations"])
+    await asyncio.sleep(1)   # Let the change stream open before anything is written
+
+    try:
+        monza = {"year": 2025, "location": "Monza", "session_name": "Race"}
+        spa = {"year": 2025, "location": "Spa", "session_name": "Race"}
+        await drivers.insert(driver(1))
+        await drivers.insert(driver(44, "Spa"))
+
+        first = await drivers.find(monza)
+        hits = repository_cache.hits
+        second = await drivers.find(monza)
+        check("repeated lookup is served from memory", repository_cache.hits == hits + 1 and second == first)
+        second.clear()
+        check("returned lists don't share the cached one", len(await drivers.find(monza)) == 1)
+
+        start = time.perf_counter()
+        for _ in range(10000):
+            await drivers.find(monza)
+        print(f"     hot lookup: {(time.perf_counter() - start) / 10000 * 1e6:.1f} us")
+
+        await drivers.find(spa)
+        await drivers.insert(driver(16))
+        check("insert invalidates the matching query", len(await drivers.find(monza)) == 2)
+        hits = repository_cache.hits
+        await drivers.find(spa)
+        check("insert keeps unrelated queries", repository_cache.hits == hits + 1)
+
+        await locations.insert(location(1, 2025, "Monza"))
+        await locations.find({"year": 2025})
+        await locations.find({"year": 2026})
+        await locations.upsert(location(1, 2026, "Monza"))
+        check("upsert invalidates the query the document left", len(await locations.find({"year": 2025})) == 0)
+        check("upsert invalidates the query the document joined", len(await locations.find({"year": 2026})) == 1)
+
+        # Writes from another client only reach this process through the change stream
+        await drivers.find(monza)
+        await other[DATABASE]["drivers"].insert_one(driver(63).model_dump())
+        check("insert by another client invalidates", await wait_for(lambda: repository_cache.get("drivers", monza) is None, timeout))
+        await drivers.find(monza)
+        await other[DATABASE]["drivers"].update_one({"driver_number": 63}, {"$set": {"location": "Spa"}})
+        check("update by another client invalidates the query the document left", await wait_for(lambda: repository_cache.get("drivers", monza) is None, timeout))
+        check("and the one it joined", len(await drivers.find(spa)) == 2)
+        await locations.find({"year": 2026})
+        await other[DATABASE]["locations"].delete_one({"meeting_key": 1})
+        check("delete by another client invalidates", await wait_for(lambda: repository_cache.get("locations", {"year": 2026}) is None, timeout))
+    finally:
+        await client.drop_database(DATABASE)
+        await client.close()
+        await other.close()
+    repository_cache.log_stats()
+    return failures
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Check the repository cache against a MongoDB replica set.")
+    parser.add_argument("--uri", default="mongodb://localhost:37018/?directConnection=true", help="Connection string of a replica set member")
+    parser.add_argument("--timeout", type=float, default=5.0, help="Seconds to wait for a change event")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    failures = asyncio.run(run(args.uri, args.timeout))
+    print(f"{len(failures)} checks failed" if failures else "All checks passed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()